@@ -0,0 +1,51 @@
+"""
+Compara el embedding de consultas una por una contra el micro-batcher
+
+Uso (desde backend/):
+    python -m benchmarks.embedding_batcher_bench --hilos 8 --consultas 200
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.embedding_batcher import EmbeddingBatcher
+from utils.embeddings import get_embedding_function
+
+CONSULTAS = [
+    "cómo cambio de médico de cabecera",
+    "necesito la credencial de afiliado",
+    "asignación familiar por cónyuge",
+    "quiero pedir un turno",
+    "cómo consigo medicamentos gratis",
+    "reintegro de gastos de sepelio",
+    "afiliar a un familiar a cargo",
+    "dónde tramito la receta electrónica",
+]
+
+def medir(nombre: str, embed, hilos: int, total: int):
+    consultas = [CONSULTAS[i % len(CONSULTAS)] + f" {i}" for i in range(total)]
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        list(pool.map(embed, consultas))
+    segundos = time.perf_counter() - inicio
+    print(f"{nombre:<12} {total / segundos:8.1f} consultas/s  ({segundos:.2f} s)")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hilos", type=int, default=8)
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--max-lote", type=int, default=16)
+    parser.add_argument("--max-espera-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    embedding_function = get_embedding_function()
+    embedding_function(["calentamiento"])
+
+    medir("individual", lambda q: embedding_function([q])[0], args.hilos, args.consultas)
+
+    batcher = EmbeddingBatcher(lambda: embedding_function, args.max_lote, args.max_espera_ms)
+    medir("batcher", batcher.embed, args.hilos, args.consultas)
+    print(batcher.stats())
+
+if __name__ == "__main__":
+    main()
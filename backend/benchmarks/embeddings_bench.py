@@ -0,0 +1,54 @@
+"""
+Mide embeddings/segundo de cada backend de utils/embeddings.py en esta máquina
+
+Uso (desde backend/):
+    python -m benchmarks.embeddings_bench --backends onnx onnx-int8 sentence-transformers
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.embeddings import BACKENDS, LazyEmbeddingFunction
+
+TEXTOS = [
+    "Cambio de médico de cabecera. Los afiliados pueden elegir o cambiar su médico de cabecera.",
+    "Credencial de afiliado. Cómo obtener la credencial digital o física de PAMI.",
+    "Asignación familiar por cónyuge. Requisitos y documentación para solicitarla.",
+    "Medicamentos gratis por razones sociales. Cómo pedir la cobertura del 100%.",
+]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["onnx", "onnx-int8"], choices=list(BACKENDS))
+    parser.add_argument("--textos", type=int, default=256)
+    parser.add_argument("--lote", type=int, default=32)
+    args = parser.parse_args()
+
+    textos = [TEXTOS[i % len(TEXTOS)] + f" {i}" for i in range(args.textos)]
+    referencia = None
+
+    for backend in args.backends:
+        embedder = LazyEmbeddingFunction(backend)
+
+        inicio = time.perf_counter()
+        embedder(["calentamiento"])
+        carga = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        vectores = []
+        for i in range(0, len(textos), args.lote):
+            vectores.extend(embedder(textos[i:i + args.lote]))
+        segundos = time.perf_counter() - inicio
+
+        vectores = np.array(vectores)
+        linea = f"{backend:<22} {len(textos) / segundos:8.1f} emb/s  carga {carga:.1f} s  dim {vectores.shape[1]}"
+        if referencia is not None and referencia.shape == vectores.shape:
+            similitud = float(np.mean(np.sum(referencia * vectores, axis=1)))
+            linea += f"  coseno vs {args.backends[0]}: {similitud:.4f}"
+        else:
+            referencia = vectores
+        print(linea)
+
+if __name__ == "__main__":
+    main()
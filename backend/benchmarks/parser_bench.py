@@ -0,0 +1,110 @@
+"""
+Compara el parser de una pasada (lxml) contra el original con BeautifulSoup
+
+Usa como fixtures las páginas guardadas en la caché HTTP del scraper (o un
+directorio con archivos .html) y verifica que los dos den el mismo JSON. Sin
+fixtures arma una página sintética con la estructura de las de PAMI.
+
+Uso (desde backend/):
+    python -m benchmarks.parser_bench
+    python -m benchmarks.parser_bench --html-dir paginas/ --repeticiones 20
+    python -m benchmarks.parser_bench --secciones 400
+    python -m benchmarks.parser_bench --procesos 4
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.http_cache import HTTP_CACHE_DIR
+from utils.scraper import parsear_tramite, parsear_tramite_bs4, parsear_tramite_lxml
+
+URL_SINTETICA = "https://www.pami.org.ar/tramite/sintetico"
+
+def cargar_fixtures(cache_dir: str, html_dir: str):
+    paginas = []
+    for ruta in sorted(glob.glob(os.path.join(cache_dir, "*.json"))):
+        with open(ruta, "r", encoding="utf-8") as f:
+            entrada = json.load(f)
+        paginas.append((entrada["url"], entrada["body"]))
+    if html_dir:
+        for ruta in sorted(glob.glob(os.path.join(html_dir, "*.html"))):
+            with open(ruta, "r", encoding="utf-8") as f:
+                nombre = os.path.splitext(os.path.basename(ruta))[0]
+                paginas.append((f"https://www.pami.org.ar/tramite/{nombre}", f.read()))
+    return paginas
+
+def pagina_sintetica(secciones: int) -> str:
+    relleno = "".join(
+        f"<div><p>Paso {i}: presentarse con <strong>DNI</strong> en la "
+        f"<a href=\"/agencias\">agencia</a> más cercana.</p><span>Nota {i}</span></div>"
+        for i in range(secciones)
+    )
+    return (
+        "<html><body><main>"
+        "<h2>Cambio de <b>médico</b> de cabecera</h2>"
+        "<p>Podés cambiar de médico de cabecera <span>una vez</span> por año.</p>"
+        "<h3>¿Quién puede realizar el trámite?</h3>"
+        "<p>La persona <strong>afiliada</strong> o un <a href=\"/apoderados\">apoderado</a>.</p>"
+        "<h3>¿Qué documentación se necesita?</h3>"
+        "<ul><li>DNI</li><li>Credencial de <b>afiliación</b></li></ul>"
+        "<h3>¿Dónde puedo realizar el trámite?</h3>"
+        f"{relleno}"
+        "<h5>Última actualización</h5>"
+        "</main></body></html>"
+    )
+
+def medir(nombre: str, parsear, paginas, repeticiones: int) -> float:
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for url, html in paginas:
+            parsear(html, url)
+    segundos = time.perf_counter() - inicio
+    por_segundo = len(paginas) * repeticiones / segundos
+    print(f"{nombre:<6} {por_segundo:10.1f} páginas/s")
+    return por_segundo
+
+def medir_pool(procesos: int, paginas, repeticiones: int):
+    """Throughput del parser configurado repartiendo las páginas en procesos, como el scrape masivo"""
+    tareas = paginas * repeticiones
+    with ProcessPoolExecutor(procesos, mp_context=multiprocessing.get_context("spawn")) as pool:
+        list(pool.map(parsear_tramite, *zip(*paginas)))
+        inicio = time.perf_counter()
+        list(pool.map(parsear_tramite, [html for _, html in tareas], [url for url, _ in tareas], chunksize=1))
+        segundos = time.perf_counter() - inicio
+    print(f"{procesos} procesos {len(tareas) / segundos:10.1f} páginas/s")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache-dir", default=HTTP_CACHE_DIR)
+    parser.add_argument("--html-dir", default="")
+    parser.add_argument("--secciones", type=int, default=50, help="Párrafos de la página sintética")
+    parser.add_argument("--repeticiones", type=int, default=10)
+    parser.add_argument("--procesos", type=int, default=0, help="Medir además el pool de procesos")
+    args = parser.parse_args()
+
+    paginas = cargar_fixtures(args.cache_dir, args.html_dir)
+    if not paginas:
+        print(f"Sin fixtures en {args.cache_dir}: se usa una página sintética con {args.secciones} párrafos")
+        paginas = [(URL_SINTETICA, pagina_sintetica(args.secciones))]
+
+    distintas = [
+        url for url, html in paginas
+        if parsear_tramite_bs4(html, url) != parsear_tramite_lxml(html, url)
+    ]
+    print(f"{len(paginas) - len(distintas)}/{len(paginas)} páginas con el mismo JSON en los dos parsers")
+    for url in distintas:
+        print(f"  ❌ {url}")
+
+    bs4 = medir("bs4", parsear_tramite_bs4, paginas, args.repeticiones)
+    lxml = medir("lxml", parsear_tramite_lxml, paginas, args.repeticiones)
+    print(f"lxml es {lxml / bs4:.1f}x más rápido")
+
+    if args.procesos:
+        medir_pool(args.procesos, paginas, args.repeticiones)
+
+if __name__ == "__main__":
+    main()
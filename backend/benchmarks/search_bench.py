@@ -0,0 +1,67 @@
+"""
+Compara la búsqueda en ChromaDB contra el índice exacto en memoria (SEARCH_ENGINE=numpy)
+
+Usa embeddings aleatorios, así que no hace falta descargar ningún modelo.
+
+Uso (desde backend/):
+    python -m benchmarks.search_bench --tramites 500 --consultas 2000
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db.connection import Base
+from utils import payload_store, vector_store
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tramites", type=int, default=500)
+    parser.add_argument("--consultas", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--n-results", type=int, default=3)
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp()
+    vector_store.CHROMA_PATH = carpeta
+    vector_store.ESTADO_PATH = f"{carpeta}/estado.json"
+    engine = create_engine(f"sqlite:///{carpeta}/bench.db")
+    Base.metadata.create_all(bind=engine)
+    payload_store.SessionLocal = sessionmaker(bind=engine)
+
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(args.tramites, args.dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    collection = vector_store.get_or_create_collection()
+    for inicio in range(0, args.tramites, 500):
+        ids = [f"tramite-{i}" for i in range(inicio, min(inicio + 500, args.tramites))]
+        payload_store.guardar_payloads(collection.name, [{"id": i, "titulo": i} for i in ids])
+        collection.add(
+            ids=ids,
+            embeddings=embeddings[inicio:inicio + len(ids)].tolist()
+        )
+
+    consultas = rng.normal(size=(args.consultas, args.dim)).astype(np.float32)
+    consultas /= np.linalg.norm(consultas, axis=1, keepdims=True)
+    consultas = consultas.tolist()
+
+    resultados = {}
+    for motor, buscar in (("chroma", vector_store._buscar_chroma), ("numpy", vector_store._buscar_numpy)):
+        buscar(consultas[0], args.n_results)
+        inicio = time.perf_counter()
+        resultados[motor] = [buscar(q, args.n_results) for q in consultas]
+        segundos = time.perf_counter() - inicio
+        print(f"{motor:<8} {segundos / len(consultas) * 1e6:10.1f} µs/consulta")
+
+    coinciden = sum(
+        a[0][0]["id"] == b[0][0]["id"]
+        for a, b in zip(resultados["chroma"], resultados["numpy"])
+    )
+    print(f"top-1 igual en {coinciden}/{len(consultas)} consultas (HNSW es aproximado)")
+
+if __name__ == "__main__":
+    main()
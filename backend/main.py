@@ -1,9 +1,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from db.connection import engine, Base
-from models import user, role, feedback
+from models import user, role, feedback, tramite_payload, job, conversacion
 from db.init_data import create_initial_data
-from routes import auth, admin, chat, scraping, tramites_urls, feedback
+from routes import auth, admin, chat, scraping, tramites_urls, feedback, metrics, jobs
+from utils.ollama_client import close_ollama_client
+from utils.executor import shutdown_executor
+from utils.scraper import close_scraper_client
+from utils.jobs import iniciar_jobs, detener_jobs
+from utils.context import cerrar_historial
 
 # Crear las tablas
 Base.metadata.create_all(bind=engine)
@@ -31,6 +36,22 @@ app.include_router(chat.router)
 app.include_router(scraping.router)
 app.include_router(tramites_urls.router)
 app.include_router(feedback.router)
+app.include_router(metrics.router)
+app.include_router(jobs.router)
+
+@app.on_event("startup")
+async def startup():
+    # Retoma los jobs que quedaron a medias (p. ej. por un reinicio)
+    iniciar_jobs()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await detener_jobs()
+    # Los mensajes de chat que quedaron sin escribir
+    cerrar_historial()
+    await close_ollama_client()
+    await close_scraper_client()
+    shutdown_executor()
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy.sql import func
+from db.connection import Base
+
+class Conversacion(Base):
+    """Conversación con el asistente de cada usuario (compartida entre workers)"""
+    __tablename__ = "conversacion"
+
+    id_usuario = Column(Integer, primary_key=True)
+    nombre = Column(String(50), nullable=True)
+    apellido = Column(String(50), nullable=True)
+    # Se incrementa con cada escritura: los workers comparan la versión de su
+    # caché contra esta para saber si otro proceso agregó mensajes
+    version = Column(Integer, nullable=False, default=0)
+    actualizado = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class MensajeConversacion(Base):
+    __tablename__ = "mensaje_conversacion"
+
+    id_mensaje = Column(Integer, primary_key=True, autoincrement=True)
+    id_usuario = Column(Integer, nullable=False, index=True)
+    # user | assistant
+    rol = Column(String(20), nullable=False)
+    contenido = Column(Text, nullable=False)
+    fecha_creacion = Column(DateTime, server_default=func.now())
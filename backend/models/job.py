@@ -0,0 +1,29 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy.sql import func
+from db.connection import Base
+
+class Job(Base):
+    """Operación larga de administración que corre en segundo plano (p. ej. scrape-all)"""
+    __tablename__ = "job"
+
+    id = Column(String(32), primary_key=True)
+    tipo = Column(String(50), nullable=False, index=True)
+    # pendiente | en_curso | completado | fallido
+    estado = Column(String(20), nullable=False, index=True)
+    # JSON con los parámetros con los que se lanzó
+    parametros = Column(Text, nullable=False, default="{}")
+    # JSON con lo necesario para retomar el job donde quedó
+    checkpoint = Column(Text, nullable=False, default="{}")
+    # JSON con el avance por etapa
+    progreso = Column(Text, nullable=False, default="{}")
+    resultado = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    # Proceso que lo está ejecutando y su último latido
+    worker = Column(String(100), nullable=True)
+    latido = Column(DateTime, nullable=True)
+    # Veces que se cayó a mitad de camino (latido vencido); soltarlo en un
+    # shutdown ordenado no cuenta
+    intentos = Column(Integer, nullable=False, default=0)
+    creado = Column(DateTime, server_default=func.now())
+    iniciado = Column(DateTime, nullable=True)
+    terminado = Column(DateTime, nullable=True)
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, String, DateTime, LargeBinary
+from sqlalchemy.sql import func
+from db.connection import Base
+
+class TramitePayload(Base):
+    """JSON completo de cada trámite, separado del índice vectorial"""
+    __tablename__ = "tramite_payload"
+    
+    coleccion = Column(String(100), primary_key=True)
+    tramite_id = Column(String(255), primary_key=True)
+    # JSON del trámite comprimido con zlib
+    datos = Column(LargeBinary, nullable=False)
+    actualizado = Column(DateTime, server_default=func.now(), onupdate=func.now())
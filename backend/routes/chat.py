@@ -1,14 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+import asyncio
+import json
+import time
 from schemas.chat import ChatMessage, ChatResponse
 from utils.security import get_current_user
 from utils.context import (
     initialize_user_context, 
-    get_user_context,
+    obtener_contexto,
     add_message,
     format_history_for_prompt
 )
-from utils.rag import generar_respuesta_con_rag
+from utils.rag import generar_respuesta_con_rag, generar_respuesta_con_rag_stream, olvidar_conversacion
 from models.user import Usuario
 from db.connection import get_db
 
@@ -28,30 +32,121 @@ async def procesar_consulta(
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
-    if not get_user_context(user_id):
+    # Única consulta de la versión del historial en la base en todo el request
+    if not await obtener_contexto(user_id):
         initialize_user_context(user_id, usuario.primer_nombre, usuario.apellido)
     
+    # El historial son los turnos anteriores: la consulta actual ya va en el prompt
+    historial = format_history_for_prompt(user_id)
     add_message(user_id, "user", mensaje.mensaje)
     
     try:
-        historial = format_history_for_prompt(user_id)
-        
-        respuesta_ia = await generar_respuesta_con_rag(
+        resultado = await generar_respuesta_con_rag(
             consulta=mensaje.mensaje,
             nombre_usuario=usuario.primer_nombre,
-            historial=historial
+            historial=historial,
+            user_id=user_id
         )
+        respuesta_ia = resultado["respuesta"]
         
         add_message(user_id, "assistant", respuesta_ia)
         
         return ChatResponse(
             respuesta=respuesta_ia,
-            contexto_id=str(user_id)
+            contexto_id=str(user_id),
+            origen=resultado["origen"]
         )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
     
+def _evento_sse(evento: str, datos: dict) -> str:
+    """Serializa un evento en formato Server-Sent Events"""
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+@router.post("/consulta/stream")
+async def procesar_consulta_stream(
+    mensaje: ChatMessage,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Igual que /consulta pero envía la respuesta por Server-Sent Events a medida que se genera
+    
+    Eventos:
+    - token: {"texto": "..."} por cada fragmento generado
+    - fin: {"respuesta", "contexto_id", "origen", "tiempo_primer_token_ms", "tiempo_total_ms"}
+    - error: {"detail": "..."} si la generación falla, aunque ya se hayan
+      enviado tokens (en ese caso no hay evento fin)
+    """
+    
+    user_id = current_user.get("user_id")
+    
+    usuario = db.query(Usuario).filter(Usuario.id_usuario == user_id).first()
+    if not usuario:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    
+    if not await obtener_contexto(user_id):
+        initialize_user_context(user_id, usuario.primer_nombre, usuario.apellido)
+    
+    historial = format_history_for_prompt(user_id)
+    add_message(user_id, "user", mensaje.mensaje)
+    
+    nombre_usuario = usuario.primer_nombre
+    
+    async def eventos():
+        inicio = time.perf_counter()
+        tiempo_primer_token_ms = None
+        fragmentos = []
+        info = {}
+        
+        try:
+            async for fragmento in generar_respuesta_con_rag_stream(
+                consulta=mensaje.mensaje,
+                nombre_usuario=nombre_usuario,
+                historial=historial,
+                info=info,
+                user_id=user_id
+            ):
+                if tiempo_primer_token_ms is None:
+                    tiempo_primer_token_ms = (time.perf_counter() - inicio) * 1000
+                
+                fragmentos.append(fragmento)
+                yield _evento_sse("token", {"texto": fragmento})
+                
+        except Exception as e:
+            yield _evento_sse("error", {"detail": f"Error interno: {str(e)}"})
+            return
+        
+        if info.get("error"):
+            # Ollama falló o cortó la respuesta: lo parcial no va al historial
+            yield _evento_sse("error", {"detail": info["error"]})
+            return
+        
+        respuesta_ia = "".join(fragmentos)
+        add_message(user_id, "assistant", respuesta_ia)
+        
+        tiempo_total_ms = (time.perf_counter() - inicio) * 1000
+        print(f"⏱️ Consulta streaming: primer token {tiempo_primer_token_ms or 0:.0f} ms, total {tiempo_total_ms:.0f} ms")
+        
+        yield _evento_sse("fin", {
+            "respuesta": respuesta_ia,
+            "contexto_id": str(user_id),
+            "origen": info.get("origen"),
+            "tiempo_primer_token_ms": round(tiempo_primer_token_ms, 1) if tiempo_primer_token_ms is not None else None,
+            "tiempo_total_ms": round(tiempo_total_ms, 1)
+        })
+    
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Evita que un proxy (nginx) acumule la respuesta antes de enviarla
+            "X-Accel-Buffering": "no"
+        }
+    )
+    
 @router.delete("/contexto")
 async def limpiar_contexto(
     current_user: dict = Depends(get_current_user)
@@ -60,6 +155,7 @@ async def limpiar_contexto(
     from utils.context import clear_context
     
     user_id = current_user.get("user_id")
-    clear_context(user_id)
+    await asyncio.to_thread(clear_context, user_id)
+    olvidar_conversacion(user_id)
     
     return {"message": "Contexto limpiado exitosamente"}
\ No newline at end of file
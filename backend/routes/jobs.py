@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from utils.security import require_role
+from utils.jobs import obtener_job, listar_jobs
+
+router = APIRouter(prefix="/admin", tags=["Admin"])
+
+@router.get("/jobs")
+def get_jobs(
+    limite: int = 20,
+    admin = Depends(require_role("administrador"))
+):
+    """Últimos jobs de administración, del más nuevo al más viejo (solo admin)"""
+    return listar_jobs(limite)
+
+@router.get("/jobs/{job_id}")
+def get_job(
+    job_id: str,
+    admin = Depends(require_role("administrador"))
+):
+    """
+    Estado de un job (solo admin)
+    
+    - estado: pendiente, en_curso, completado o fallido
+    - progreso: total, completados y ok/errores de cada etapa
+    - throughput_por_minuto y eta_segundos mientras está en curso
+    - resultado cuando termina (para scrape-all, el ScrapingAllResponse)
+    """
+    job = obtener_job(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job '{job_id}' no encontrado"
+        )
+    
+    # El checkpoint es interno (lista de URLs procesadas, totales parciales)
+    checkpoint = job.pop("checkpoint")
+    job["coleccion"] = checkpoint.get("coleccion")
+    return job
@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Depends
+
+from utils.security import require_role
+from utils.answer_cache import answer_cache
+from utils.ollama_client import get_ollama_stats
+from utils.executor import get_executor_stats
+from utils.vector_store import embedding_batcher, numpy_index, SEARCH_ENGINE
+from utils.http_cache import get_http_cache_stats
+from utils.session_store import get_session_stores_stats
+from utils.context import get_historial_stats
+from utils.rag import get_retrieval_stats
+
+router = APIRouter(prefix="/admin", tags=["Admin"])
+
+@router.get("/metricas")
+def get_metricas(
+    admin = Depends(require_role("administrador"))
+):
+    """
+    Métricas internas del asistente (solo admin)
+    
+    - answer_cache: hits/misses/evictions del cache de respuestas
+    - ollama: generaciones en curso y en espera por backend
+    - vector_store_pool: cola y espera del pool de hilos de la base vectorial
+    - embedding_batcher: tamaño de lote y throughput del embedding de consultas
+    - busqueda: motor configurado y estado del índice en memoria
+    - http_cache: lecturas y escrituras de la caché de páginas del scraper
+    - sesiones: tamaño y evictions (LRU, inactividad, memoria) de cada store de sesiones
+    - historial: recargas desde la base y escrituras por lotes del historial de chat
+    - retrieval: turnos con el trámite de la búsqueda vs. con el del turno
+      anterior (la búsqueda corre igual en los dos), y tokens de prompt
+      evaluados por Ollama con y sin su context de la sesión
+    """
+    return {
+        "answer_cache": answer_cache.stats(),
+        "ollama": get_ollama_stats(),
+        "vector_store_pool": get_executor_stats(),
+        "embedding_batcher": embedding_batcher.stats(),
+        "busqueda": {"motor": SEARCH_ENGINE, "indice_numpy": numpy_index.stats()},
+        "http_cache": get_http_cache_stats(),
+        "sesiones": get_session_stores_stats(),
+        "historial": get_historial_stats(),
+        "retrieval": get_retrieval_stats()
+    }
@@ -1,18 +1,45 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, HttpUrl
-from typing import List
+from typing import Dict, List, Literal, Optional
 
 from db.connection import get_db
-from utils.scraper import scrape_tramite, scrape_and_generate_keywords
-from utils.vector_store import add_tramite, delete_tramite, get_collection_count
+from utils.scraper import (
+    scrape_tramite_async,
+    load_tramites_urls,
+    extract_id_from_url
+)
+from utils.pipeline import ejecutar_pipeline, nuevo_resumen
+from utils.keywords import KEYWORDS_MODO
+from utils.jobs import JobActivo, JobContext, registrar_tipo, crear_job
+from utils.vector_store import (
+    delete_tramites,
+    get_indice_tramites,
+    crear_coleccion_nueva,
+    activar_coleccion,
+    eliminar_coleccion,
+    rollback_coleccion,
+    get_active_collection_name,
+    get_estado_colecciones
+)
 from utils.security import require_role
+from utils.executor import run_blocking
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
 class ScrapingRequest(BaseModel):
     url: HttpUrl
 
+class UrlTiming(BaseModel):
+    url: str
+    ok: bool
+    fetch_ms: float
+    parse_ms: float
+    intentos: int
+    cache: Optional[str] = None
+    error: Optional[str] = None
+
 class ScrapingAllResponse(BaseModel):
     success: bool
     total_urls: int
@@ -21,9 +48,14 @@ class ScrapingAllResponse(BaseModel):
     keywords_generated: int
     inserted_to_db: int
     errors: List[str]
+    coleccion: Optional[str] = None
+    changed: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    timings: List[UrlTiming] = []
 
 @router.post("/scrape-url")
-def scrape_single_url(
+async def scrape_single_url(
     request: ScrapingRequest,
     admin = Depends(require_role("administrador"))
 ):
@@ -39,7 +71,7 @@ def scrape_single_url(
     """
     try:
         url_str = str(request.url)
-        tramite = scrape_tramite(url_str)
+        tramite = await scrape_tramite_async(url_str)
         
         if not tramite:
             raise HTTPException(
@@ -49,96 +81,185 @@ def scrape_single_url(
         
         return tramite
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error scrapeando: {str(e)}"
         )
 
-@router.post("/scrape-all", response_model=ScrapingAllResponse)
+class JobCreado(BaseModel):
+    job_id: str
+    estado: str
+
+async def ejecutar_scrape_all(job: JobContext) -> Dict:
+    """
+    Job de scrape-all (ver utils/jobs.py). Guarda en el checkpoint las URLs ya
+    terminadas, los totales y la colección nueva del modo completo, así al
+    retomarse después de un reinicio sigue desde ahí.
+    """
+    modo = job.parametros.get("modo", "incremental")
+    keywords_modo = job.parametros.get("keywords_modo", KEYWORDS_MODO)
+    print(f"📋 Iniciando scraping completo (modo {modo}, keywords {keywords_modo})...")
+    urls = load_tramites_urls()
+    if not urls:
+        return jsonable_encoder(ScrapingAllResponse(
+            success=False,
+            total_urls=0,
+            scraped=0,
+            failed=0,
+            keywords_generated=0,
+            inserted_to_db=0,
+            errors=["No hay URLs configuradas"]
+        ))
+    
+    checkpoint = job.checkpoint
+    resumen = checkpoint.setdefault("resumen", nuevo_resumen())
+    procesadas = checkpoint.setdefault("procesadas", [])
+    ya_procesadas = set(procesadas)
+    pendientes = [url for url in urls if url not in ya_procesadas]
+    
+    job.progreso["total"] = len(urls)
+    job.progreso["completados"] = len(urls) - len(pendientes)
+    etapas = job.progreso.setdefault("etapas", {})
+    if ya_procesadas:
+        print(f"🔁 Retomando: {len(ya_procesadas)} URLs ya procesadas, faltan {len(pendientes)}")
+    
+    def al_terminar(terminadas: List[str]):
+        procesadas.extend(terminadas)
+        job.avanzar(len(terminadas))
+    
+    # Solo hash y keywords: el trámite completo se lee en el pipeline si hace falta
+    existentes = await run_blocking(get_indice_tramites)
+    ids_configurados = {extract_id_from_url(url) for url in urls}
+    # Solo se borran los trámites cuya URL ya no está configurada, no los que fallaron al scrapear
+    removidos = [tramite_id for tramite_id in existentes if tramite_id not in ids_configurados]
+    
+    # En modo completo los removidos simplemente no pasan a la colección nueva
+    eliminados = len(removidos)
+    if modo == "completo":
+        # Todo va a una colección nueva que se activa al terminar
+        if not checkpoint.get("coleccion"):
+            checkpoint["coleccion"] = await run_blocking(crear_coleccion_nueva)
+            await job.guardar()
+        coleccion_nueva = checkpoint["coleccion"]
+        await ejecutar_pipeline(
+            pendientes, existentes,
+            collection_name=coleccion_nueva,
+            solo_modificados=False,
+            resumen=resumen,
+            etapas=etapas,
+            al_terminar=al_terminar,
+            keywords_modo=keywords_modo
+        )
+        
+        if resumen["inserted"] == 0:
+            await run_blocking(eliminar_coleccion, coleccion_nueva)
+            resumen["errors"].append("No se insertó ningún trámite: se mantiene la colección activa")
+            coleccion_activa = await run_blocking(get_active_collection_name)
+        else:
+            estado = await run_blocking(activar_coleccion, coleccion_nueva)
+            coleccion_activa = estado["activa"]
+    else:
+        # Upsert de los modificados a medida que salen del pipeline y borrado de los que ya no existen
+        await ejecutar_pipeline(
+            pendientes, existentes,
+            resumen=resumen,
+            etapas=etapas,
+            al_terminar=al_terminar,
+            keywords_modo=keywords_modo
+        )
+        eliminados = await run_blocking(delete_tramites, removidos)
+        if eliminados < len(removidos):
+            resumen["errors"].append(
+                f"Solo se eliminaron {eliminados} de {len(removidos)} trámites que ya no están configurados"
+            )
+        coleccion_activa = await run_blocking(get_active_collection_name)
+    
+    errors = resumen["errors"]
+    if not resumen["scraped"]:
+        errors.append("No se pudo scrapear ningún trámite")
+    # En modo incremental puede no haber nada que insertar
+    nada_que_insertar = modo == "incremental" and resumen["changed"] == 0
+    
+    print(f"✅ Proceso completado: {resumen['inserted']} trámites insertados, {resumen['unchanged']} sin cambios, {eliminados} eliminados")
+    
+    return jsonable_encoder(ScrapingAllResponse(
+        success=resumen["scraped"] > 0 and (resumen["inserted"] > 0 or nada_que_insertar),
+        total_urls=len(urls),
+        scraped=resumen["scraped"],
+        failed=len(urls) - resumen["scraped"],
+        keywords_generated=resumen["keywords_generated"],
+        inserted_to_db=resumen["inserted"],
+        errors=errors,
+        coleccion=coleccion_activa,
+        changed=resumen["changed"],
+        unchanged=resumen["unchanged"],
+        removed=eliminados,
+        timings=resumen["timings"]
+    ))
+
+registrar_tipo("scrape-all", ejecutar_scrape_all)
+
+@router.post("/scrape-all", response_model=JobCreado, status_code=202)
 async def scrape_all_tramites(
+    modo: Literal["incremental", "completo"] = "incremental",
+    keywords_modo: Optional[Literal["llm", "tfidf"]] = None,
     admin = Depends(require_role("administrador"))
 ):
     """
-    Scrapea todos los trámites del archivo de configuración (solo admin)
+    Lanza en segundo plano el scraping de todos los trámites del archivo de
+    configuración (solo admin). Devuelve el id del job: el avance y el
+    resultado (ScrapingAllResponse) se consultan en GET /admin/jobs/{job_id}.
     
-    Proceso:
+    Proceso (ver utils/pipeline.py, las etapas corren en paralelo):
     1. Lee las URLs de /app/config/tramites_urls.json
-    2. Scrapea cada URL
-    3. Genera keywords con Ollama
-    4. Borra todos los trámites existentes en ChromaDB
-    5. Inserta los nuevos trámites en ChromaDB
+    2. Scrapea las URLs en paralelo (SCRAPER_CONCURRENCY, con pausa por host)
+    3. Genera keywords (solo para trámites nuevos o modificados) según
+       keywords_modo: "llm" con Ollama o "tfidf" sobre el catálogo, sin LLM
+       (default: KEYWORDS_MODO)
+    4. Inserta por lotes a medida que llegan, según el modo:
+       - incremental: upsert de los trámites modificados y borrado de los
+         que ya no están en la configuración, sobre la colección activa
+       - completo: inserta todo en una colección nueva y la activa al
+         terminar (la anterior queda disponible para rollback). Usarlo al
+         cambiar de backend de embeddings.
     
+    Mientras se re-indexa el chatbot sigue respondiendo con la colección
+    activa. Si el servidor se reinicia a mitad de camino, el job se retoma
+    desde su último checkpoint.
     """
-    errors = []
-    
+    # El modo de keywords queda fijo en el job, así al retomarlo se usa el mismo
     try:
-        # 1. Scrapear y generar keywords
-        print("📋 Iniciando scraping completo...")
-        tramites = await scrape_and_generate_keywords()
-        
-        if not tramites:
-            return ScrapingAllResponse(
-                success=False,
-                total_urls=0,
-                scraped=0,
-                failed=0,
-                keywords_generated=0,
-                inserted_to_db=0,
-                errors=["No se pudo scrapear ningún trámite"]
-            )
-        
-        # 2. Limpiar ChromaDB (borrar trámites existentes)
-        print("🗑️ Limpiando base vectorial...")
-        try:
-            from utils.vector_store import get_or_create_collection
-            collection = get_or_create_collection()
-            
-            # Obtener todos los IDs existentes
-            existing = collection.get()
-            if existing and existing['ids']:
-                for tramite_id in existing['ids']:
-                    delete_tramite(tramite_id)
-                print(f"✅ Eliminados {len(existing['ids'])} trámites antiguos")
-        except Exception as e:
-            errors.append(f"Error limpiando ChromaDB: {str(e)}")
-        
-        # 3. Insertar trámites en ChromaDB
-        print("💾 Insertando trámites en ChromaDB...")
-        inserted = 0
-        for tramite in tramites:
-            try:
-                success = add_tramite(tramite)
-                if success:
-                    inserted += 1
-            except Exception as e:
-                errors.append(f"Error insertando {tramite['id']}: {str(e)}")
-        
-        # 4. Contar keywords generadas
-        keywords_count = sum(
-            1 for t in tramites 
-            if t.get('metadata', {}).get('keywords')
+        job_id = await crear_job(
+            "scrape-all",
+            {"modo": modo, "keywords_modo": keywords_modo or KEYWORDS_MODO},
+            exclusivo=True
         )
-        
-        # 5. Calcular estadísticas
-        from utils.scraper import load_tramites_urls
-        total_urls = len(load_tramites_urls())
-        failed = total_urls - len(tramites)
-        
-        print(f"✅ Proceso completado: {inserted} trámites insertados")
-        
-        return ScrapingAllResponse(
-            success=True,
-            total_urls=total_urls,
-            scraped=len(tramites),
-            failed=failed,
-            keywords_generated=keywords_count,
-            inserted_to_db=inserted,
-            errors=errors
+    except JobActivo as e:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Ya hay un scraping en curso (job {e.job_id})"
         )
-        
-    except Exception as e:
+    return JobCreado(job_id=job_id, estado="en_curso")
+
+@router.get("/reindex")
+def get_reindex_estado(
+    admin = Depends(require_role("administrador"))
+):
+    """Colección activa y la anterior disponible para rollback (solo admin)"""
+    return get_estado_colecciones()
+
+@router.post("/reindex/rollback")
+def rollback_reindex(
+    admin = Depends(require_role("administrador"))
+):
+    """Vuelve a la versión anterior de la base vectorial (solo admin)"""
+    try:
+        return rollback_coleccion()
+    except ValueError as e:
         raise HTTPException(
-            status_code=500,
-            detail=f"Error en el proceso de scraping: {str(e)}"
-        )
\ No newline at end of file
+            status_code=400,
+            detail=str(e)
+        )
@@ -1,12 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel, HttpUrl
-from typing import List
+from typing import List, Literal, Optional
 import json
 import os
 
 from utils.security import require_role
-from utils.scraper import scrape_tramite, generar_keywords_con_ollama
+from utils.scraper import scrape_tramite_async, generar_keywords_con_ollama, KEYWORDS_MAX
+from utils.keywords import KEYWORDS_MODO, generar_keywords_tfidf
 from utils.vector_store import add_tramite, delete_tramite, get_all_tramites
+from utils.executor import run_blocking
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
@@ -77,6 +79,7 @@ def get_tramites_urls(
 @router.post("/tramites-urls")
 async def add_tramite_url(
     url_data: UrlCreate,
+    keywords_modo: Optional[Literal["llm", "tfidf"]] = None,
     admin = Depends(require_role("administrador"))
 ):
     """
@@ -86,7 +89,8 @@ async def add_tramite_url(
     1. Valida que la URL sea de PAMI
     2. Verifica que no exista ya
     3. Scrapea el trámite
-    4. Genera keywords
+    4. Genera keywords ("llm" con Ollama o "tfidf" sobre el catálogo,
+       default: KEYWORDS_MODO)
     5. Inserta en ChromaDB
     6. Agrega la URL al archivo de configuración
     """
@@ -112,7 +116,7 @@ async def add_tramite_url(
     try:
         # 1. Scrapear el trámite
         print(f"🔍 Scrapeando nuevo trámite: {url_str}")
-        tramite = scrape_tramite(url_str)
+        tramite = await scrape_tramite_async(url_str)
         
         if not tramite:
             raise HTTPException(
@@ -121,13 +125,17 @@ async def add_tramite_url(
             )
         
         # 2. Generar keywords
-        print(f"🤖 Generando keywords...")
-        keywords = await generar_keywords_con_ollama(tramite)
-        tramite["metadata"]["keywords"] = keywords
+        keywords_modo = keywords_modo or KEYWORDS_MODO
+        print(f"🤖 Generando keywords ({keywords_modo})...")
+        if keywords_modo == "tfidf":
+            catalogo = await run_blocking(get_all_tramites)
+            generar_keywords_tfidf([tramite], catalogo, KEYWORDS_MAX)
+        else:
+            tramite["metadata"]["keywords"] = await generar_keywords_con_ollama(tramite)
         
         # 3. Insertar en ChromaDB
         print(f"💾 Insertando en ChromaDB...")
-        success = add_tramite(tramite)
+        success = await run_blocking(add_tramite, tramite)
         
         if not success:
             raise HTTPException(
@@ -139,7 +147,7 @@ async def add_tramite_url(
         urls.append(url_str)
         if not save_urls_to_config(urls):
             # Si falla guardar el JSON, eliminar de ChromaDB para mantener consistencia
-            delete_tramite(tramite["id"])
+            await run_blocking(delete_tramite, tramite["id"])
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Error guardando la configuración"
@@ -6,4 +6,6 @@ class ChatMessage(BaseModel):
 
 class ChatResponse(BaseModel):
     respuesta: str
-    contexto_id: Optional[str] = None
\ No newline at end of file
+    contexto_id: Optional[str] = None
+    # Qué camino generó la respuesta: "llm", "plantilla", "cache" o "sin_resultados"
+    origen: Optional[str] = None
\ No newline at end of file
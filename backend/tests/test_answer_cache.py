@@ -0,0 +1,11 @@
+from utils.answer_cache import AnswerCache
+
+def test_nombre_dentro_de_otra_palabra_no_se_reemplaza():
+    cache = AnswerCache(max_entradas=10, ttl_segundos=60)
+    cache.set("t1", "¿cómo pido la credencial?", "Sol", "Hola Sol. Solicitud en la agencia, Sol.")
+    assert cache.get("t1", "¿cómo pido la credencial?", "Ana") == "Hola Ana. Solicitud en la agencia, Ana."
+
+def test_respuesta_sin_nombre_queda_igual():
+    cache = AnswerCache(max_entradas=10, ttl_segundos=60)
+    cache.set("t1", "requisitos", "Sol", "Presentá la Solicitud firmada.")
+    assert cache.get("t1", "requisitos", "Ana") == "Presentá la Solicitud firmada."
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db.connection import Base
+from models.conversacion import Conversacion, MensajeConversacion
+from utils import context, session_store
+
+@pytest.fixture
+def consultas(monkeypatch, tmp_path):
+    """Base SQLite temporal; devuelve la lista de user_id de cada consulta de versión"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'historial.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine, tables=[Conversacion.__table__, MensajeConversacion.__table__])
+    monkeypatch.setattr(context, "SessionLocal", sessionmaker(autocommit=False, autoflush=False, bind=engine))
+    context.user_contexts.clear()
+
+    hechas = []
+    version_en_db = context._version_en_db
+
+    def contar(user_id):
+        hechas.append(user_id)
+        return version_en_db(user_id)
+
+    monkeypatch.setattr(context, "_version_en_db", contar)
+    yield hechas
+    context._escribir_lote()
+    context.user_contexts.clear()
+    engine.dispose()
+
+def _turno(user_id, consulta):
+    """Lo que hace la ruta de chat con el historial en cada consulta"""
+    async def turno():
+        if not await context.obtener_contexto(user_id):
+            context.initialize_user_context(user_id, "Ana", "Pérez")
+        historial = context.format_history_for_prompt(user_id)
+        context.add_message(user_id, "user", consulta)
+        context.add_message(user_id, "assistant", "respuesta")
+        return historial
+    return asyncio.run(turno())
+
+def test_una_sola_consulta_de_version_por_request(consultas):
+    _turno(1, "¿cómo pido la credencial?")
+    context._escribir_lote()
+    consultas.clear()
+    historial = _turno(1, "¿y dónde la retiro?")
+    assert consultas == [1]
+    assert "¿cómo pido la credencial?" in historial
+
+def test_historial_formateado_cuenta_en_el_tamano_de_la_sesion(consultas):
+    _turno(2, "¿cómo pido la credencial? " * 20)
+    antes = context.user_contexts.bytes
+    context.format_history_for_prompt(2)
+    assert context.user_contexts.bytes > antes
+    assert context.user_contexts.bytes == session_store.estimar_bytes(context.user_contexts.peek(2))
@@ -0,0 +1,68 @@
+import threading
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+
+from db.connection import Base
+from models.job import Job
+from utils import jobs
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    """Base SQLite temporal (en archivo, para que varios threads compitan por el lock)"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine, tables=[Job.__table__])
+    sesiones = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(jobs, "SessionLocal", sesiones)
+    yield sesiones
+    engine.dispose()
+
+def _activos(sesiones, tipo):
+    db = sesiones()
+    try:
+        return db.query(Job).filter(Job.tipo == tipo, Job.estado.in_(jobs.ESTADOS_ACTIVOS)).count()
+    finally:
+        db.close()
+
+def test_crear_exclusivo_deja_un_solo_job_activo(db):
+    creados, rechazados = [], []
+    barrera = threading.Barrier(8)
+
+    def crear():
+        barrera.wait()
+        try:
+            creados.append(jobs._crear("scrape-all", {}, exclusivo=True))
+        except jobs.JobActivo as e:
+            rechazados.append(e.job_id)
+
+    hilos = [threading.Thread(target=crear) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert len(creados) == 1
+    assert rechazados == creados * 7
+    assert _activos(db, "scrape-all") == 1
+
+def _con_latido(sesiones, job_id, latido):
+    sesion = sesiones()
+    try:
+        sesion.execute(update(Job).where(Job.id == job_id).values(latido=latido))
+        sesion.commit()
+    finally:
+        sesion.close()
+
+def test_solo_las_caidas_cuentan_como_intentos(db):
+    job_id = jobs._crear("scrape-all", {})
+    assert jobs._reclamar(job_id)["intentos"] == 0
+
+    # Shutdown ordenado: se soltó sin latido
+    _con_latido(db, job_id, None)
+    assert jobs._reclamar(job_id)["intentos"] == 0
+
+    # Caída: el latido quedó vencido
+    _con_latido(db, job_id, jobs._ahora() - timedelta(seconds=jobs.JOB_COLGADO_SEGUNDOS + 1))
+    assert jobs._reclamar(job_id)["intentos"] == 1
@@ -0,0 +1,28 @@
+from utils import keywords
+from utils.keywords import ExtractorTfidf
+
+def _tramite(tramite_id, titulo, descripcion=""):
+    return {"id": tramite_id, "titulo": titulo, "descripcion": descripcion}
+
+def test_tramite_modificado_reemplaza_sus_terminos_anteriores():
+    extractor = ExtractorTfidf([_tramite("a", "Audífonos para afiliados"), _tramite("b", "Credencial de afiliados")])
+    extractor.agregar(_tramite("a", "Anteojos recetados"))
+
+    assert extractor.documentos == 2
+    assert extractor.df["audifonos"] == 0
+    assert extractor.df["anteojos"] == 1
+    assert extractor.df["afiliados"] == 1
+
+def test_catalogo_chico_ordena_por_frecuencia(monkeypatch):
+    monkeypatch.setattr(keywords, "TFIDF_MIN_DOCUMENTOS", 10)
+    extractor = ExtractorTfidf()
+    # Con un solo documento el idf de todos los términos es ~0
+    resultado = extractor.extraer(_tramite("a", "Insulina", "insulina tiras reactivas"), cantidad=2)
+    assert resultado == ["insulina", "tiras"]
+
+def test_catalogo_grande_usa_idf(monkeypatch):
+    monkeypatch.setattr(keywords, "TFIDF_MIN_DOCUMENTOS", 2)
+    catalogo = [_tramite(str(i), "Afiliados credencial") for i in range(5)]
+    extractor = ExtractorTfidf(catalogo)
+    resultado = extractor.extraer(_tramite("x", "Afiliados audífonos"), cantidad=1)
+    assert resultado == ["audifonos"]
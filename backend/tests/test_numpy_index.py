@@ -0,0 +1,15 @@
+from utils.numpy_index import NumpyIndex
+
+def test_catalogo_vacio_no_falla():
+    indice = NumpyIndex()
+    assert indice.buscar([0.1, 0.2, 0.3], 3, "v1", lambda: ([], [])) == []
+    assert indice.stats()["tramites"] == 0
+
+def test_catalogo_que_se_vacia_y_vuelve_a_llenarse():
+    indice = NumpyIndex()
+    tramites = [{"id": "a"}, {"id": "b"}]
+    assert [t["id"] for t, _ in indice.buscar([1.0, 0.0], 2, "v1", lambda: ([[1.0, 0.0], [0.0, 1.0]], tramites))] == ["a", "b"]
+    assert indice.buscar([1.0, 0.0], 2, "v2", lambda: (None, [])) == []
+    resultados = indice.buscar([0.0, 1.0], 1, "v3", lambda: ([[0.0, 2.0]], [{"id": "c"}]))
+    assert resultados[0][0]["id"] == "c"
+    assert abs(resultados[0][1]) < 1e-6
@@ -0,0 +1,82 @@
+import asyncio
+import copy
+
+from utils import pipeline
+
+def _tramite(tramite_id, keywords):
+    return {
+        "id": tramite_id,
+        "titulo": f"Trámite {tramite_id}",
+        "descripcion": "Solicitud de la credencial de afiliación",
+        "quien_puede_realizar": {"texto": "Afiliados", "enlaces": []},
+        "documentacion_necesaria": {"texto": "", "items": ["DNI"], "enlaces": []},
+        "donde_realizar": {"texto": "Agencia", "enlaces": []},
+        "url_oficial": f"https://www.pami.org.ar/tramite/{tramite_id}",
+        "metadata": {"keywords": keywords, "hash_contenido": f"hash-{tramite_id}"},
+    }
+
+def _indice(tramites):
+    # Lo que arma get_indice_tramites: solo hash y keywords
+    return {
+        tramite["id"]: {"id": tramite["id"], "metadata": {
+            "hash_contenido": tramite["metadata"]["hash_contenido"],
+            "keywords": tramite["metadata"]["keywords"],
+        }}
+        for tramite in tramites
+    }
+
+def _preparar(monkeypatch, indexados, insertados, leidos):
+    async def descargar_pagina(url, tiempos, existente=None):
+        # 304: el trámite indexado sigue valiendo
+        return None, copy.deepcopy(existente)
+
+    async def run_blocking(funcion, *args, **kwargs):
+        if funcion is pipeline.add_tramites:
+            tramites = args[0]
+            insertados.extend(tramite["id"] for tramite in tramites)
+            return [{"id": tramite["id"], "ok": True, "error": None} for tramite in tramites]
+        return funcion(*args, **kwargs)
+
+    def get_tramites_por_id(ids):
+        leidos.extend(ids)
+        return {tramite_id: indexados[tramite_id] for tramite_id in ids if tramite_id in indexados}
+
+    monkeypatch.setattr(pipeline, "descargar_pagina", descargar_pagina)
+    monkeypatch.setattr(pipeline, "run_blocking", run_blocking)
+    monkeypatch.setattr(pipeline, "get_tramites_por_id", get_tramites_por_id)
+    monkeypatch.setattr(pipeline, "iterar_tramites", lambda: iter(indexados.values()))
+    monkeypatch.setattr(pipeline, "PIPELINE_UPSERT_ESPERA", 0.01)
+
+def test_sin_cambios_y_sin_keywords_llega_al_upsert(monkeypatch):
+    indexados = {"con-keywords": _tramite("con-keywords", ["credencial"]), "sin-keywords": _tramite("sin-keywords", [])}
+    insertados, leidos = [], []
+    _preparar(monkeypatch, indexados, insertados, leidos)
+
+    urls = [tramite["url_oficial"] for tramite in indexados.values()]
+    resumen = asyncio.run(pipeline.ejecutar_pipeline(urls, _indice(indexados.values()), keywords_modo="tfidf"))
+
+    assert insertados == ["sin-keywords"]
+    # Solo se lee completo el que va al upsert
+    assert leidos == ["sin-keywords"]
+    assert resumen["changed"] == 1
+    assert resumen["unchanged"] == 1
+    assert resumen["inserted"] == 1
+
+def test_completo_lee_el_payload_de_los_sin_cambios(monkeypatch):
+    indexados = {"a": _tramite("a", ["credencial"]), "b": _tramite("b", ["credencial"])}
+    insertados, leidos = [], []
+    _preparar(monkeypatch, indexados, insertados, leidos)
+    # "b" figura en el índice pero perdió su payload
+    del indexados["b"]
+
+    urls = [f"https://www.pami.org.ar/tramite/{tramite_id}" for tramite_id in ("a", "b")]
+    indice = _indice([_tramite("a", ["credencial"]), _tramite("b", ["credencial"])])
+    resumen = asyncio.run(pipeline.ejecutar_pipeline(urls, indice, solo_modificados=False, keywords_modo="tfidf"))
+
+    assert insertados == ["a"]
+    assert sorted(leidos) == ["a", "b"]
+    assert resumen["inserted"] == 1
+    assert resumen["scraped"] == 1
+    assert [tiempos["url"] for tiempos in resumen["timings"] if tiempos.get("error")] == [urls[1]]
+    # El trámite leído no se modifica en el caché compartido
+    assert indexados["a"]["metadata"]["keywords"] == ["credencial"]
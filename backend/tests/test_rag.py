@@ -0,0 +1,174 @@
+import asyncio
+import contextlib
+import json
+
+import httpx
+import pytest
+
+from utils import rag
+
+INSULINAS = {"id": "insulinas", "titulo": "Insulinas y tiras reactivas"}
+TRAMITES = {
+    "audifonos": {"id": "audifonos", "titulo": "Audífonos"},
+    "reintegro": {"id": "reintegro", "titulo": "Reintegro de medicamentos"},
+    "oculista": {"id": "oculista", "titulo": "Turno con oftalmología"},
+    "credencial": {"id": "credencial", "titulo": "Credencial de afiliación"},
+}
+HISTORIAL = "Usuario: ¿Cómo pido insulina?\nAsistente: ..."
+USER_ID = 1
+
+@pytest.fixture
+def buscar(monkeypatch):
+    """Reemplaza la búsqueda: devuelve lo que el test deje en resultados"""
+    resultados = []
+
+    async def run_blocking(funcion, *args, **kwargs):
+        return funcion(*args, **kwargs)
+
+    monkeypatch.setattr(rag, "run_blocking", run_blocking)
+    monkeypatch.setattr(rag, "search_tramites_con_distancia", lambda consulta, n_results=1: list(resultados))
+    monkeypatch.setattr(rag, "formatear_tramite_como_texto", lambda tramite: f"TRÁMITE: {tramite['titulo']}")
+    rag.ultimo_retrieval.clear()
+    rag.contextos_ollama.clear()
+    rag.recordar_retrieval(USER_ID, INSULINAS, "TRÁMITE: Insulinas y tiras reactivas")
+    yield resultados
+    rag.ultimo_retrieval.clear()
+    rag.contextos_ollama.clear()
+
+def _resolver(consulta):
+    return asyncio.run(rag._buscar_y_resolver(consulta, "Ana", HISTORIAL, USER_ID))
+
+@pytest.mark.parametrize("consulta, esperado", [
+    ("¿Y para pedir audífonos?", "audifonos"),
+    ("E implantes, ¿los cubren?", "audifonos"),
+    ("Y el reintegro de medicamentos?", "reintegro"),
+    ("Pero necesito turno con el oculista", "oculista"),
+    ("Entonces, ¿cómo saco la credencial?", "credencial"),
+    ("O sea que la credencial la saco en la agencia?", "credencial"),
+])
+def test_cambio_de_tema_con_conector_busca_de_nuevo(buscar, consulta, esperado):
+    # Resultado claro pero no tanto como para responder por plantilla
+    buscar.append((TRAMITES[esperado], 0.7))
+    resuelto = _resolver(consulta)
+    assert resuelto["tramite"]["id"] == esperado
+    assert rag.ultimo_retrieval.peek(USER_ID)["tramite_id"] == esperado
+
+def test_repregunta_con_busqueda_floja_reutiliza_el_anterior(buscar):
+    buscar.append((TRAMITES["credencial"], 1.2))
+    resuelto = _resolver("¿Y dónde lo pido?")
+    assert resuelto["tramite"]["id"] == "insulinas"
+
+def test_consulta_corta_sin_resultados_reutiliza_el_anterior(buscar):
+    resuelto = _resolver("¿cuánto tarda?")
+    assert resuelto["tramite"]["id"] == "insulinas"
+
+def test_repregunta_sobre_el_mismo_tramite_va_al_llm(buscar):
+    buscar.append((INSULINAS, 0.2))
+    resuelto = _resolver("¿Y los papeles?")
+    assert resuelto["tramite"]["id"] == "insulinas"
+    assert "respuesta" not in resuelto
+
+def _contexto_guardado(monkeypatch, carga):
+    monkeypatch.setattr(rag, "version_conversacion", lambda user_id: carga)
+    rag.contextos_ollama.clear()
+    rag._recordar_contexto_ollama(USER_ID, "insulinas", {"context": [1, 2, 3]})
+
+def test_context_de_ollama_se_reutiliza_en_la_misma_version(monkeypatch):
+    _contexto_guardado(monkeypatch, 7)
+    plan = rag._para_el_llm("insulinas", "TRÁMITE: Insulinas", "¿y dónde lo pido?", "Ana", HISTORIAL, USER_ID)
+    assert plan["context"] == [1, 2, 3]
+
+def test_context_de_ollama_se_descarta_si_cambio_la_conversacion(monkeypatch):
+    _contexto_guardado(monkeypatch, 7)
+    # Otro worker escribió: la conversación se recargó con otra versión
+    monkeypatch.setattr(rag, "version_conversacion", lambda user_id: 8)
+    plan = rag._para_el_llm("insulinas", "TRÁMITE: Insulinas", "¿y dónde lo pido?", "Ana", HISTORIAL, USER_ID)
+    assert plan["context"] is None
+    assert rag.contextos_ollama.peek(USER_ID) is None
+
+def test_stream_cortado_descarta_el_context(monkeypatch):
+    _contexto_guardado(monkeypatch, 7)
+
+    async def resolver(consulta, nombre_usuario, historial, user_id=None):
+        return {"tramite": {"id": "insulinas"}, "prompt": "...", "context": [1, 2, 3]}
+
+    async def stream(prompt, context=None, generacion=None):
+        for fragmento in ("Primero ", "segundo ", "tercero"):
+            yield fragmento
+        generacion["context"] = [1, 2, 3, 4]
+
+    monkeypatch.setattr(rag, "_resolver_sin_llm", resolver)
+    monkeypatch.setattr(rag, "llamar_ollama_stream", stream)
+
+    async def cliente_que_se_va():
+        respuesta = rag.generar_respuesta_con_rag_stream("¿y dónde lo pido?", "Ana", HISTORIAL, user_id=USER_ID)
+        assert await respuesta.__anext__() == "Primero "
+        await respuesta.aclose()
+
+    asyncio.run(cliente_que_se_va())
+    assert rag.contextos_ollama.peek(USER_ID) is None
+    rag.contextos_ollama.clear()
+
+class _RespuestaStream:
+    """Respuesta de Ollama en streaming que manda las líneas dadas y después falla con error"""
+
+    def __init__(self, lineas, error=None):
+        self.status_code = 200
+        self.lineas = lineas
+        self.error = error
+
+    async def aiter_lines(self):
+        for linea in self.lineas:
+            yield linea
+        if self.error:
+            raise self.error
+
+def _generar_stream(monkeypatch, respuesta):
+    @contextlib.asynccontextmanager
+    async def generate_stream(payload, backend="chat"):
+        yield respuesta
+
+    async def resolver(consulta, nombre_usuario, historial, user_id=None):
+        return {"tramite": {"id": "cambio-medico"}, "prompt": "...", "context": None}
+
+    monkeypatch.setattr(rag, "generate_stream", generate_stream)
+    monkeypatch.setattr(rag, "_resolver_sin_llm", resolver)
+    monkeypatch.setattr(rag, "version_conversacion", lambda user_id: 7)
+    rag.answer_cache.clear()
+    rag.contextos_ollama.clear()
+
+    async def consumir():
+        info = {}
+        fragmentos = [f async for f in rag.generar_respuesta_con_rag_stream("¿cómo cambio de médico?", "Ana", "", info, USER_ID)]
+        return fragmentos, info
+
+    return asyncio.run(consumir())
+
+def test_stream_que_falla_a_mitad_no_se_cachea(monkeypatch):
+    linea = json.dumps({"response": "**Cambio de médico** parcial", "done": False})
+    fragmentos, info = _generar_stream(monkeypatch, _RespuestaStream([linea], httpx.ReadTimeout("timeout")))
+
+    assert fragmentos == ["**Cambio de médico** parcial"]
+    assert info["error"] == rag.ERROR_TIMEOUT
+    assert rag.answer_cache.get("cambio-medico", "¿cómo cambio de médico?", "Ana") is None
+    assert rag.contextos_ollama.peek(USER_ID) is None
+
+def test_stream_cortado_sin_done_no_se_cachea(monkeypatch):
+    linea = json.dumps({"response": "**Cambio de médico** parcial", "done": False})
+    _, info = _generar_stream(monkeypatch, _RespuestaStream([linea]))
+
+    assert info["error"] == rag.ERROR_INTERNO
+    assert rag.answer_cache.get("cambio-medico", "¿cómo cambio de médico?", "Ana") is None
+
+def test_stream_completo_se_cachea_y_guarda_el_context(monkeypatch):
+    lineas = [
+        json.dumps({"response": "**Cambio de médico**", "done": False}),
+        json.dumps({"response": "", "done": True, "context": [1, 2], "prompt_eval_count": 10}),
+    ]
+    _, info = _generar_stream(monkeypatch, _RespuestaStream(lineas))
+
+    assert "error" not in info
+    assert rag.answer_cache.get("cambio-medico", "¿cómo cambio de médico?", "Ana") == "**Cambio de médico**"
+    assert list(rag.contextos_ollama.peek(USER_ID)["context"]) == [1, 2]
+    rag.answer_cache.clear()
+    rag.contextos_ollama.clear()
@@ -0,0 +1,49 @@
+import asyncio
+
+import httpx
+import pytest
+
+from utils import http_cache, scraper
+
+URL = "https://www.pami.org.ar/tramite/credencial"
+
+@pytest.fixture
+def pagina(monkeypatch, tmp_path):
+    """Caché HTTP en un directorio temporal y un servidor que responde lo que el test indique"""
+    monkeypatch.setattr(http_cache, "HTTP_CACHE_DIR", str(tmp_path))
+    respuestas = []
+
+    async def descargar(url, tiempos, headers=None):
+        status, body = respuestas.pop(0)
+        return httpx.Response(status, text=body, headers={"etag": '"v2"'}, request=httpx.Request("GET", url))
+
+    monkeypatch.setattr(scraper, "_descargar", descargar)
+    return respuestas
+
+def _existente(hash_contenido):
+    return {"id": "credencial", "metadata": {"keywords": ["credencial"], "hash_contenido": hash_contenido}}
+
+def test_304_reparsea_si_la_pagina_guardada_no_llego_al_indice(pagina):
+    # Corrida anterior: 200 con contenido nuevo, parseado, pero el upsert falló
+    http_cache.guardar(URL, "<html>nuevo</html>", '"v2"')
+    http_cache.anotar_hash_contenido(URL, "hash-nuevo")
+
+    pagina.append((304, ""))
+    html, tramite = asyncio.run(scraper.descargar_pagina(URL, scraper.nuevo_registro_tiempos(URL), _existente("hash-viejo")))
+    assert html == "<html>nuevo</html>"
+    assert tramite is None
+
+def test_304_reutiliza_el_indexado_si_coincide_el_hash(pagina):
+    http_cache.guardar(URL, "<html>igual</html>", '"v2"', hash_contenido="hash-igual")
+
+    pagina.append((304, ""))
+    html, tramite = asyncio.run(scraper.descargar_pagina(URL, scraper.nuevo_registro_tiempos(URL), _existente("hash-igual")))
+    assert html is None
+    assert tramite["metadata"]["hash_contenido"] == "hash-igual"
+
+def test_200_guarda_la_pagina_sin_hash_hasta_parsearla(pagina):
+    pagina.append((200, "<html>otra</html>"))
+    asyncio.run(scraper.descargar_pagina(URL, scraper.nuevo_registro_tiempos(URL), _existente("hash-viejo")))
+    entrada = http_cache.leer(URL)
+    assert entrada["body"] == "<html>otra</html>"
+    assert entrada["hash_contenido"] is None
@@ -0,0 +1,16 @@
+from utils import session_store
+from utils.session_store import SessionStore
+
+def test_peek_no_devuelve_sesiones_vencidas(monkeypatch):
+    ahora = [1000.0]
+    monkeypatch.setattr(session_store.time, "monotonic", lambda: ahora[0])
+    store = SessionStore("test_peek", ttl_segundos=10)
+    store.set(1, {"mensajes": []})
+
+    ahora[0] += 5
+    assert store.peek(1) == {"mensajes": []}
+    ahora[0] += 20
+    assert store.peek(1) is None
+    assert len(store) == 0
+    assert store.stats()["evictions_ttl"] == 1
+    assert store.bytes == 0
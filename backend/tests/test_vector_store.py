@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from utils import vector_store
+
+@pytest.fixture
+def estado(monkeypatch, tmp_path):
+    ruta = tmp_path / "vector_store_estado.json"
+    ruta.write_text(json.dumps({"activa": "vieja", "anterior": None, "revision": 1}))
+    monkeypatch.setattr(vector_store, "ESTADO_PATH", str(ruta))
+    monkeypatch.setattr(vector_store, "_estado_cache", {"mtime": None, "estado": None})
+    return ruta
+
+def test_marcar_cambio_no_deshace_la_activacion(estado):
+    errores = []
+
+    def marcar():
+        try:
+            for _ in range(50):
+                vector_store._marcar_cambio("vieja")
+        except Exception as e:
+            errores.append(e)
+
+    hilos = [threading.Thread(target=marcar) for _ in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    vector_store.activar_coleccion("nueva")
+    for hilo in hilos:
+        hilo.join()
+
+    assert errores == []
+    guardado = json.loads(estado.read_text())
+    assert guardado["activa"] == "nueva"
+    assert guardado["anterior"] == "vieja"
+    assert vector_store.get_active_collection_name() == "nueva"
+    assert not list(estado.parent.glob("*.tmp"))
+
+def test_cambio_de_otro_worker_vacia_el_cache_de_respuestas(estado):
+    assert vector_store.get_active_collection_name() == "vieja"
+    vector_store.answer_cache.set("credencial", "¿cómo saco la credencial?", "", "respuesta vieja")
+
+    # Otro worker activa la colección nueva (escribe el archivo directamente)
+    estado.write_text(json.dumps({"activa": "nueva", "anterior": "vieja", "revision": 2}))
+    os.utime(estado, (time.time() + 5, time.time() + 5))
+
+    assert vector_store.get_active_collection_name() == "nueva"
+    assert vector_store.answer_cache.get("credencial", "¿cómo saco la credencial?", "") is None
+
+def test_sin_cambios_el_cache_de_respuestas_se_mantiene(estado):
+    assert vector_store.get_active_collection_name() == "vieja"
+    vector_store.answer_cache.set("credencial", "¿cómo saco la credencial?", "", "respuesta")
+    assert vector_store.get_active_collection_name() == "vieja"
+    assert vector_store.answer_cache.get("credencial", "¿cómo saco la credencial?", "") == "respuesta"
+    vector_store.answer_cache.clear()
+
+class _ColeccionFalsa:
+    name = "vieja"
+
+    def __init__(self, metadatas):
+        self.metadatas = metadatas
+
+    def get(self, ids=None, include=None):
+        ids = list(self.metadatas) if ids is None else ids
+        return {"ids": ids, "metadatas": [self.metadatas[i] for i in ids]}
+
+def test_indice_de_tramites_solo_tiene_hash_y_keywords(monkeypatch):
+    legado = {"id": "legado", "titulo": "Viejo", "metadata": {"hash_contenido": "h2", "keywords": []}}
+    coleccion = _ColeccionFalsa({"nuevo": {}, "legado": {"json_data": json.dumps(legado)}})
+    monkeypatch.setattr(vector_store, "get_or_create_collection", lambda: coleccion)
+    monkeypatch.setattr(vector_store, "iterar_payloads", lambda nombre, ids: iter([
+        {"id": "nuevo", "titulo": "Nuevo", "descripcion": "texto largo", "metadata": {"hash_contenido": "h1", "keywords": ["dni"]}},
+    ]))
+
+    assert vector_store.get_indice_tramites() == {
+        "nuevo": {"id": "nuevo", "metadata": {"hash_contenido": "h1", "keywords": ["dni"]}},
+        "legado": {"id": "legado", "metadata": {"hash_contenido": "h2", "keywords": []}},
+    }
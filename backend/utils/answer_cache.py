@@ -0,0 +1,106 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# Configuración del cache de respuestas
+ANSWER_CACHE_MAX_ENTRADAS = int(os.getenv("ANSWER_CACHE_MAX_ENTRADAS", 500))
+ANSWER_CACHE_TTL_SEGUNDOS = float(os.getenv("ANSWER_CACHE_TTL_SEGUNDOS", 6 * 3600))
+
+# Las respuestas se guardan sin el nombre del usuario para poder compartirlas
+MARCADOR_NOMBRE = "{{nombre_usuario}}"
+
+# Palabras que no cambian el sentido de la consulta ("cómo cambio de médico" == "cambio médico")
+STOPWORDS = {
+    "a", "al", "algo", "como", "con", "cual", "cuales", "cuando", "de", "del",
+    "donde", "el", "en", "es", "esta", "este", "hacer", "hago", "hola", "la",
+    "las", "le", "lo", "los", "me", "mi", "necesito", "para", "por", "puedo",
+    "que", "quiero", "se", "si", "sobre", "su", "un", "una", "y", "yo",
+}
+
+def normalizar_consulta(consulta: str) -> str:
+    """
+    Normaliza la consulta para que pequeñas diferencias de redacción
+    (mayúsculas, tildes, signos, palabras vacías, orden) den la misma clave
+    """
+    texto = unicodedata.normalize("NFKD", consulta.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    palabras = re.findall(r"[a-z0-9ñ]+", texto)
+    significativas = sorted({p for p in palabras if p not in STOPWORDS})
+    return " ".join(significativas)
+
+class AnswerCache:
+    """Cache LRU con TTL de respuestas del RAG, indexado por (trámite, consulta normalizada)"""
+
+    def __init__(self, max_entradas: int, ttl_segundos: float):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self._entradas: "OrderedDict[Tuple[str, str], Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidaciones = 0
+
+    def get(self, tramite_id: str, consulta: str, nombre_usuario: str) -> Optional[str]:
+        clave = (tramite_id, normalizar_consulta(consulta))
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.misses += 1
+                return None
+
+            guardado, respuesta = entrada
+            if time.monotonic() - guardado > self.ttl_segundos:
+                del self._entradas[clave]
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self._entradas.move_to_end(clave)
+            self.hits += 1
+        return respuesta.replace(MARCADOR_NOMBRE, nombre_usuario)
+
+    def set(self, tramite_id: str, consulta: str, nombre_usuario: str, respuesta: str):
+        clave = (tramite_id, normalizar_consulta(consulta))
+        if nombre_usuario:
+            # Solo la palabra entera: "Sol" no tiene que tocar "Solicitud"
+            respuesta = re.sub(rf"\b{re.escape(nombre_usuario)}\b", MARCADOR_NOMBRE, respuesta)
+        with self._lock:
+            self._entradas[clave] = (time.monotonic(), respuesta)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_tramite(self, tramite_id: str):
+        """Elimina las respuestas generadas a partir de un trámite"""
+        with self._lock:
+            claves = [clave for clave in self._entradas if clave[0] == tramite_id]
+            for clave in claves:
+                del self._entradas[clave]
+            self.invalidaciones += len(claves)
+
+    def clear(self):
+        with self._lock:
+            self.invalidaciones += len(self._entradas)
+            self._entradas.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "ttl_segundos": self.ttl_segundos,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidaciones": self.invalidaciones,
+            }
+
+answer_cache = AnswerCache(ANSWER_CACHE_MAX_ENTRADAS, ANSWER_CACHE_TTL_SEGUNDOS)
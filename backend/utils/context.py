@@ -1,66 +1,522 @@
+import asyncio
+import itertools
+import os
+import threading
 from typing import List, Dict, Optional
 
-# Almacenamiento en memoria del contexto por usuario
-user_contexts: Dict[int, Dict] = {}
+from sqlalchemy import delete, or_, select, update
+
+from db.connection import SessionLocal
+from models.conversacion import Conversacion, MensajeConversacion
+from utils.ollama_client import generate
+from utils.session_store import SessionStore
+
+# El historial se guarda en la base (tablas conversacion y mensaje_conversacion)
+# para que cualquier worker de uvicorn pueda seguir la conversación y no se
+# pierda al reiniciar. Los mensajes nuevos se escriben en segundo plano, por
+# lotes, cada CONTEXT_FLUSH_SEGUNDOS (o antes si se juntan CONTEXT_FLUSH_LOTE).
+CONTEXT_FLUSH_SEGUNDOS = float(os.getenv("CONTEXT_FLUSH_SEGUNDOS", 0.5))
+CONTEXT_FLUSH_LOTE = int(os.getenv("CONTEXT_FLUSH_LOTE", 50))
+
+# Caché en memoria del contexto por usuario, acotada: las sesiones inactivas
+# por más de SESSION_TTL_SEGUNDOS o las menos usadas cuando se llega al tope
+# se descartan (y se vuelven a leer de la base si el usuario vuelve)
+user_contexts = SessionStore("contextos")
 
 # Límite de mensajes a mantener
 MAX_MESSAGES = 10
 
+# Presupuesto de tokens del historial que va en cada prompt (se estiman ~4
+# caracteres por token): el resumen de lo conversado antes más los últimos
+# mensajes. Los últimos HISTORIAL_TURNOS_LITERALES turnos (pregunta y
+# respuesta) van tal cual; cuando se juntan HISTORIAL_TURNOS_POR_RESUMEN turnos
+# más viejos se pliegan en el resumen, en segundo plano.
+HISTORIAL_MAX_TOKENS = int(os.getenv("HISTORIAL_MAX_TOKENS", 600))
+HISTORIAL_TURNOS_LITERALES = int(os.getenv("HISTORIAL_TURNOS_LITERALES", 2))
+HISTORIAL_TURNOS_POR_RESUMEN = int(os.getenv("HISTORIAL_TURNOS_POR_RESUMEN", 2))
+
+# El resumen se guarda como un mensaje más con este rol
+ROL_RESUMEN = "resumen"
+
+# Número de carga de cada copia en memoria de una conversación: cambia cada
+# vez que se (re)lee de la base porque otro worker escribió o se limpió, pero
+# no con las escrituras propias. Lo derivado de la conversación en este
+# proceso (el context de Ollama) solo vale mientras no cambie.
+_cargas = itertools.count(1)
+
+# Escrituras todavía no hechas en la base, por usuario (ver _nuevo_pendiente)
+_pendientes: Dict[int, Dict] = {}
+_lock = threading.Lock()
+# Lo toma la escritura de un lote y las recargas desde la base, así una recarga
+# nunca ve un mensaje a la vez en la base y entre los pendientes
+_lock_escritura = threading.Lock()
+_hay_pendientes = threading.Event()
+_lote_lleno = threading.Event()
+_escritor: Optional[threading.Thread] = None
+_cerrando = False
+_resumiendo = set()
+_tareas_resumen = set()
+_stats = {
+    "recargas": 0,
+    "lotes": 0,
+    "mensajes_escritos": 0,
+    "errores": 0,
+    "resumenes": 0,
+    "errores_resumen": 0,
+    "historial_cacheado": 0,
+    "historial_formateado": 0,
+}
+
+def _nuevo_pendiente(nombre: str, apellido: str) -> Dict:
+    # resumen: el último generado (reemplaza al guardado); resumidos: cuántos
+    # de los mensajes más viejos ya están plegados en él y hay que borrar
+    return {"nombre": nombre, "apellido": apellido, "mensajes": [], "resumen": None, "resumidos": 0}
+
+def estimar_tokens(texto: str) -> int:
+    return len(texto) // 4 + 1
+
+def _version_en_db(user_id: int) -> int:
+    db = SessionLocal()
+    try:
+        version = db.execute(
+            select(Conversacion.version).where(Conversacion.id_usuario == user_id)
+        ).scalar()
+        return version or 0
+    finally:
+        db.close()
+
+def _leer_de_db(user_id: int) -> Optional[Dict]:
+    """Contexto guardado en la base con los últimos MAX_MESSAGES mensajes, o None"""
+    db = SessionLocal()
+    try:
+        conversacion = db.get(Conversacion, user_id)
+        if conversacion is None:
+            return None
+        mensajes = db.execute(
+            select(MensajeConversacion.rol, MensajeConversacion.contenido)
+            .where(MensajeConversacion.id_usuario == user_id, MensajeConversacion.rol != ROL_RESUMEN)
+            .order_by(MensajeConversacion.id_mensaje.desc())
+            .limit(MAX_MESSAGES)
+        ).all()
+        resumen = db.execute(
+            select(MensajeConversacion.contenido)
+            .where(MensajeConversacion.id_usuario == user_id, MensajeConversacion.rol == ROL_RESUMEN)
+            .order_by(MensajeConversacion.id_mensaje.desc())
+            .limit(1)
+        ).scalar()
+        return {
+            "nombre": conversacion.nombre,
+            "apellido": conversacion.apellido,
+            "resumen": resumen or "",
+            "mensajes": [{"role": rol, "content": contenido} for rol, contenido in reversed(mensajes)],
+            "version": conversacion.version,
+        }
+    finally:
+        db.close()
+
+def _recargar(user_id: int) -> Optional[Dict]:
+    """Lee el contexto de la base y le suma los mensajes de este proceso que todavía no se escribieron"""
+    with _lock_escritura:
+        contexto = _leer_de_db(user_id)
+        with _lock:
+            pendiente = _pendientes.get(user_id)
+            if pendiente is not None:
+                if contexto is None:
+                    contexto = {"nombre": pendiente["nombre"], "apellido": pendiente["apellido"], "resumen": "", "mensajes": [], "version": 0}
+                mensajes = contexto["mensajes"] + pendiente["mensajes"]
+                if pendiente["resumen"] is not None:
+                    contexto["resumen"] = pendiente["resumen"]
+                    mensajes = mensajes[pendiente["resumidos"]:]
+                contexto["mensajes"] = mensajes[-MAX_MESSAGES:]
+        _stats["recargas"] += 1
+        if contexto is not None:
+            contexto["carga"] = next(_cargas)
+            user_contexts.set(user_id, contexto)
+        return contexto
+
 def initialize_user_context(user_id: int, nombre: str, apellido: str):
-    """Inicializa el contexto de un usuario con su información personal"""
-    if user_id not in user_contexts:
-        user_contexts[user_id] = {
+    """
+    Inicializa el contexto de un usuario con su información personal. Se
+    llama después de obtener_contexto, así que no vuelve a mirar la base.
+    """
+    if user_contexts.peek(user_id) is None:
+        user_contexts.set(user_id, {
             "nombre": nombre,
             "apellido": apellido,
-            "mensajes": []
-        }
+            "resumen": "",
+            "mensajes": [],
+            "version": 0,
+            "carga": next(_cargas)
+        })
+        with _lock:
+            _pendientes.setdefault(user_id, _nuevo_pendiente(nombre, apellido))
 
 def get_user_context(user_id: int) -> Optional[Dict]:
-    """Obtiene el contexto completo de un usuario"""
-    return user_contexts.get(user_id)
+    """
+    Obtiene el contexto completo de un usuario. Se usa la copia en memoria
+    mientras su versión coincida con la de la base; si otro worker escribió
+    (o no está en memoria) se vuelve a leer.
+    """
+    contexto = user_contexts.get(user_id)
+    if contexto is not None and contexto["version"] == _version_en_db(user_id):
+        return contexto
+    return _recargar(user_id)
+
+async def obtener_contexto(user_id: int) -> Optional[Dict]:
+    """
+    get_user_context fuera del event loop (consulta la versión en la base).
+    Se llama una vez por request; lo que sigue usa la copia en memoria.
+    """
+    return await asyncio.to_thread(get_user_context, user_id)
+
+def version_conversacion(user_id: int) -> Optional[int]:
+    """Número de carga de la conversación en memoria (ver _cargas), o None si no está"""
+    contexto = user_contexts.peek(user_id)
+    return contexto.get("carga") if contexto is not None else None
 
 def add_message(user_id: int, role: str, content: str):
     """Agrega un mensaje al contexto del usuario
-    
+
     Args:
         user_id: ID del usuario
         role: "user" o "assistant"
         content: Contenido del mensaje
-    
-    if user_id in user_contexts:
-        user_contexts[user_id]["mensajes"].append({
-            "role": role,
-            "content": content
-        })
-        
-        # Mantener solo los últimos MAX_MESSAGES
-        if len(user_contexts[user_id]["mensajes"]) > MAX_MESSAGES:
-            user_contexts[user_id]["mensajes"] = user_contexts[user_id]["mensajes"][-MAX_MESSAGES:]
     """
+    contexto = user_contexts.peek(user_id) or get_user_context(user_id)
+    if contexto is None:
+        return
+
+    mensaje = {"role": role, "content": content}
+    contexto["mensajes"].append(mensaje)
+
+    # Mantener solo los últimos MAX_MESSAGES (normalmente el resumen los pliega antes)
+    if len(contexto["mensajes"]) > MAX_MESSAGES:
+        contexto["mensajes"] = contexto["mensajes"][-MAX_MESSAGES:]
+    contexto["formateado"] = None
+    # Se vuelve a guardar para que el store recalcule el tamaño
+    user_contexts.set(user_id, contexto)
+
+    with _lock:
+        pendiente = _pendientes.setdefault(user_id, _nuevo_pendiente(contexto["nombre"], contexto["apellido"]))
+        pendiente["mensajes"].append(mensaje)
+        total = sum(len(p["mensajes"]) for p in _pendientes.values())
+    _iniciar_escritor()
+    _hay_pendientes.set()
+    if total >= CONTEXT_FLUSH_LOTE:
+        _lote_lleno.set()
+
+    # Al cerrar un turno se ve si ya hay turnos viejos para plegar en el resumen
+    if role == "assistant":
+        _programar_resumen(user_id, contexto)
+
 def get_conversation_history(user_id: int) -> List[Dict]:
     """Obtiene el historial de mensajes de un usuario"""
-    context = user_contexts.get(user_id)
+    context = get_user_context(user_id)
     if context:
         return context["mensajes"]
     return []
 
 def clear_context(user_id: int):
-    """Elimina el contexto de un usuario (logout o fin de sesión)"""
-    if user_id in user_contexts:
-        del user_contexts[user_id]
+    """Elimina el contexto de un usuario (logout o fin de sesión), en todos los workers"""
+    with _lock_escritura:
+        with _lock:
+            _pendientes.pop(user_id, None)
+        user_contexts.delete(user_id)
+        db = SessionLocal()
+        try:
+            db.execute(delete(MensajeConversacion).where(MensajeConversacion.id_usuario == user_id))
+            # La versión sigue subiendo (no se borra la fila) para que ningún
+            # worker confunda su copia vieja con la conversación nueva
+            db.execute(
+                update(Conversacion)
+                .where(Conversacion.id_usuario == user_id)
+                .values(version=Conversacion.version + 1)
+            )
+            db.commit()
+        finally:
+            db.close()
+
+def _recortar(texto: str, tokens: int) -> str:
+    """Recorta el texto al presupuesto de tokens (se queda con el principio)"""
+    maximo = max(0, tokens * 4)
+    if len(texto) <= maximo:
+        return texto
+    return texto[:maximo].rstrip() + "…"
+
+def _repartir(tamanos: List[int], presupuesto: int) -> List[int]:
+    """
+    Reparte el presupuesto entre los mensajes: los que entran enteros se
+    quedan con lo suyo y lo que sobra se divide en partes iguales entre el resto
+    """
+    cupos = list(tamanos)
+    restantes = len(tamanos)
+    for i in sorted(range(len(tamanos)), key=lambda i: tamanos[i]):
+        cupo = max(0, presupuesto) // restantes
+        cupos[i] = min(tamanos[i], cupo)
+        presupuesto -= cupos[i]
+        restantes -= 1
+    return cupos
+
+def _formatear(contexto: Dict) -> str:
+    mensajes = contexto["mensajes"]
+    literales = min(2 * HISTORIAL_TURNOS_LITERALES, len(mensajes))
+    encabezado = "\n\nHISTORIAL DE CONVERSACIÓN:\n"
+    presupuesto = HISTORIAL_MAX_TOKENS - estimar_tokens(encabezado)
+    resumen = ""
+    if contexto.get("resumen"):
+        # El resumen no se come más de un tercio del presupuesto
+        resumen = _recortar(contexto["resumen"], presupuesto // 3)
+        presupuesto -= estimar_tokens(resumen)
+
+    # De los mensajes más nuevos a los más viejos: los de los últimos turnos
+    # van siempre, repartiéndose lo que queda (las respuestas largas se
+    # recortan); los anteriores solo si entran enteros
+    todas = [
+        f"{'Usuario' if msg['role'] == 'user' else 'Asistente'}: {msg['content']}"
+        for msg in reversed(mensajes)
+    ]
+    cupos = _repartir([estimar_tokens(linea) for linea in todas[:literales]], presupuesto)
+    lineas = []
+    for posicion, linea in enumerate(todas):
+        tokens = estimar_tokens(linea)
+        if posicion < literales:
+            if tokens > cupos[posicion]:
+                linea = _recortar(linea, cupos[posicion])
+                tokens = estimar_tokens(linea)
+        elif tokens > presupuesto:
+            break
+        lineas.append(linea)
+        presupuesto -= tokens
+
+    if not resumen and not lineas:
+        return ""
+
+    formatted = encabezado
+    if resumen:
+        formatted += f"Resumen de lo conversado antes: {resumen}\n"
+    for linea in reversed(lineas):
+        formatted += f"{linea}\n"
+    return formatted
 
 def format_history_for_prompt(user_id: int) -> str:
-    """Formatea el historial de conversación para incluir en el prompt"""
-    history = get_conversation_history(user_id)
-    
-    if not history:
+    """
+    Formatea el historial de conversación para incluir en el prompt, dentro
+    de HISTORIAL_MAX_TOKENS. Se guarda formateado hasta que cambie.
+
+    Usa la copia en memoria que ya validó obtener_contexto en este request.
+    """
+    contexto = user_contexts.peek(user_id)
+    if not contexto:
         return ""
-    
-    formatted = "\n\nHISTORIAL DE CONVERSACIÓN:\n"
-    for msg in history:
-        if msg["role"] == "user":
-            formatted += f"Usuario: {msg['content']}\n"
-        else:
-            formatted += f"Asistente: {msg['content']}\n"
-    
-    return formatted
\ No newline at end of file
+
+    if contexto.get("formateado") is not None:
+        _stats["historial_cacheado"] += 1
+        return contexto["formateado"]
+
+    contexto["formateado"] = _formatear(contexto)
+    _stats["historial_formateado"] += 1
+    # Se vuelve a guardar para que el store cuente el texto formateado en su tamaño
+    user_contexts.set(user_id, contexto)
+    return contexto["formateado"]
+
+async def generar_resumen(resumen_anterior: str, mensajes: List[Dict]) -> str:
+    """Pliega mensajes viejos de la conversación en el resumen (vacío si falla)"""
+    conversacion = "\n".join(
+        f"{'Usuario' if m['role'] == 'user' else 'Asistente'}: {_recortar(m['content'], HISTORIAL_MAX_TOKENS)}"
+        for m in mensajes
+    )
+    prompt = f"""Resumí en no más de 80 palabras, en español, la conversación entre un afiliado de PAMI y el asistente. Conservá qué trámites se consultaron, los datos que dio el usuario y lo que quedó pendiente. Respondé solo con el resumen.
+
+Resumen anterior: {resumen_anterior or "(ninguno)"}
+
+Mensajes nuevos:
+{conversacion}"""
+    try:
+        response = await generate({"prompt": prompt, "stream": False}, backend="resumen")
+        if response.status_code != 200:
+            print(f"⚠️ Error en Ollama resumiendo el historial: {response.status_code}")
+            return ""
+        return response.json().get("response", "").strip()
+    except Exception as e:
+        print(f"❌ Error resumiendo el historial: {e}")
+        return ""
+
+def _programar_resumen(user_id: int, contexto: Dict):
+    """Lanza en segundo plano el resumen de los turnos viejos, si ya hay suficientes"""
+    viejos = len(contexto["mensajes"]) - 2 * HISTORIAL_TURNOS_LITERALES
+    if viejos < 2 * HISTORIAL_TURNOS_POR_RESUMEN or user_id in _resumiendo:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    _resumiendo.add(user_id)
+    tarea = loop.create_task(_resumir(user_id, contexto))
+    _tareas_resumen.add(tarea)
+    tarea.add_done_callback(_tareas_resumen.discard)
+
+async def _resumir(user_id: int, contexto: Dict):
+    try:
+        viejos = contexto["mensajes"][:-2 * HISTORIAL_TURNOS_LITERALES]
+        resumen = await generar_resumen(contexto.get("resumen", ""), viejos)
+        if not resumen:
+            _stats["errores_resumen"] += 1
+            return
+
+        # Se aplica solo si la conversación no se recargó ni se recortó mientras tanto
+        actual = user_contexts.peek(user_id)
+        if (
+            actual is not contexto
+            or len(contexto["mensajes"]) < len(viejos)
+            or any(a is not b for a, b in zip(contexto["mensajes"], viejos))
+        ):
+            return
+        contexto["resumen"] = resumen
+        contexto["mensajes"] = contexto["mensajes"][len(viejos):]
+        contexto["formateado"] = None
+        user_contexts.set(user_id, contexto)
+
+        with _lock:
+            pendiente = _pendientes.setdefault(user_id, _nuevo_pendiente(contexto["nombre"], contexto["apellido"]))
+            pendiente["resumen"] = resumen
+            pendiente["resumidos"] += len(viejos)
+        _iniciar_escritor()
+        _hay_pendientes.set()
+        _stats["resumenes"] += 1
+        print(f"📝 Historial del usuario {user_id}: {len(viejos)} mensajes plegados en el resumen")
+    finally:
+        _resumiendo.discard(user_id)
+
+def _escribir_lote() -> int:
+    """Escribe en una transacción todos los mensajes pendientes; devuelve cuántos"""
+    with _lock_escritura:
+        with _lock:
+            lote = dict(_pendientes)
+            _pendientes.clear()
+            _hay_pendientes.clear()
+            _lote_lleno.clear()
+        if not lote:
+            return 0
+
+        versiones = {}
+        db = SessionLocal()
+        try:
+            for user_id, pendiente in lote.items():
+                # Incremento atómico: si dos workers escriben a la vez, cada uno ve la versión del otro
+                resultado = db.execute(
+                    update(Conversacion)
+                    .where(Conversacion.id_usuario == user_id)
+                    .values(version=Conversacion.version + 1)
+                )
+                if resultado.rowcount == 0:
+                    db.add(Conversacion(
+                        id_usuario=user_id,
+                        nombre=pendiente["nombre"],
+                        apellido=pendiente["apellido"],
+                        version=1
+                    ))
+                    versiones[user_id] = 0
+                else:
+                    versiones[user_id] = db.execute(
+                        select(Conversacion.version).where(Conversacion.id_usuario == user_id)
+                    ).scalar() - 1
+                for mensaje in pendiente["mensajes"]:
+                    db.add(MensajeConversacion(id_usuario=user_id, rol=mensaje["role"], contenido=mensaje["content"]))
+                db.flush()
+
+                if pendiente["resumen"] is not None:
+                    # El resumen nuevo reemplaza al anterior y a los mensajes que pliega
+                    plegados = (
+                        select(MensajeConversacion.id_mensaje)
+                        .where(MensajeConversacion.id_usuario == user_id, MensajeConversacion.rol != ROL_RESUMEN)
+                        .order_by(MensajeConversacion.id_mensaje)
+                        .limit(pendiente["resumidos"])
+                    )
+                    db.execute(
+                        delete(MensajeConversacion)
+                        .where(
+                            MensajeConversacion.id_usuario == user_id,
+                            or_(MensajeConversacion.rol == ROL_RESUMEN, MensajeConversacion.id_mensaje.in_(plegados))
+                        )
+                    )
+                    db.add(MensajeConversacion(id_usuario=user_id, rol=ROL_RESUMEN, contenido=pendiente["resumen"]))
+                    db.flush()
+
+                # En la base tampoco se guardan más de MAX_MESSAGES por usuario
+                recientes = (
+                    select(MensajeConversacion.id_mensaje)
+                    .where(MensajeConversacion.id_usuario == user_id, MensajeConversacion.rol != ROL_RESUMEN)
+                    .order_by(MensajeConversacion.id_mensaje.desc())
+                    .limit(MAX_MESSAGES)
+                )
+                db.execute(
+                    delete(MensajeConversacion)
+                    .where(
+                        MensajeConversacion.id_usuario == user_id,
+                        MensajeConversacion.rol != ROL_RESUMEN,
+                        MensajeConversacion.id_mensaje.not_in(recientes)
+                    )
+                )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            _stats["errores"] += 1
+            print(f"❌ Error guardando el historial de conversación: {e}")
+            # Se devuelven a la cola (antes que los que llegaron mientras tanto)
+            with _lock:
+                for user_id, pendiente in lote.items():
+                    nuevo = _pendientes.get(user_id)
+                    if nuevo is not None:
+                        pendiente["mensajes"].extend(nuevo["mensajes"])
+                        if nuevo["resumen"] is not None:
+                            pendiente["resumen"] = nuevo["resumen"]
+                            pendiente["resumidos"] += nuevo["resumidos"]
+                    _pendientes[user_id] = pendiente
+                _hay_pendientes.set()
+            return 0
+        finally:
+            db.close()
+
+        # La copia en memoria sigue siendo válida si nadie más escribió en el medio
+        for user_id, version_anterior in versiones.items():
+            contexto = user_contexts.peek(user_id)
+            if contexto is not None:
+                contexto["version"] = version_anterior + 1 if contexto["version"] == version_anterior else None
+
+        escritos = sum(len(p["mensajes"]) for p in lote.values())
+        _stats["lotes"] += 1
+        _stats["mensajes_escritos"] += escritos
+        return escritos
+
+def _escribir_en_segundo_plano():
+    while True:
+        _hay_pendientes.wait()
+        # Espera a juntar más mensajes en el lote, salvo que ya esté lleno o se esté cerrando
+        _lote_lleno.wait(CONTEXT_FLUSH_SEGUNDOS)
+        _escribir_lote()
+        if _cerrando:
+            return
+
+def _iniciar_escritor():
+    global _escritor
+    if _escritor is None or not _escritor.is_alive():
+        with _lock:
+            if _escritor is None or not _escritor.is_alive():
+                _escritor = threading.Thread(target=_escribir_en_segundo_plano, name="historial-writer", daemon=True)
+                _escritor.start()
+
+def cerrar_historial():
+    """Escribe los mensajes pendientes y detiene el escritor (shutdown de la app)"""
+    global _cerrando, _escritor
+    _cerrando = True
+    _hay_pendientes.set()
+    _lote_lleno.set()
+    if _escritor is not None:
+        _escritor.join(timeout=10)
+        _escritor = None
+    _escribir_lote()
+
+def get_historial_stats() -> Dict:
+    with _lock:
+        pendientes = sum(len(p["mensajes"]) for p in _pendientes.values())
+    return {"mensajes_pendientes": pendientes, **_stats}
@@ -0,0 +1,89 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+# Tamaño máximo de lote y cuánto se espera a que lleguen más consultas.
+# Como search_tramites corre en el pool de utils/executor.py, nunca hay más
+# consultas simultáneas que VECTOR_STORE_THREADS.
+EMBEDDING_BATCH_MAX = int(os.getenv("EMBEDDING_BATCH_MAX", 16))
+EMBEDDING_BATCH_ESPERA_MS = float(os.getenv("EMBEDDING_BATCH_ESPERA_MS", 5))
+
+class EmbeddingBatcher:
+    """
+    Junta las consultas que llegan con pocos milisegundos de diferencia y las
+    embebe en una sola pasada del modelo, devolviendo a cada hilo su vector
+    """
+
+    def __init__(
+        self,
+        get_embedding_function: Callable[[], Callable[[List[str]], List]],
+        max_lote: int = EMBEDDING_BATCH_MAX,
+        max_espera_ms: float = EMBEDDING_BATCH_ESPERA_MS
+    ):
+        self._get_embedding_function = get_embedding_function
+        self.max_lote = max_lote
+        self.max_espera = max_espera_ms / 1000
+        self._cola: "queue.Queue" = queue.Queue()
+        self._hilo: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._lotes = 0
+        self._textos = 0
+        self._max_lote_visto = 0
+        self._segundos_embebiendo = 0.0
+
+    def embed(self, texto: str) -> List[float]:
+        """Devuelve el embedding de un texto (bloquea hasta que su lote se procese)"""
+        futuro: Future = Future()
+        self._asegurar_hilo()
+        self._cola.put((texto, futuro))
+        return futuro.result()
+
+    def _asegurar_hilo(self):
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._procesar, name="embedding-batcher", daemon=True)
+                self._hilo.start()
+
+    def _procesar(self):
+        while True:
+            lote = [self._cola.get()]
+            limite = time.monotonic() + self.max_espera
+
+            while len(lote) < self.max_lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(self._cola.get(timeout=restante))
+                except queue.Empty:
+                    break
+
+            inicio = time.perf_counter()
+            try:
+                embeddings = self._get_embedding_function()([texto for texto, _ in lote])
+                for (_, futuro), embedding in zip(lote, embeddings):
+                    futuro.set_result(embedding)
+            except Exception as e:
+                for _, futuro in lote:
+                    futuro.set_exception(e)
+
+            with self._lock:
+                self._lotes += 1
+                self._textos += len(lote)
+                self._max_lote_visto = max(self._max_lote_visto, len(lote))
+                self._segundos_embebiendo += time.perf_counter() - inicio
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "max_lote": self.max_lote,
+                "max_espera_ms": self.max_espera * 1000,
+                "lotes": self._lotes,
+                "textos": self._textos,
+                "lote_promedio": round(self._textos / self._lotes, 2) if self._lotes else 0.0,
+                "lote_maximo": self._max_lote_visto,
+                "embeddings_por_segundo": round(self._textos / self._segundos_embebiendo, 1) if self._segundos_embebiendo else 0.0,
+            }
@@ -0,0 +1,150 @@
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+from chromadb.utils import embedding_functions
+
+# Backend de embeddings de la base vectorial:
+# - "onnx": all-MiniLM-L6-v2 en ONNX (mismos vectores que el default de ChromaDB)
+# - "onnx-int8": el mismo modelo cuantizado a int8 (más rápido en CPU, vectores aproximados)
+# - "sentence-transformers": all-MiniLM-L6-v2 con PyTorch
+# - "ollama": endpoint /api/embed del nodo de IA
+# Al cambiar de backend hay que re-indexar con /admin/scrape-all: los vectores
+# de un backend no son comparables con los de otro.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://nodo-ia:11434")
+OLLAMA_EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+
+def _normalizar(vectores: np.ndarray) -> np.ndarray:
+    normas = np.linalg.norm(vectores, axis=1, keepdims=True)
+    normas[normas == 0] = 1e-12
+    return vectores / normas
+
+class ONNXMiniLM(embedding_functions.ONNXMiniLM_L6_V2):
+    """
+    El embedder ONNX de ChromaDB, pero rellenando cada lote solo hasta la
+    consulta más larga en lugar de siempre a 256 tokens. Con la máscara de
+    atención los vectores son los mismos y en CPU es varias veces más rápido.
+    """
+
+    modelo_archivo = "model.onnx"
+
+    def _init_model_and_tokenizer(self) -> None:
+        if self.model is None and self.tokenizer is None:
+            carpeta = os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME)
+            self.tokenizer = self.Tokenizer.from_file(os.path.join(carpeta, "tokenizer.json"))
+            self.tokenizer.enable_truncation(max_length=256)
+            self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+            self.model = self.ort.InferenceSession(
+                self._preparar_modelo(carpeta),
+                providers=["CPUExecutionProvider"]
+            )
+
+    def _preparar_modelo(self, carpeta: str) -> str:
+        return os.path.join(carpeta, self.modelo_archivo)
+
+    def _forward(self, documents: List[str], batch_size: int = 32) -> np.ndarray:
+        todos = []
+        for i in range(0, len(documents), batch_size):
+            encoded = self.tokenizer.encode_batch(list(documents[i:i + batch_size]))
+            input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+            salida = self.model.run(None, {
+                "input_ids": input_ids,
+                "attention_mask": attention_mask,
+                "token_type_ids": np.zeros_like(input_ids),
+            })
+            # Mean pooling con la máscara de atención, igual que el original
+            mascara = np.expand_dims(attention_mask, -1)
+            embeddings = (salida[0] * mascara).sum(1) / np.clip(mascara.sum(1), 1e-9, None)
+            todos.append(_normalizar(embeddings).astype(np.float32))
+        return np.concatenate(todos)
+
+class ONNXMiniLMInt8(ONNXMiniLM):
+    """Igual que ONNXMiniLM pero con los pesos cuantizados dinámicamente a int8"""
+
+    modelo_archivo = "model_int8.onnx"
+
+    def _preparar_modelo(self, carpeta: str) -> str:
+        destino = os.path.join(carpeta, self.modelo_archivo)
+        if not os.path.exists(destino):
+            try:
+                from onnxruntime.quantization import quantize_dynamic, QuantType
+            except ImportError:
+                raise ValueError("Para onnx-int8 se necesita el paquete onnx (pip install onnx)")
+            print("⚙️ Cuantizando el modelo de embeddings a int8...")
+            quantize_dynamic(
+                os.path.join(carpeta, "model.onnx"),
+                destino,
+                weight_type=QuantType.QInt8
+            )
+        return destino
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self._model = SentenceTransformer(model_name, device="cpu")
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        return self._model.encode(
+            list(input),
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        ).tolist()
+
+class OllamaEmbedder:
+    """Embeddings del nodo de IA; se normalizan para usar los mismos umbrales de distancia"""
+
+    def __init__(self, base_url: str, model: str):
+        self._url = f"{base_url}/api/embed"
+        self._model = model
+        self._client = httpx.Client(timeout=60.0)
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        response = self._client.post(self._url, json={"model": self._model, "input": list(input)})
+        response.raise_for_status()
+        vectores = np.array(response.json()["embeddings"], dtype=np.float32)
+        return _normalizar(vectores).tolist()
+
+BACKENDS: Dict[str, Callable[[], Callable]] = {
+    "onnx": ONNXMiniLM,
+    "onnx-int8": ONNXMiniLMInt8,
+    "sentence-transformers": lambda: SentenceTransformerEmbedder(EMBEDDING_MODEL),
+    "ollama": lambda: OllamaEmbedder(OLLAMA_BASE_URL, OLLAMA_EMBED_MODEL),
+}
+
+class LazyEmbeddingFunction:
+    """
+    Embedding function para ChromaDB que recién crea (y carga) el backend
+    la primera vez que hay que embeber algo
+    """
+
+    def __init__(self, backend: str):
+        if backend not in BACKENDS:
+            raise ValueError(f"EMBEDDING_BACKEND desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+        self.backend = backend
+        self._embedder: Optional[Callable] = None
+        self._lock = threading.Lock()
+
+    def _get_embedder(self) -> Callable:
+        if self._embedder is None:
+            with self._lock:
+                if self._embedder is None:
+                    print(f"📦 Cargando backend de embeddings: {self.backend}")
+                    self._embedder = BACKENDS[self.backend]()
+        return self._embedder
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        return self._get_embedder()(input)
+
+_embedding_function: Optional[LazyEmbeddingFunction] = None
+
+def get_embedding_function() -> LazyEmbeddingFunction:
+    """Embedding function configurada en EMBEDDING_BACKEND (singleton, carga perezosa)"""
+    global _embedding_function
+    if _embedding_function is None:
+        _embedding_function = LazyEmbeddingFunction(EMBEDDING_BACKEND)
+    return _embedding_function
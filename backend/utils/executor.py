@@ -0,0 +1,133 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+# Hilos dedicados a las operaciones bloqueantes de la base vectorial
+# (embedding de la consulta, queries e inserts en ChromaDB)
+VECTOR_STORE_THREADS = int(os.getenv("VECTOR_STORE_THREADS", 4))
+
+# Procesos para el trabajo de CPU de los scrapings masivos (parseo del HTML),
+# que con hilos quedaría serializado por el GIL. Con 0 se ejecuta en un hilo
+# del proceso principal.
+SCRAPER_PARSE_WORKERS = int(os.getenv("SCRAPER_PARSE_WORKERS", min(4, os.cpu_count() or 1)))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_lock = threading.Lock()
+_lock = threading.Lock()
+_stats = {
+    "en_cola": 0,
+    "en_curso": 0,
+    "completadas": 0,
+    "max_en_cola": 0,
+    "espera_total_ms": 0.0,
+}
+
+def get_executor() -> ThreadPoolExecutor:
+    """Obtiene el pool de hilos de la base vectorial (singleton)"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=VECTOR_STORE_THREADS,
+            thread_name_prefix="vector-store"
+        )
+    return _executor
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """
+    Ejecuta una función bloqueante en el pool dedicado y la espera sin trabar el event loop
+
+    Args:
+        func: Función sincrónica (ej: search_tramites, add_tramite)
+
+    Returns:
+        Lo que devuelva func
+    """
+    encolada = time.perf_counter()
+    with _lock:
+        _stats["en_cola"] += 1
+        _stats["max_en_cola"] = max(_stats["max_en_cola"], _stats["en_cola"])
+
+    def tarea():
+        with _lock:
+            _stats["en_cola"] -= 1
+            _stats["en_curso"] += 1
+            _stats["espera_total_ms"] += (time.perf_counter() - encolada) * 1000
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with _lock:
+                _stats["en_curso"] -= 1
+                _stats["completadas"] += 1
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), tarea)
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Obtiene el pool de procesos (singleton). Usa spawn: el proceso principal
+    ya tiene hilos corriendo y hacer fork con hilos puede dejar locks tomados.
+    """
+    global _process_pool
+    with _process_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=SCRAPER_PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+def _descartar_process_pool(pool: ProcessPoolExecutor):
+    global _process_pool
+    with _process_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False)
+
+async def run_in_process(func: Callable, *args) -> Any:
+    """
+    Ejecuta una función de CPU en el pool de procesos. func y sus argumentos
+    tienen que poder serializarse (funciones de módulo, tipos básicos).
+    
+    Si SCRAPER_PARSE_WORKERS es 0, o el pool se rompe (p. ej. un worker muerto
+    por falta de memoria), se ejecuta en un hilo del proceso actual.
+    """
+    if SCRAPER_PARSE_WORKERS <= 0:
+        return await asyncio.to_thread(func, *args)
+    
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        print("⚠️ Pool de procesos roto: se recrea y esta tarea corre en el proceso actual")
+        _descartar_process_pool(pool)
+        return await asyncio.to_thread(func, *args)
+
+def get_executor_stats() -> Dict:
+    """Profundidad de la cola y tiempos de espera del pool"""
+    with _lock:
+        completadas = _stats["completadas"]
+        return {
+            "hilos": VECTOR_STORE_THREADS,
+            "en_cola": _stats["en_cola"],
+            "en_curso": _stats["en_curso"],
+            "max_en_cola": _stats["max_en_cola"],
+            "completadas": completadas,
+            "espera_promedio_ms": round(_stats["espera_total_ms"] / completadas, 2) if completadas else 0.0,
+        }
+
+def shutdown_executor():
+    """Libera los hilos y los procesos (shutdown de la app)"""
+    global _executor, _process_pool
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
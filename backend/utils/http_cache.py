@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+# Caché en disco de las páginas scrapeadas: un JSON por URL con el HTML y los
+# validadores (ETag / Last-Modified) para pedir la página con GET condicional.
+# Cada entrada lleva además el hash del trámite que salió de parsear ese HTML:
+# un 304 solo evita el reparseo si el trámite indexado tiene ese mismo hash.
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", "/app/database/http_cache")
+
+_lock = threading.Lock()
+_stats = {
+    "lecturas": 0,
+    "aciertos": 0,
+    "guardadas": 0,
+}
+
+def _ruta(url: str) -> str:
+    return os.path.join(HTTP_CACHE_DIR, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+def leer(url: str) -> Optional[Dict]:
+    """
+    Entrada guardada para una URL
+
+    Returns:
+        {url, body, etag, last_modified, hash_contenido, guardado} o None si no está
+    """
+    with _lock:
+        _stats["lecturas"] += 1
+    try:
+        with open(_ruta(url), "r", encoding="utf-8") as f:
+            entrada = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"⚠️ Entrada de caché HTTP ilegible para {url}: {e}")
+        return None
+    with _lock:
+        _stats["aciertos"] += 1
+    return entrada
+
+def guardar(
+    url: str,
+    body: str,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+    hash_contenido: Optional[str] = None
+):
+    """Guarda (o reemplaza) la página de una URL. Un error de disco no corta el scraping."""
+    _escribir({
+        "url": url,
+        "body": body,
+        "etag": etag,
+        "last_modified": last_modified,
+        "hash_contenido": hash_contenido,
+        "guardado": time.time(),
+    })
+
+def anotar_hash_contenido(url: str, hash_contenido: str):
+    """Registra el hash del trámite parseado a partir del HTML guardado de la URL"""
+    entrada = leer(url)
+    if entrada is None or entrada.get("hash_contenido") == hash_contenido:
+        return
+    entrada["hash_contenido"] = hash_contenido
+    _escribir(entrada)
+
+def _escribir(entrada: Dict):
+    url = entrada["url"]
+    ruta = _ruta(url)
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(HTTP_CACHE_DIR, exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entrada, f, ensure_ascii=False)
+        os.replace(tmp, ruta)
+        with _lock:
+            _stats["guardadas"] += 1
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar en la caché HTTP {url}: {e}")
+
+def headers_condicionales(entrada: Optional[Dict]) -> Dict[str, str]:
+    """If-None-Match / If-Modified-Since a partir de una entrada guardada"""
+    headers = {}
+    if entrada:
+        if entrada.get("etag"):
+            headers["If-None-Match"] = entrada["etag"]
+        if entrada.get("last_modified"):
+            headers["If-Modified-Since"] = entrada["last_modified"]
+    return headers
+
+def get_http_cache_stats() -> Dict:
+    with _lock:
+        return {"directorio": HTTP_CACHE_DIR, **_stats}
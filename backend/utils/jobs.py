@@ -0,0 +1,365 @@
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, case, or_, text, update
+
+from db.connection import SessionLocal
+from models.job import Job
+
+# Cada cuánto un job en curso guarda su checkpoint y avisa que sigue vivo, y
+# cuánto tiempo sin latidos hace falta para darlo por colgado y retomarlo
+JOB_LATIDO_SEGUNDOS = float(os.getenv("JOB_LATIDO_SEGUNDOS", 5))
+JOB_COLGADO_SEGUNDOS = float(os.getenv("JOB_COLGADO_SEGUNDOS", 30))
+# Caídas (el proceso murió o dejó de latir) después de las cuales un job se
+# abandona. Soltarlo en un shutdown ordenado no cuenta.
+JOB_MAX_INTENTOS = int(os.getenv("JOB_MAX_INTENTOS", 3))
+
+ESTADOS_ACTIVOS = ("pendiente", "en_curso")
+
+# Identifica a este proceso cuando reclama un job (puede haber varios workers de uvicorn)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_tipos: Dict[str, Callable[["JobContext"], Awaitable[Dict]]] = {}
+_tareas: Dict[str, asyncio.Task] = {}
+_supervisor: Optional[asyncio.Task] = None
+
+class JobPerdido(Exception):
+    """Otro proceso reclamó el job (este dejó de latir a tiempo)"""
+
+class JobActivo(Exception):
+    """Ya hay un job de ese tipo pendiente o en curso (y se pidió que sea exclusivo)"""
+
+    def __init__(self, job_id: str):
+        super().__init__(job_id)
+        self.job_id = job_id
+
+class JobContext:
+    """
+    Lo que ve el código de un job: sus parámetros, el checkpoint a retomar y
+    el avance. El job modifica checkpoint y progreso en memoria; el runner los
+    guarda en cada latido.
+    """
+
+    def __init__(self, job_id: str, parametros: Dict, checkpoint: Dict, progreso: Dict):
+        self.job_id = job_id
+        self.parametros = parametros
+        self.checkpoint = checkpoint
+        self.progreso = progreso
+        # El throughput se calcula sobre lo hecho en esta corrida
+        self.progreso["corrida_desde"] = time.time()
+        self.progreso["completados_al_retomar"] = self.progreso.get("completados", 0)
+
+    def avanzar(self, completados: int = 1):
+        self.progreso["completados"] = self.progreso.get("completados", 0) + completados
+
+    def serializar(self):
+        # Se serializa en el event loop, donde el job modifica estos dicts
+        return json.dumps(self.checkpoint, ensure_ascii=False), json.dumps(self.progreso, ensure_ascii=False)
+
+    async def guardar(self, soltar: bool = False):
+        """Guarda checkpoint y avance ya (además de en cada latido)"""
+        await asyncio.to_thread(_latir, self.job_id, *self.serializar(), soltar)
+
+def registrar_tipo(tipo: str, funcion: Callable[[JobContext], Awaitable[Dict]]):
+    """Asocia un tipo de job con la corrutina que lo ejecuta (devuelve el resultado)"""
+    _tipos[tipo] = funcion
+
+def _ahora() -> datetime:
+    return datetime.utcnow()
+
+def _a_dict(job: Job) -> Dict:
+    return {
+        "id": job.id,
+        "tipo": job.tipo,
+        "estado": job.estado,
+        "parametros": json.loads(job.parametros or "{}"),
+        "checkpoint": json.loads(job.checkpoint or "{}"),
+        "progreso": json.loads(job.progreso or "{}"),
+        "resultado": json.loads(job.resultado) if job.resultado else None,
+        "error": job.error,
+        "worker": job.worker,
+        "latido": job.latido,
+        "intentos": job.intentos,
+        "creado": job.creado,
+        "iniciado": job.iniciado,
+        "terminado": job.terminado,
+    }
+
+def _crear(tipo: str, parametros: Dict, exclusivo: bool = False) -> str:
+    db = SessionLocal()
+    try:
+        if exclusivo:
+            # Toma el lock de escritura de SQLite antes de mirar: nadie puede
+            # insertar otro job entre la verificación y el INSERT
+            db.execute(text("BEGIN IMMEDIATE"))
+            activo = db.query(Job.id).filter(Job.tipo == tipo, Job.estado.in_(ESTADOS_ACTIVOS)).first()
+            if activo:
+                db.rollback()
+                raise JobActivo(activo.id)
+        job = Job(
+            id=uuid.uuid4().hex,
+            tipo=tipo,
+            estado="pendiente",
+            parametros=json.dumps(parametros, ensure_ascii=False),
+            checkpoint="{}",
+            progreso="{}",
+            intentos=0
+        )
+        db.add(job)
+        db.commit()
+        return job.id
+    finally:
+        db.close()
+
+def _reclamar(job_id: str) -> Optional[Dict]:
+    """
+    Toma el job para este proceso si está pendiente o si quien lo corría dejó
+    de latir. El UPDATE condicional hace que solo un proceso lo consiga.
+    Solo se cuenta un intento más si el anterior se cayó (latido vencido),
+    no si se soltó en un shutdown ordenado (latido en None).
+    """
+    limite = _ahora() - timedelta(seconds=JOB_COLGADO_SEGUNDOS)
+    db = SessionLocal()
+    try:
+        resultado = db.execute(
+            update(Job)
+            .where(
+                Job.id == job_id,
+                or_(
+                    Job.estado == "pendiente",
+                    and_(Job.estado == "en_curso", or_(Job.latido.is_(None), Job.latido < limite))
+                )
+            )
+            .values(
+                estado="en_curso",
+                worker=WORKER_ID,
+                latido=_ahora(),
+                intentos=case(
+                    (and_(Job.estado == "en_curso", Job.latido.is_not(None)), Job.intentos + 1),
+                    else_=Job.intentos
+                ),
+                iniciado=_ahora()
+            )
+        )
+        db.commit()
+        if resultado.rowcount != 1:
+            return None
+        return _a_dict(db.get(Job, job_id))
+    finally:
+        db.close()
+
+def _latir(job_id: str, checkpoint: str, progreso: str, soltar: bool = False):
+    """
+    Guarda checkpoint y avance si el job sigue siendo de este proceso.
+    Con soltar=True además borra el latido para que se retome enseguida.
+    """
+    db = SessionLocal()
+    try:
+        resultado = db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.worker == WORKER_ID, Job.estado == "en_curso")
+            .values(
+                checkpoint=checkpoint,
+                progreso=progreso,
+                latido=None if soltar else _ahora()
+            )
+        )
+        db.commit()
+        if resultado.rowcount != 1:
+            raise JobPerdido(job_id)
+    finally:
+        db.close()
+
+def _terminar(job_id: str, estado: str, progreso: str, resultado: Optional[Dict] = None, error: Optional[str] = None):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.worker == WORKER_ID)
+            .values(
+                estado=estado,
+                progreso=progreso,
+                resultado=json.dumps(resultado, ensure_ascii=False, default=str) if resultado is not None else None,
+                error=error,
+                latido=_ahora(),
+                terminado=_ahora()
+            )
+        )
+        db.commit()
+    finally:
+        db.close()
+
+def _candidatos() -> List[Job]:
+    """Jobs pendientes o colgados que este proceso no está corriendo"""
+    limite = _ahora() - timedelta(seconds=JOB_COLGADO_SEGUNDOS)
+    db = SessionLocal()
+    try:
+        jobs = db.query(Job).filter(
+            or_(
+                Job.estado == "pendiente",
+                and_(Job.estado == "en_curso", or_(Job.latido.is_(None), Job.latido < limite))
+            )
+        ).all()
+        return [job for job in jobs if job.id not in _tareas]
+    finally:
+        db.close()
+
+async def _ejecutar(job: Dict):
+    job_id = job["id"]
+    contexto = JobContext(job_id, job["parametros"], job["checkpoint"], job["progreso"])
+    tarea_actual = asyncio.current_task()
+
+    async def latir():
+        while True:
+            await asyncio.sleep(JOB_LATIDO_SEGUNDOS)
+            try:
+                await contexto.guardar()
+            except JobPerdido:
+                print(f"⚠️ Job {job_id} reclamado por otro proceso: se detiene acá")
+                tarea_actual.cancel()
+                return
+            except Exception as e:
+                # Un error puntual (p. ej. la base bloqueada) no corta los latidos
+                print(f"⚠️ No se pudo guardar el checkpoint del job {job_id}: {e}")
+
+    latidos = asyncio.create_task(latir())
+    print(f"🏃 Job {job_id} ({job['tipo']}) en curso, {job['intentos']} caídas antes")
+    try:
+        resultado = await _tipos[job["tipo"]](contexto)
+        latidos.cancel()
+        await asyncio.to_thread(_terminar, job_id, "completado", contexto.serializar()[1], resultado)
+        print(f"✅ Job {job_id} completado")
+    except asyncio.CancelledError:
+        # Shutdown (o job perdido): se guarda el checkpoint y se suelta para que otro lo retome
+        latidos.cancel()
+        try:
+            await contexto.guardar(soltar=True)
+        except JobPerdido:
+            pass
+        raise
+    except Exception as e:
+        latidos.cancel()
+        print(f"❌ Job {job_id} falló: {e}")
+        await asyncio.to_thread(_terminar, job_id, "fallido", contexto.serializar()[1], None, str(e))
+    finally:
+        _tareas.pop(job_id, None)
+
+def _lanzar(job: Dict):
+    _tareas[job["id"]] = asyncio.create_task(_ejecutar(job))
+
+async def crear_job(tipo: str, parametros: Dict, exclusivo: bool = False) -> str:
+    """
+    Crea un job y lo empieza a ejecutar en segundo plano en este proceso
+
+    Args:
+        exclusivo: Si ya hay uno del mismo tipo pendiente o en curso se
+                   levanta JobActivo (verificación e INSERT en la misma transacción)
+    """
+    if tipo not in _tipos:
+        raise ValueError(f"Tipo de job desconocido: {tipo}")
+    job_id = await asyncio.to_thread(_crear, tipo, parametros, exclusivo)
+    job = await asyncio.to_thread(_reclamar, job_id)
+    if job:
+        _lanzar(job)
+    return job_id
+
+def obtener_job(job_id: str) -> Optional[Dict]:
+    """
+    Estado del job con su avance, throughput (ítems/minuto en la corrida
+    actual) y ETA estimada
+    """
+    db = SessionLocal()
+    try:
+        job = db.get(Job, job_id)
+        if job is None:
+            return None
+        datos = _a_dict(job)
+    finally:
+        db.close()
+
+    progreso = datos["progreso"]
+    total = progreso.get("total")
+    completados = progreso.get("completados", 0)
+    datos["throughput_por_minuto"] = None
+    datos["eta_segundos"] = None
+    if datos["estado"] == "en_curso" and progreso.get("corrida_desde"):
+        segundos = time.time() - progreso["corrida_desde"]
+        hechos = completados - progreso.get("completados_al_retomar", 0)
+        if segundos > 0 and hechos > 0:
+            por_segundo = hechos / segundos
+            datos["throughput_por_minuto"] = round(por_segundo * 60, 1)
+            if total:
+                datos["eta_segundos"] = round(max(0, total - completados) / por_segundo)
+    return datos
+
+def listar_jobs(limite: int = 20) -> List[Dict]:
+    db = SessionLocal()
+    try:
+        jobs = db.query(Job).order_by(Job.creado.desc()).limit(limite).all()
+        return [
+            {
+                "id": job.id,
+                "tipo": job.tipo,
+                "estado": job.estado,
+                "intentos": job.intentos,
+                "creado": job.creado,
+                "terminado": job.terminado,
+                "error": job.error,
+            }
+            for job in jobs
+        ]
+    finally:
+        db.close()
+
+async def _supervisar():
+    """Retoma los jobs pendientes o colgados (p. ej. por un reinicio) desde su checkpoint"""
+    while True:
+        try:
+            for job in await asyncio.to_thread(_candidatos):
+                # Un en_curso con latido vencido es una caída más (al reclamarlo se suma)
+                caidas = job.intentos + (1 if job.estado == "en_curso" and job.latido is not None else 0)
+                if caidas >= JOB_MAX_INTENTOS:
+                    await asyncio.to_thread(_abandonar, job.id, f"Se abandonó después de {caidas} caídas")
+                    continue
+                reclamado = await asyncio.to_thread(_reclamar, job.id)
+                if reclamado:
+                    print(f"🔁 Retomando job {job.id} desde su checkpoint")
+                    _lanzar(reclamado)
+        except Exception as e:
+            print(f"❌ Error supervisando jobs: {e}")
+        await asyncio.sleep(JOB_LATIDO_SEGUNDOS)
+
+def _abandonar(job_id: str, error: str):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.estado.in_(ESTADOS_ACTIVOS))
+            .values(estado="fallido", error=error, terminado=_ahora())
+        )
+        db.commit()
+    finally:
+        db.close()
+
+def iniciar_jobs():
+    """Arranca el supervisor de jobs (startup de la app)"""
+    global _supervisor
+    if _supervisor is None or _supervisor.done():
+        _supervisor = asyncio.create_task(_supervisar())
+
+async def detener_jobs():
+    """Detiene el supervisor y suelta los jobs en curso con su checkpoint (shutdown)"""
+    global _supervisor
+    if _supervisor is not None:
+        _supervisor.cancel()
+        _supervisor = None
+    tareas = list(_tareas.values())
+    for tarea in tareas:
+        tarea.cancel()
+    await asyncio.gather(*tareas, return_exceptions=True)
@@ -0,0 +1,136 @@
+import math
+import os
+import re
+import time
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+# Cómo se generan las keywords de los trámites: "llm" (Ollama, ver
+# utils/scraper.py) o "tfidf" (TF-IDF sobre el catálogo, sin LLM y en
+# milisegundos por trámite). Se puede elegir en cada corrida.
+KEYWORDS_MODO = os.getenv("KEYWORDS_MODO", "llm")
+MODOS_KEYWORDS = ("llm", "tfidf")
+
+# Con menos documentos que esto las frecuencias de documento no dicen nada
+# (con uno solo todos los términos tienen idf ~0): se ordena solo por TF
+TFIDF_MIN_DOCUMENTOS = int(os.getenv("TFIDF_MIN_DOCUMENTOS", 10))
+
+# Peso de cada campo en la frecuencia de términos: el título describe mejor
+# el trámite que los requisitos
+PESOS_CAMPOS = {
+    "titulo": 3,
+    "descripcion": 2,
+    "quien_puede_realizar": 1,
+    "documentacion_necesaria": 1,
+    "donde_realizar": 1,
+}
+
+STOPWORDS_ES = set("""
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aun cada
+como con contra cual cuales cualquier cuando cuanto de del desde donde dos
+durante e el ella ellas ello ellos en entre era eran es esa esas ese eso esos
+esta estan estar estas este esto estos fue fueron ha habia han hasta hay la
+las le les lo los mas me mi mis mismo mucho muy nada ni no nos nuestra
+nuestro o otra otras otro otros para pero poco por porque puede pueden que
+quien quienes se sea segun ser si sin sobre solo son su sus tambien tan
+tanto te tener tiene tienen todo todos tu tus u un una unas uno unos usted
+ustedes va vez y ya
+podes podra debe deben deberas debera hacer realizar realiza traves caso casos
+tramite tramites pami www http https org ar
+""".split())
+
+_PALABRA = re.compile(r"[a-zñ]+")
+
+def _sin_acentos(texto: str) -> str:
+    # Conserva la ñ: solo se sacan las tildes y diéresis
+    descompuesto = unicodedata.normalize("NFD", texto.lower().replace("ñ", "\0"))
+    return "".join(c for c in descompuesto if unicodedata.category(c) != "Mn").replace("\0", "ñ")
+
+def tokenizar(texto: str) -> List[str]:
+    """Palabras en minúscula y sin tildes, sin stopwords ni palabras de menos de 3 letras"""
+    return [
+        palabra for palabra in _PALABRA.findall(_sin_acentos(texto or ""))
+        if len(palabra) >= 3 and palabra not in STOPWORDS_ES
+    ]
+
+def _textos_campo(valor) -> Iterable[str]:
+    if isinstance(valor, str):
+        yield valor
+    elif isinstance(valor, dict):
+        yield valor.get("texto", "")
+        yield from valor.get("items", [])
+
+def frecuencias(tramite: Dict) -> Counter:
+    """Frecuencia de cada término en el trámite, ponderada por campo"""
+    tf = Counter()
+    for campo, peso in PESOS_CAMPOS.items():
+        for texto in _textos_campo(tramite.get(campo)):
+            for palabra in tokenizar(texto):
+                tf[palabra] += peso
+    return tf
+
+class ExtractorTfidf:
+    """
+    Keywords por TF-IDF: los términos frecuentes en el trámite y poco
+    frecuentes en el resto del catálogo. Las frecuencias de documento se
+    arman una vez con el catálogo y se actualizan con cada trámite nuevo o
+    modificado (la versión nueva reemplaza los términos de la indexada).
+
+    Con un catálogo vacío o chico conviene agregar primero todos los
+    trámites a procesar y recién después extraer; mientras haya menos de
+    TFIDF_MIN_DOCUMENTOS documentos las keywords salen solo por TF.
+    """
+
+    def __init__(self, catalogo: Optional[Iterable[Dict]] = None):
+        self.documentos = 0
+        self.df = Counter()
+        # Términos con los que cuenta cada id en df
+        self._terminos: Dict[str, frozenset] = {}
+        for tramite in catalogo or []:
+            self.agregar(tramite)
+
+    def agregar(self, tramite: Dict):
+        """Suma el trámite a las frecuencias de documento, reemplazando su versión anterior si ya estaba"""
+        tramite_id = tramite.get("id")
+        terminos = frozenset(frecuencias(tramite))
+        anteriores = self._terminos.get(tramite_id)
+        if anteriores == terminos:
+            return
+        if anteriores is not None:
+            self.df.subtract(anteriores)
+            self.documentos -= 1
+        self._terminos[tramite_id] = terminos
+        self.documentos += 1
+        self.df.update(terminos)
+
+    def extraer(self, tramite: Dict, cantidad: int = 7) -> List[str]:
+        self.agregar(tramite)
+        tf = frecuencias(tramite)
+        if self.documentos < TFIDF_MIN_DOCUMENTOS:
+            puntajes = dict(tf)
+        else:
+            puntajes = {
+                palabra: frecuencia * math.log((1 + self.documentos) / (1 + self.df[palabra])) + frecuencia * 1e-3
+                for palabra, frecuencia in tf.items()
+            }
+        # A igual puntaje, el orden de aparición (primero el título)
+        orden = {palabra: i for i, palabra in enumerate(tf)}
+        mejores = sorted(puntajes, key=lambda p: (-puntajes[p], orden[p]))
+        return mejores[:cantidad]
+
+def generar_keywords_tfidf(tramites: List[Dict], catalogo: Optional[Iterable[Dict]] = None, cantidad: int = 7):
+    """
+    Completa metadata.keywords de los trámites con TF-IDF sobre el catálogo
+    (los trámites ya indexados) más los propios trámites
+    """
+    if not tramites:
+        return
+    inicio = time.perf_counter()
+    extractor = ExtractorTfidf(catalogo)
+    for tramite in tramites:
+        extractor.agregar(tramite)
+    for tramite in tramites:
+        tramite["metadata"]["keywords"] = extractor.extraer(tramite, cantidad)
+    segundos = time.perf_counter() - inicio
+    print(f"🔤 Keywords TF-IDF de {len(tramites)} trámites en {segundos * 1000:.0f} ms")
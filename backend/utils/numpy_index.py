@@ -0,0 +1,85 @@
+import threading
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+class NumpyIndex:
+    """
+    Búsqueda exacta en memoria para catálogos chicos: todos los embeddings
+    normalizados en una matriz contigua y los trámites ya decodificados.
+
+    Se recarga solo cuando cambia la versión de la colección.
+    """
+
+    def __init__(self):
+        self._version: Optional[Hashable] = None
+        self._matriz = np.zeros((0, 0), dtype=np.float32)
+        self._tramites: List[Dict] = []
+        self._lock = threading.Lock()
+        self.recargas = 0
+
+    def _asegurar_version(self, version: Hashable, cargar: Callable[[], Tuple[List[List[float]], List[Dict]]]):
+        if self._version == version:
+            return
+        with self._lock:
+            if self._version == version:
+                return
+            embeddings, tramites = cargar()
+            if tramites:
+                matriz = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(len(tramites), -1)
+                normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+                normas[normas == 0] = 1e-12
+                matriz /= normas
+            else:
+                # Colección vacía: reshape(0, -1) no puede deducir la dimensión
+                matriz = np.zeros((0, 0), dtype=np.float32)
+            self._matriz = matriz
+            self._tramites = tramites
+            self._version = version
+            self.recargas += 1
+            print(f"🔄 Índice en memoria cargado: {len(tramites)} trámites")
+
+    def buscar(
+        self,
+        query_embedding: List[float],
+        n_results: int,
+        version: Hashable,
+        cargar: Callable[[], Tuple[List[List[float]], List[Dict]]]
+    ) -> List[Tuple[Dict, float]]:
+        """
+        Top-k por similitud coseno
+
+        Args:
+            query_embedding: Embedding de la consulta
+            n_results: Cantidad de resultados
+            version: Identificador de la versión de la colección
+            cargar: Devuelve (embeddings, trámites) de la colección si hay que recargar
+
+        Returns:
+            Lista de (trámite, distancia) de más a menos relevante. La distancia es
+            2 - 2·coseno, que para vectores normalizados es la L2 al cuadrado que
+            devuelve ChromaDB, así los umbrales valen para los dos motores.
+        """
+        self._asegurar_version(version, cargar)
+        matriz, tramites = self._matriz, self._tramites
+        if not tramites:
+            return []
+
+        consulta = np.asarray(query_embedding, dtype=np.float32)
+        norma = np.linalg.norm(consulta)
+        if norma > 0:
+            consulta = consulta / norma
+
+        similitudes = matriz @ consulta
+        k = min(n_results, len(tramites))
+        mejores = np.argpartition(-similitudes, k - 1)[:k]
+        mejores = mejores[np.argsort(-similitudes[mejores])]
+
+        return [(tramites[i], float(2 - 2 * similitudes[i])) for i in mejores]
+
+    def stats(self) -> Dict:
+        return {
+            "tramites": len(self._tramites),
+            "version": str(self._version) if self._version is not None else None,
+            "recargas": self.recargas,
+        }
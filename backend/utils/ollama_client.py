@@ -0,0 +1,133 @@
+import asyncio
+import httpx
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, AsyncIterator, Optional
+
+# Configuración del nodo de IA (docker-compose define OLLAMA_BASE_URL)
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://nodo-ia:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:3b")
+
+# Cuánto mantiene Ollama el modelo cargado después de cada request; con el
+# modelo en memoria también sigue disponible el contexto (KV) de cada sesión
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_GENERATE_URL = f"{OLLAMA_BASE_URL}/api/generate"
+
+# Pool de conexiones compartido por toda la app
+OLLAMA_MAX_CONEXIONES = int(os.getenv("OLLAMA_MAX_CONEXIONES", 10))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", 10))
+
+# Límite de generaciones simultáneas y timeout de lectura por cada uso del LLM.
+# En nodos sin GPU conviene mantener la concurrencia baja: Ollama encola igual
+# y las generaciones en paralelo solo se pisan entre sí.
+BACKENDS: Dict[str, Dict] = {
+    "chat": {
+        "concurrencia": int(os.getenv("OLLAMA_CONCURRENCIA_CHAT", 2)),
+        "timeout": float(os.getenv("OLLAMA_TIMEOUT_CHAT", 300)),
+    },
+    "keywords": {
+        "concurrencia": int(os.getenv("OLLAMA_CONCURRENCIA_KEYWORDS", 2)),
+        "timeout": float(os.getenv("OLLAMA_TIMEOUT_KEYWORDS", 120)),
+    },
+    # Resúmenes del historial de chat, en segundo plano
+    "resumen": {
+        "concurrencia": int(os.getenv("OLLAMA_CONCURRENCIA_RESUMEN", 1)),
+        "timeout": float(os.getenv("OLLAMA_TIMEOUT_RESUMEN", 120)),
+    },
+}
+
+_client: Optional[httpx.AsyncClient] = None
+_semaforos: Dict[str, asyncio.Semaphore] = {}
+_en_curso: Dict[str, int] = {nombre: 0 for nombre in BACKENDS}
+_esperando: Dict[str, int] = {nombre: 0 for nombre in BACKENDS}
+
+def get_ollama_client() -> httpx.AsyncClient:
+    """Obtiene el cliente HTTP de Ollama con keep-alive (singleton)"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OLLAMA_MAX_CONEXIONES,
+                max_keepalive_connections=OLLAMA_MAX_CONEXIONES
+            ),
+            timeout=httpx.Timeout(BACKENDS["chat"]["timeout"], connect=OLLAMA_CONNECT_TIMEOUT)
+        )
+    return _client
+
+def _get_semaforo(backend: str) -> asyncio.Semaphore:
+    if backend not in _semaforos:
+        _semaforos[backend] = asyncio.Semaphore(BACKENDS[backend]["concurrencia"])
+    return _semaforos[backend]
+
+def _get_timeout(backend: str) -> httpx.Timeout:
+    return httpx.Timeout(BACKENDS[backend]["timeout"], connect=OLLAMA_CONNECT_TIMEOUT)
+
+@asynccontextmanager
+async def _turno(backend: str):
+    """Espera un lugar libre en el semáforo del backend y lleva la cuenta de la cola"""
+    semaforo = _get_semaforo(backend)
+    _esperando[backend] += 1
+    try:
+        await semaforo.acquire()
+    finally:
+        _esperando[backend] -= 1
+
+    _en_curso[backend] += 1
+    try:
+        yield
+    finally:
+        _en_curso[backend] -= 1
+        semaforo.release()
+
+async def generate(payload: Dict, backend: str = "chat") -> httpx.Response:
+    """
+    Envía un request a /api/generate respetando el límite de concurrencia del backend
+
+    Args:
+        payload: Body del request (se completan "model" y "keep_alive" si no vienen)
+        backend: "chat", "keywords" o "resumen"
+
+    Returns:
+        httpx.Response: Respuesta de Ollama (el caller revisa el status)
+    """
+    payload = {"model": OLLAMA_MODEL, "keep_alive": OLLAMA_KEEP_ALIVE, **payload}
+    async with _turno(backend):
+        return await get_ollama_client().post(
+            OLLAMA_GENERATE_URL,
+            json=payload,
+            timeout=_get_timeout(backend)
+        )
+
+@asynccontextmanager
+async def generate_stream(payload: Dict, backend: str = "chat") -> AsyncIterator[httpx.Response]:
+    """
+    Igual que generate pero con la respuesta abierta en modo streaming.
+    El lugar en el semáforo se libera recién al cerrar la respuesta.
+    """
+    payload = {"model": OLLAMA_MODEL, "keep_alive": OLLAMA_KEEP_ALIVE, **payload}
+    async with _turno(backend):
+        async with get_ollama_client().stream(
+            "POST",
+            OLLAMA_GENERATE_URL,
+            json=payload,
+            timeout=_get_timeout(backend)
+        ) as response:
+            yield response
+
+def get_ollama_stats() -> Dict:
+    """Generaciones en curso y en espera por backend"""
+    return {
+        nombre: {
+            "concurrencia": config["concurrencia"],
+            "en_curso": _en_curso[nombre],
+            "esperando": _esperando[nombre],
+        }
+        for nombre, config in BACKENDS.items()
+    }
+
+async def close_ollama_client():
+    """Cierra el pool de conexiones (shutdown de la app)"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,145 @@
+import json
+import threading
+import zlib
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+from db.connection import SessionLocal
+from models.tramite_payload import TramitePayload
+
+# Objetos ya decodificados por (colección, id). Los dicts se comparten entre
+# requests: quien los use no debe modificarlos.
+_cache: Dict[Tuple[str, str], Dict] = {}
+_cache_version: Dict[str, Optional[Hashable]] = {}
+_lock = threading.Lock()
+
+def _codificar(tramite: Dict) -> bytes:
+    return zlib.compress(json.dumps(tramite, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+def _decodificar(datos: bytes) -> Dict:
+    return json.loads(zlib.decompress(datos).decode("utf-8"))
+
+def _sincronizar_version(coleccion: str, version: Optional[Hashable]):
+    """Si la colección cambió (p. ej. desde otro worker) se descarta lo decodificado"""
+    if version is None:
+        return
+    with _lock:
+        if _cache_version.get(coleccion) != version:
+            for clave in [c for c in _cache if c[0] == coleccion]:
+                del _cache[clave]
+            _cache_version[coleccion] = version
+
+def guardar_payloads(coleccion: str, tramites: List[Dict]):
+    """Inserta o reemplaza los trámites de una colección en una sola transacción"""
+    db = SessionLocal()
+    try:
+        for tramite in tramites:
+            db.merge(TramitePayload(
+                coleccion=coleccion,
+                tramite_id=tramite["id"],
+                datos=_codificar(tramite)
+            ))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    with _lock:
+        for tramite in tramites:
+            _cache.pop((coleccion, tramite["id"]), None)
+
+def obtener_payloads(coleccion: str, ids: Iterable[str], version: Optional[Hashable] = None) -> Dict[str, Dict]:
+    """
+    Trámites por id, primero desde el cache en memoria y el resto con una sola query
+
+    Args:
+        coleccion: Nombre de la colección
+        ids: Ids a resolver
+        version: Versión de la colección; si cambió se vacía el cache
+
+    Returns:
+        Dict id -> trámite (los ids que no están se omiten)
+    """
+    _sincronizar_version(coleccion, version)
+    ids = list(ids)
+    encontrados: Dict[str, Dict] = {}
+    faltantes = []
+
+    with _lock:
+        for tramite_id in ids:
+            tramite = _cache.get((coleccion, tramite_id))
+            if tramite is None:
+                faltantes.append(tramite_id)
+            else:
+                encontrados[tramite_id] = tramite
+
+    if faltantes:
+        db = SessionLocal()
+        try:
+            filas = db.query(TramitePayload.tramite_id, TramitePayload.datos).filter(
+                TramitePayload.coleccion == coleccion,
+                TramitePayload.tramite_id.in_(faltantes)
+            ).all()
+        finally:
+            db.close()
+
+        with _lock:
+            for tramite_id, datos in filas:
+                tramite = _decodificar(datos)
+                _cache[(coleccion, tramite_id)] = tramite
+                encontrados[tramite_id] = tramite
+
+    return encontrados
+
+def iterar_payloads(coleccion: str, ids: List[str], lote: int = 200) -> Iterator[Dict]:
+    """
+    Recorre los trámites de a lotes sin pasar por el cache en memoria: para
+    leer todo el catálogo sin tenerlo entero decodificado a la vez
+    """
+    for inicio in range(0, len(ids), lote):
+        db = SessionLocal()
+        try:
+            filas = db.query(TramitePayload.datos).filter(
+                TramitePayload.coleccion == coleccion,
+                TramitePayload.tramite_id.in_(ids[inicio:inicio + lote])
+            ).all()
+        finally:
+            db.close()
+        for (datos,) in filas:
+            yield _decodificar(datos)
+
+def eliminar_payloads(coleccion: str, ids: List[str]):
+    db = SessionLocal()
+    try:
+        db.query(TramitePayload).filter(
+            TramitePayload.coleccion == coleccion,
+            TramitePayload.tramite_id.in_(ids)
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+    with _lock:
+        for tramite_id in ids:
+            _cache.pop((coleccion, tramite_id), None)
+
+def eliminar_coleccion_payloads(coleccion: str):
+    """Borra todos los trámites de una colección"""
+    db = SessionLocal()
+    try:
+        db.query(TramitePayload).filter(
+            TramitePayload.coleccion == coleccion
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+    with _lock:
+        for clave in [c for c in _cache if c[0] == coleccion]:
+            del _cache[clave]
+        _cache_version.pop(coleccion, None)
+
+def get_payload_stats() -> Dict:
+    with _lock:
+        return {"decodificados_en_memoria": len(_cache)}
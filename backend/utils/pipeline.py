@@ -0,0 +1,343 @@
+import asyncio
+import copy
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from utils.executor import run_blocking, SCRAPER_PARSE_WORKERS
+from utils.keywords import KEYWORDS_MODO, ExtractorTfidf
+from utils.ollama_client import BACKENDS
+from utils.scraper import (
+    SCRAPER_CONCURRENCY,
+    descargar_pagina,
+    parsear_pagina,
+    nuevo_registro_tiempos,
+    registrar_error_scraping,
+    generar_keywords_en_lotes,
+    KEYWORDS_BATCH_SIZE,
+    KEYWORDS_MAX,
+    extract_id_from_url,
+    sin_cambios
+)
+from utils.vector_store import (
+    add_tramites,
+    get_tramites_por_id,
+    iterar_tramites,
+    VECTOR_STORE_BATCH_SIZE
+)
+
+# Capacidad de las colas entre etapas: limita cuántos trámites hay en memoria
+# a la vez sin importar el tamaño del catálogo
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 16))
+
+# El upsert junta hasta VECTOR_STORE_BATCH_SIZE trámites (y las keywords hasta
+# KEYWORDS_BATCH_SIZE), pero no espera más de PIPELINE_UPSERT_ESPERA segundos:
+# así lo ya procesado se vuelve buscable aunque el resto venga lento
+PIPELINE_UPSERT_ESPERA = float(os.getenv("PIPELINE_UPSERT_ESPERA", 2.0))
+
+_FIN = object()
+
+async def _etapa(
+    entrada: asyncio.Queue,
+    salida: Optional[asyncio.Queue],
+    workers: int,
+    procesar: Callable[..., Awaitable]
+):
+    """
+    Corre workers que toman de la cola de entrada y ponen en la de salida lo
+    que devuelva procesar (si no es None). Cuando terminan todos, avisa a la
+    etapa siguiente.
+    """
+    async def worker():
+        while True:
+            item = await entrada.get()
+            if item is _FIN:
+                # Que lo vea también el resto de los workers de esta etapa
+                await entrada.put(_FIN)
+                return
+            resultado = await procesar(*item)
+            if resultado is not None and salida is not None:
+                await salida.put(resultado)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+    if salida is not None:
+        await salida.put(_FIN)
+
+async def _tomar_lote(cola: asyncio.Queue, maximo: int, espera: float):
+    """
+    Espera el primer ítem y junta hasta maximo, sin esperar más de espera
+    segundos desde que llegó el primero.
+
+    Returns:
+        (lote, terminado): terminado es True si llegó el fin de la cola
+    """
+    lote = []
+    limite = 0.0
+    while len(lote) < maximo:
+        try:
+            if lote:
+                item = await asyncio.wait_for(cola.get(), max(0.0, limite - time.monotonic()))
+            else:
+                item = await cola.get()
+        except asyncio.TimeoutError:
+            break
+        if item is _FIN:
+            return lote, True
+        lote.append(item)
+        if len(lote) == 1:
+            limite = time.monotonic() + espera
+    return lote, False
+
+def nuevo_resumen() -> Dict:
+    """Totales de una corrida del pipeline (se pueden retomar desde un checkpoint)"""
+    return {
+        "scraped": 0,
+        "changed": 0,
+        "unchanged": 0,
+        "inserted": 0,
+        "keywords_generated": 0,
+        "ids": [],
+        "errors": [],
+        "timings": [],
+    }
+
+async def ejecutar_pipeline(
+    urls: List[str],
+    existentes: Optional[Dict[str, Dict]] = None,
+    collection_name: Optional[str] = None,
+    solo_modificados: bool = True,
+    resumen: Optional[Dict] = None,
+    etapas: Optional[Dict[str, Dict[str, int]]] = None,
+    al_terminar: Optional[Callable[[List[str]], None]] = None,
+    keywords_modo: Optional[str] = None
+) -> Dict:
+    """
+    Scrapea, genera keywords e inserta los trámites por etapas conectadas con
+    colas acotadas (descarga → parseo → keywords → upsert por lotes). Cada
+    trámite queda insertado apenas completa su lote, sin esperar al resto.
+
+    Args:
+        urls: URLs a procesar
+        existentes: Lo mínimo de cada trámite indexado, por id (ver
+                    get_indice_tramites: hash y keywords). Los trámites
+                    completos se leen solo cuando hacen falta.
+        collection_name: Colección destino (default: la activa)
+        solo_modificados: Si es True, los trámites sin cambios no se re-insertan
+        resumen: Totales de una corrida anterior a los que sumar (ver nuevo_resumen)
+        etapas: Dict donde ir contando ok/errores de cada etapa (para mostrar avance)
+        al_terminar: Se llama con las URLs que ya no tienen trabajo pendiente
+                     (insertadas, sin cambios o fallidas). Los totales del
+                     resumen se actualizan recién en ese momento, así un
+                     checkpoint con el resumen y esas URLs es consistente.
+        keywords_modo: "llm" (Ollama, en lotes) o "tfidf" (sobre el catálogo
+                       de existentes, sin LLM). Default: KEYWORDS_MODO
+
+    Returns:
+        El resumen: scraped, changed, unchanged, inserted, keywords_generated,
+        ids (los scrapeados), errors y timings (uno por URL)
+    """
+    existentes = existentes or {}
+    resumen = resumen if resumen is not None else nuevo_resumen()
+    etapas = etapas if etapas is not None else {}
+    for etapa in ("descarga", "parseo", "keywords", "upsert"):
+        etapas.setdefault(etapa, {"ok": 0, "errores": 0})
+
+    def terminar(registros: List[Dict]):
+        for registro in registros:
+            resumen["timings"].append(registro["tiempos"])
+            if registro["id"]:
+                resumen["scraped"] += 1
+                resumen["ids"].append(registro["id"])
+            for clave in ("changed", "unchanged", "inserted", "keywords_generated"):
+                resumen[clave] += registro[clave]
+        if al_terminar:
+            al_terminar([registro["tiempos"]["url"] for registro in registros])
+
+    keywords_modo = keywords_modo or KEYWORDS_MODO
+    # Las frecuencias de documento se arman recorriendo el catálogo de a lotes
+    extractor = await run_blocking(ExtractorTfidf, iterar_tramites()) if keywords_modo == "tfidf" else None
+
+    # Ventana en la que hubo lotes de keywords con el LLM, para el throughput
+    llm = {"tramites": 0, "desde": None, "hasta": None}
+
+    cola_urls: asyncio.Queue = asyncio.Queue()
+    cola_html: asyncio.Queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    cola_keywords: asyncio.Queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    cola_upsert: asyncio.Queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+
+    for url in urls:
+        cola_urls.put_nowait((url,))
+    cola_urls.put_nowait(_FIN)
+
+    async def descargar(url: str):
+        registro = {
+            "tiempos": nuevo_registro_tiempos(url),
+            "id": None,
+            "changed": 0,
+            "unchanged": 0,
+            "inserted": 0,
+            "keywords_generated": 0,
+        }
+        tiempos = registro["tiempos"]
+        try:
+            html, tramite = await descargar_pagina(url, tiempos, existentes.get(extract_id_from_url(url)))
+        except Exception as e:
+            registrar_error_scraping(url, tiempos, e)
+            etapas["descarga"]["errores"] += 1
+            terminar([registro])
+            return None
+        etapas["descarga"]["ok"] += 1
+        if tramite:
+            tiempos["ok"] = True
+        return (registro, html, tramite)
+
+    async def completar(tramite: Dict) -> Dict:
+        """
+        Ante un 304 se tiene solo el hash y las keywords del indexado: el
+        trámite completo se lee si va a llegar al upsert (re-indexado completo,
+        o le faltan keywords)
+        """
+        if solo_modificados and tramite["metadata"].get("keywords"):
+            return tramite
+        completos = await run_blocking(get_tramites_por_id, [tramite["id"]])
+        if tramite["id"] not in completos:
+            raise ValueError(f"El trámite indexado {tramite['id']} no está en el payload store")
+        return copy.deepcopy(completos[tramite["id"]])
+
+    async def parsear(registro: Dict, html: Optional[str], tramite: Optional[Dict]):
+        url = registro["tiempos"]["url"]
+        try:
+            if tramite is None:
+                tramite = await parsear_pagina(html, url, registro["tiempos"], en_proceso_aparte=True)
+            else:
+                tramite = await completar(tramite)
+        except Exception as e:
+            registrar_error_scraping(url, registro["tiempos"], e)
+            tramite = None
+        if tramite is None:
+            etapas["parseo"]["errores"] += 1
+            terminar([registro])
+            return None
+        etapas["parseo"]["ok"] += 1
+        registro["id"] = tramite["id"]
+        return (registro, tramite)
+
+    def con_keywords(registro: Dict, tramite: Dict, nuevas: bool = True) -> Optional[tuple]:
+        """
+        Cuenta el resultado de keywords y decide si el trámite sigue al upsert.
+        Un trámite sin cambios al que se le generaron keywords (no las tenía)
+        pasa a contarse como modificado: hay que guardarlas.
+        """
+        if tramite["metadata"]["keywords"]:
+            registro["keywords_generated"] = 1
+            etapas["keywords"]["ok"] += 1
+            if nuevas and registro["unchanged"]:
+                registro["unchanged"] = 0
+                registro["changed"] = 1
+        else:
+            etapas["keywords"]["errores"] += 1
+
+        if registro["changed"] or not solo_modificados:
+            return (registro, tramite)
+        terminar([registro])
+        return None
+
+    async def keywords_lote(lote: List[tuple]):
+        if llm["desde"] is None:
+            llm["desde"] = time.perf_counter()
+        await generar_keywords_en_lotes([tramite for _, tramite in lote], batch_size=len(lote))
+        llm["tramites"] += len(lote)
+        llm["hasta"] = time.perf_counter()
+        for registro, tramite in lote:
+            siguiente = con_keywords(registro, tramite)
+            if siguiente:
+                await cola_upsert.put(siguiente)
+
+    async def keywords():
+        """
+        Los trámites sin cambios reutilizan sus keywords; con el LLM el resto
+        se junta en lotes de KEYWORDS_BATCH_SIZE y se corren hasta la
+        concurrencia del backend "keywords" de Ollama a la vez
+        """
+        semaforo = asyncio.Semaphore(max(1, BACKENDS["keywords"]["concurrencia"]))
+        en_curso = set()
+        terminado = False
+        while not terminado:
+            items, terminado = await _tomar_lote(cola_keywords, KEYWORDS_BATCH_SIZE, PIPELINE_UPSERT_ESPERA)
+            lote = []
+            for registro, tramite in items:
+                existente = existentes.get(tramite["id"])
+                if sin_cambios(tramite, existente):
+                    registro["unchanged"] = 1
+                    if existente["metadata"].get("keywords"):
+                        tramite["metadata"]["keywords"] = list(existente["metadata"]["keywords"])
+                        siguiente = con_keywords(registro, tramite, nuevas=False)
+                        if siguiente:
+                            await cola_upsert.put(siguiente)
+                        continue
+                else:
+                    registro["changed"] = 1
+                lote.append((registro, tramite))
+
+            if lote and extractor is not None:
+                # TF-IDF tarda milisegundos: se resuelve acá mismo, sin lotes en
+                # paralelo. Primero entra todo el lote en las frecuencias de
+                # documento (con un catálogo vacío son las únicas que hay).
+                for _, tramite in lote:
+                    extractor.agregar(tramite)
+                for registro, tramite in lote:
+                    tramite["metadata"]["keywords"] = extractor.extraer(tramite, KEYWORDS_MAX)
+                    siguiente = con_keywords(registro, tramite)
+                    if siguiente:
+                        await cola_upsert.put(siguiente)
+            elif lote:
+                await semaforo.acquire()
+                tarea = asyncio.create_task(keywords_lote(lote))
+                en_curso.add(tarea)
+                tarea.add_done_callback(en_curso.discard)
+                tarea.add_done_callback(lambda _: semaforo.release())
+
+        await asyncio.gather(*list(en_curso))
+        await cola_upsert.put(_FIN)
+
+    async def upsert():
+        terminado = False
+        while not terminado:
+            lote, terminado = await _tomar_lote(cola_upsert, VECTOR_STORE_BATCH_SIZE, PIPELINE_UPSERT_ESPERA)
+            if lote:
+                registros = [registro for registro, _ in lote]
+                estados = await run_blocking(add_tramites, [tramite for _, tramite in lote], collection_name=collection_name)
+                for registro, estado in zip(registros, estados):
+                    if estado["ok"]:
+                        registro["inserted"] = 1
+                        etapas["upsert"]["ok"] += 1
+                    else:
+                        etapas["upsert"]["errores"] += 1
+                        resumen["errors"].append(f"Error insertando {estado['id']}: {estado['error']}")
+                terminar(registros)
+                print(f"💾 Lote de {len(lote)} trámites insertado ({resumen['inserted']} en total)")
+
+    inicio = time.perf_counter()
+    tareas = [
+        asyncio.create_task(_etapa(cola_urls, cola_html, SCRAPER_CONCURRENCY, descargar)),
+        asyncio.create_task(_etapa(cola_html, cola_keywords, SCRAPER_PARSE_WORKERS, parsear)),
+        asyncio.create_task(keywords()),
+        asyncio.create_task(upsert()),
+    ]
+    try:
+        await asyncio.gather(*tareas)
+    except BaseException:
+        for tarea in tareas:
+            tarea.cancel()
+        raise
+
+    if llm["tramites"]:
+        segundos = max(llm["hasta"] - llm["desde"], 1e-6)
+        etapas["keywords"]["tramites_por_minuto"] = round(llm["tramites"] / segundos * 60, 1)
+        print(f"🤖 Keywords con el LLM: {llm['tramites']} trámites a {etapas['keywords']['tramites_por_minuto']} trámites/minuto")
+    print(
+        f"✅ Pipeline completo en {time.perf_counter() - inicio:.1f}s: "
+        f"{len(urls)} URLs, {resumen['changed']} modificados, "
+        f"{resumen['inserted']} insertados en total"
+    )
+    return resumen
@@ -1,9 +1,71 @@
 import httpx
-from typing import Optional, Dict, List
-from utils.vector_store import search_tramites
+import json
+import os
+import re
+from array import array
+from typing import Optional, Dict, List, AsyncIterator
+from utils.vector_store import search_tramites_con_distancia
+from utils.ollama_client import generate, generate_stream
+from utils.answer_cache import answer_cache, normalizar_consulta
+from utils.executor import run_blocking
+from utils.session_store import SessionStore
+from utils.context import version_conversacion
 
-OLLAMA_URL = "http://nodo-ia:11434/api/generate"
-OLLAMA_MODEL = "llama3.2:3b"
+# "auto": respuesta por plantilla cuando la búsqueda es confiable, LLM en el resto
+# "llm": siempre generar con el LLM
+RESPUESTA_MODO = os.getenv("RESPUESTA_MODO", "auto")
+
+# Distancia máxima (misma escala que search_tramites) para responder por plantilla
+PLANTILLA_DISTANCIA_MAXIMA = float(os.getenv("PLANTILLA_DISTANCIA_MAXIMA", 0.6))
+
+# Consultas que son charla y no un pedido de información de un trámite
+PATRON_CONVERSACIONAL = re.compile(
+    r"^\s*[¿¡]?\s*(?:(?:gracias|chau|adi[oó]s|ok|dale|perfecto|"
+    r"y|entonces|pero|eso|ese|esa|por qu[eé]|otra vez)\b|no entend|me explic)",
+    re.IGNORECASE
+)
+
+# Repreguntas sobre el trámite del turno anterior ("¿y dónde lo pido?"): las
+# que remiten a lo ya hablado. Los conectores del principio ("y", "pero",
+# "entonces") no alcanzan: también encabezan preguntas sobre un tema nuevo.
+PATRON_REPREGUNTA = re.compile(
+    r"\b(?:eso|esos|esas|lo mismo|ah[ií]|all[ií]|"
+    r"el tr[aá]mite|ese tr[aá]mite|este tr[aá]mite|los papeles|la documentaci[oó]n|"
+    r"lo hago|lo pido|lo tramito|lo solicito|la pido|la solicito)\b",
+    re.IGNORECASE
+)
+
+# Una consulta corta (en palabras significativas, ver normalizar_consulta)
+# sin un resultado claro en la búsqueda también se toma como repregunta
+RETRIEVAL_REUSO_MAX_PALABRAS = int(os.getenv("RETRIEVAL_REUSO_MAX_PALABRAS", 4))
+# Distancia a partir de la cual el resultado de la búsqueda se considera flojo
+RETRIEVAL_REUSO_DISTANCIA = float(os.getenv("RETRIEVAL_REUSO_DISTANCIA", 0.8))
+
+# Trámite y contexto ya formateado del último turno de cada usuario
+ultimo_retrieval = SessionStore("retrieval")
+
+# Estado (tokens de "context") que devuelve Ollama al final de cada respuesta,
+# por usuario: en la repregunta siguiente sobre el mismo trámite se manda solo
+# la consulta nueva y Ollama no vuelve a evaluar el prompt completo. Pasado
+# OLLAMA_CONTEXTO_MAX_TOKENS se descarta y se arranca con el prompt entero.
+# Se guarda junto con la versión de la conversación (ver version_conversacion):
+# si otro worker la siguió o la limpió, el context ya no la representa.
+OLLAMA_CONTEXTO_MAX_TOKENS = int(os.getenv("OLLAMA_CONTEXTO_MAX_TOKENS", 4096))
+contextos_ollama = SessionStore("ollama_contexto")
+_contexto_stats = {
+    "turnos_con_contexto": 0,
+    "turnos_sin_contexto": 0,
+    "prompt_eval_con_contexto": 0,
+    "prompt_eval_sin_contexto": 0,
+}
+# Turnos resueltos con el trámite que dio la búsqueda y turnos en los que se
+# siguió con el del turno anterior. La búsqueda corre en los dos casos: lo que
+# se ahorra al seguir con el trámite anterior es el formateo del contexto y,
+# si el turno anterior fue sobre él, volver a evaluar el prompt en Ollama.
+_retrieval_stats = {
+    "tramite_nuevo": 0,
+    "tramite_reutilizado": 0,
+}
 
 def formatear_tramite_como_texto(tramite: Dict) -> str:
     """
@@ -101,59 +163,404 @@ CONTEXTO:
 
     return system_prompt
 
-async def llamar_ollama(prompt: str) -> str:
+def construir_prompt_repregunta(consulta: str) -> str:
+    """
+    Prompt de un turno que continúa el contexto de Ollama del anterior: las
+    reglas, el trámite y la conversación ya están evaluados ahí
+    """
+    return f"Usuario: {consulta}\n\nAsistente (respondé solo con información del CONTEXTO):"
+
+def renderizar_respuesta_plantilla(tramite: Dict) -> str:
+    """
+    Arma directamente la respuesta en el mismo formato markdown que se le pide al LLM
+    en construir_prompt_con_contexto, copiando los campos del trámite
+    
+    Args:
+        tramite: Diccionario con la estructura JSON del trámite
+    
+    Returns:
+        str: Respuesta en markdown
+    """
+    partes = [f"**{tramite['titulo']}**"]
+    
+    if tramite['descripcion']:
+        partes.append(tramite['descripcion'])
+    
+    if tramite['quien_puede_realizar']['texto']:
+        partes.append("**👤 ¿Quién puede realizarlo?**")
+        partes.append(tramite['quien_puede_realizar']['texto'])
+    
+    if tramite['documentacion_necesaria']['items']:
+        partes.append("**📋 Documentación necesaria:**")
+        partes.append("\n".join(f"- {item}" for item in tramite['documentacion_necesaria']['items']))
+    
+    if tramite['donde_realizar']['texto']:
+        partes.append("**💻 ¿Dónde realizarlo?**")
+        partes.append(tramite['donde_realizar']['texto'])
+    
+    # Enlaces de todas las secciones sin repetir, y al final la página oficial
+    enlaces = []
+    for enlace in (
+        tramite['quien_puede_realizar']['enlaces']
+        + tramite['documentacion_necesaria']['enlaces']
+        + tramite['donde_realizar']['enlaces']
+    ):
+        if enlace not in enlaces and enlace != tramite['url_oficial']:
+            enlaces.append(enlace)
+    
+    lineas_enlaces = [f"- [{enlace}]({enlace})" for enlace in enlaces]
+    lineas_enlaces.append(f"- [Página oficial del trámite]({tramite['url_oficial']})")
+    partes.append("**🔗 Enlaces:**")
+    partes.append("\n".join(lineas_enlaces))
+    
+    return "\n\n".join(partes)
+
+def es_consulta_conversacional(consulta: str) -> bool:
+    """Saludos, agradecimientos o repreguntas que necesitan al LLM y no una ficha del trámite"""
+    return bool(PATRON_CONVERSACIONAL.match(consulta))
+
+def es_repregunta(consulta: str) -> bool:
+    """Repregunta sobre lo último que se habló (pronombres, "y ...", "los papeles")"""
+    return bool(PATRON_REPREGUNTA.search(consulta))
+
+def es_consulta_corta(consulta: str) -> bool:
+    return len(normalizar_consulta(consulta).split()) <= RETRIEVAL_REUSO_MAX_PALABRAS
+
+def recordar_retrieval(user_id: Optional[int], tramite: Dict, contexto: str):
+    if user_id is not None:
+        ultimo_retrieval.set(user_id, {"tramite_id": tramite["id"], "titulo": tramite.get("titulo", ""), "contexto": contexto})
+
+def olvidar_conversacion(user_id: int):
+    """Descarta el trámite y el contexto de Ollama recordados del usuario"""
+    ultimo_retrieval.delete(user_id)
+    contextos_ollama.delete(user_id)
+
+def _recordar_contexto_ollama(user_id: Optional[int], tramite_id: str, generacion: Dict):
+    """
+    Guarda el context que devolvió Ollama y registra cuántos tokens del
+    prompt tuvo que evaluar (con y sin reutilizar el contexto anterior)
+    """
+    if user_id is None:
+        return
+    con_contexto = generacion.get("con_contexto", False)
+    evaluados = generacion.get("prompt_eval_count")
+    if evaluados is not None:
+        clave = "con_contexto" if con_contexto else "sin_contexto"
+        _contexto_stats[f"turnos_{clave}"] += 1
+        _contexto_stats[f"prompt_eval_{clave}"] += evaluados
+        print(f"🧮 prompt_eval_count: {evaluados} tokens ({'con' if con_contexto else 'sin'} contexto de Ollama)")
+
+    context = generacion.get("context")
+    if context and len(context) <= OLLAMA_CONTEXTO_MAX_TOKENS:
+        # array de enteros: ocupa mucho menos que una lista en el store
+        contextos_ollama.set(user_id, {
+            "tramite_id": tramite_id,
+            "conversacion": version_conversacion(user_id),
+            "context": array("i", context),
+        })
+    else:
+        contextos_ollama.delete(user_id)
+
+def get_contexto_ollama_stats() -> Dict:
+    """Promedio de tokens de prompt evaluados por turno, con y sin contexto reutilizado"""
+    stats = dict(_contexto_stats)
+    for clave in ("con_contexto", "sin_contexto"):
+        turnos = stats[f"turnos_{clave}"]
+        stats[f"prompt_eval_promedio_{clave}"] = round(stats[f"prompt_eval_{clave}"] / turnos, 1) if turnos else None
+    return stats
+
+def get_retrieval_stats() -> Dict:
+    total = _retrieval_stats["tramite_nuevo"] + _retrieval_stats["tramite_reutilizado"]
+    return {
+        **_retrieval_stats,
+        "tasa_tramite_reutilizado": round(_retrieval_stats["tramite_reutilizado"] / total, 3) if total else 0.0,
+        "contexto_ollama": get_contexto_ollama_stats(),
+    }
+
+def usar_plantilla(consulta: str, distancia: float) -> bool:
+    """Decide si la respuesta puede armarse por plantilla sin pasar por el LLM"""
+    return (
+        RESPUESTA_MODO == "auto"
+        and distancia <= PLANTILLA_DISTANCIA_MAXIMA
+        and not es_consulta_conversacional(consulta)
+    )
+
+ERROR_OLLAMA = "Error al comunicarse con el asistente de IA. Por favor, intentá nuevamente."
+ERROR_TIMEOUT = "El asistente está tardando mucho en responder. Por favor, intentá nuevamente."
+ERROR_INTERNO = "Ocurrió un error al procesar tu consulta. Por favor, intentá nuevamente."
+
+# Mensajes de error que nunca deben quedar en el cache de respuestas
+MENSAJES_ERROR = {ERROR_OLLAMA, ERROR_TIMEOUT, ERROR_INTERNO}
+
+def _payload_chat(prompt: str, context: Optional[List[int]], stream: bool) -> Dict:
+    payload = {"prompt": prompt, "stream": stream}
+    if context:
+        payload["context"] = context
+    return payload
+
+def _anotar_generacion(generacion: Optional[Dict], resultado: Dict):
+    """Copia del último mensaje de Ollama lo necesario para el turno siguiente"""
+    if generacion is not None:
+        generacion["context"] = resultado.get("context")
+        generacion["prompt_eval_count"] = resultado.get("prompt_eval_count")
+
+async def llamar_ollama(prompt: str, context: Optional[List[int]] = None, generacion: Optional[Dict] = None) -> str:
+    """
+    Args:
+        context: Tokens de context de una respuesta anterior a continuar (opcional)
+        generacion: Dict donde se dejan el context nuevo y prompt_eval_count
+    """
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                OLLAMA_URL,
-                json={
-                    "model": OLLAMA_MODEL,
-                    "prompt": prompt,
-                    "stream": False
-                },
-                timeout=1000.0
-            )
-            
-            if response.status_code != 200:
-                return "Error al comunicarse con el asistente de IA. Por favor, intentá nuevamente."
-            
-            resultado = response.json()
-            respuesta = resultado.get("response", "")
-            
-            return respuesta
+        response = await generate(_payload_chat(prompt, context, stream=False), backend="chat")
+        
+        if response.status_code != 200:
+            return ERROR_OLLAMA
+        
+        resultado = response.json()
+        respuesta = resultado.get("response", "")
+        _anotar_generacion(generacion, resultado)
+        
+        return respuesta
             
     except httpx.TimeoutException:
-        return "El asistente está tardando mucho en responder. Por favor, intentá nuevamente."
+        return ERROR_TIMEOUT
     except Exception as e:
         print(f"❌ Error en llamar_ollama: {e}")
-        return "Ocurrió un error al procesar tu consulta. Por favor, intentá nuevamente."
+        return ERROR_INTERNO
+
+async def llamar_ollama_stream(
+    prompt: str,
+    context: Optional[List[int]] = None,
+    generacion: Optional[Dict] = None
+) -> AsyncIterator[str]:
+    """
+    Igual que llamar_ollama pero con "stream": True: devuelve los fragmentos
+    de texto a medida que Ollama los va generando (NDJSON, una línea por fragmento).
+    El context y prompt_eval_count vienen en la última línea.
+    
+    Si se pasa generacion, un fallo (aunque ya se hayan mandado fragmentos)
+    no se devuelve como texto: queda el mensaje en generacion["error"]. Solo
+    una respuesta que llegó hasta "done": true deja generacion["done"].
+    """
+    def fallar(mensaje: str) -> Optional[str]:
+        if generacion is None:
+            return mensaje
+        generacion["error"] = mensaje
+        return None
+    
+    error = None
+    try:
+        async with generate_stream(_payload_chat(prompt, context, stream=True), backend="chat") as response:
+            
+            if response.status_code != 200:
+                error = fallar(ERROR_OLLAMA)
+            else:
+                terminada = False
+                async for linea in response.aiter_lines():
+                    if not linea.strip():
+                        continue
+                    
+                    resultado = json.loads(linea)
+                    fragmento = resultado.get("response", "")
+                    if fragmento:
+                        yield fragmento
+                    
+                    if resultado.get("done"):
+                        _anotar_generacion(generacion, resultado)
+                        terminada = True
+                        break
+                
+                if terminada:
+                    if generacion is not None:
+                        generacion["done"] = True
+                else:
+                    print("❌ Error en llamar_ollama_stream: la respuesta se cortó antes de terminar")
+                    error = fallar(ERROR_INTERNO)
+                        
+    except httpx.TimeoutException:
+        error = fallar(ERROR_TIMEOUT)
+    except Exception as e:
+        print(f"❌ Error en llamar_ollama_stream: {e}")
+        error = fallar(ERROR_INTERNO)
+    
+    if error:
+        yield error
+
+def mensaje_sin_resultados(nombre_usuario: str) -> str:
+    """Respuesta fija cuando la búsqueda no encuentra ningún trámite relevante"""
+    return f"¡Hola, {nombre_usuario}! No encontré un resultado exacto para tu búsqueda. A veces, funciona mejor si usas el **nombre completo del trámite** (ej: en lugar de 'conyuge', prueba con 'Asignación Familiar por Cónyuge'). ¿Podrías intentar con un término más específico? Si aún así no lo encuentras, te sugiero contactar directamente a PAMI al **138** o visitar https://www.pami.org.ar para más información."
+
+def _guardar_en_cache(tramite_id: str, consulta: str, nombre_usuario: str, historial: str, respuesta: str):
+    """Solo se cachean respuestas sin historial (no dependen de la conversación) y sin error"""
+    if historial or not respuesta or respuesta in MENSAJES_ERROR:
+        return
+    answer_cache.set(tramite_id, consulta, nombre_usuario, respuesta)
+
+def _para_el_llm(tramite_id: str, contexto: str, consulta: str, nombre_usuario: str, historial: str, user_id: Optional[int]) -> Dict:
+    """
+    Prompt a generar con el LLM. Si el turno anterior fue sobre el mismo
+    trámite (y en esta misma versión de la conversación) se continúa su
+    context de Ollama y solo se manda la consulta nueva.
+    """
+    previo = contextos_ollama.get(user_id) if user_id is not None and historial else None
+    if previo and (previo["conversacion"] is None or previo["conversacion"] != version_conversacion(user_id)):
+        # La conversación se recargó de la base: el context quedó atrás
+        contextos_ollama.delete(user_id)
+        previo = None
+    if previo and previo["tramite_id"] == tramite_id:
+        return {
+            "tramite": {"id": tramite_id},
+            "prompt": construir_prompt_repregunta(consulta),
+            "context": list(previo["context"]),
+        }
+    prompt = construir_prompt_con_contexto(consulta, contexto, nombre_usuario, historial)
+    return {"tramite": {"id": tramite_id}, "prompt": prompt, "context": None}
+
+def _reusar(anterior: Dict, consulta: str, nombre_usuario: str, historial: str, user_id: Optional[int]) -> Dict:
+    """Prompt con el contexto del turno anterior (las repreguntas siempre van al LLM)"""
+    print(f"♻️ Repregunta sobre '{anterior['titulo']}': se reutiliza el contexto anterior")
+    return _para_el_llm(anterior["tramite_id"], anterior["contexto"], consulta, nombre_usuario, historial, user_id)
+
+async def _resolver_sin_llm(consulta: str, nombre_usuario: str, historial: str, user_id: Optional[int] = None) -> Dict:
+    """
+    Búsqueda + todos los caminos que no necesitan generar con el LLM
+    
+    Siempre se busca primero. Si hay historial, el trámite del turno anterior
+    se reutiliza cuando la búsqueda vuelve a dar ese mismo trámite y la
+    consulta es una repregunta, o cuando no encuentra nada claro y la
+    consulta es una repregunta o es corta. Reutilizarlo no ahorra la búsqueda
+    (embedding + índice), que corre en todos los turnos: evita que una
+    repregunta ambigua salte a otro trámite y permite seguir el context de
+    Ollama del turno anterior.
+    
+    Returns:
+        Dict: {"respuesta", "origen"} si ya hay respuesta (sin resultados, plantilla o cache),
+              o {"tramite", "prompt", "context"} si hay que generarla con el LLM
+    """
+    resuelto = await _buscar_y_resolver(consulta, nombre_usuario, historial, user_id)
+    if "respuesta" in resuelto and user_id is not None:
+        # El modelo no vio este turno: el context guardado ya no sigue la conversación
+        contextos_ollama.delete(user_id)
+    return resuelto
+
+async def _buscar_y_resolver(consulta: str, nombre_usuario: str, historial: str, user_id: Optional[int]) -> Dict:
+    # La búsqueda (embedding + ChromaDB) es bloqueante: corre en el pool dedicado
+    resultados = await run_blocking(search_tramites_con_distancia, consulta, n_results=1)
+    
+    anterior = ultimo_retrieval.get(user_id) if user_id is not None and historial else None
+    if anterior:
+        flojo = not resultados or resultados[0][1] > RETRIEVAL_REUSO_DISTANCIA
+        mismo_tramite = bool(resultados) and resultados[0][0]["id"] == anterior["tramite_id"]
+        repregunta = es_repregunta(consulta)
+        if (mismo_tramite and repregunta) or (flojo and (repregunta or es_consulta_corta(consulta))):
+            _retrieval_stats["tramite_reutilizado"] += 1
+            return _reusar(anterior, consulta, nombre_usuario, historial, user_id)
+    
+    _retrieval_stats["tramite_nuevo"] += 1
+    if not resultados:
+        return {"respuesta": mensaje_sin_resultados(nombre_usuario), "origen": "sin_resultados"}
+    
+    tramite, distancia = resultados[0]
+    
+    contexto = formatear_tramite_como_texto(tramite)
+    recordar_retrieval(user_id, tramite, contexto)
+    
+    if usar_plantilla(consulta, distancia):
+        return {"respuesta": renderizar_respuesta_plantilla(tramite), "origen": "plantilla"}
+    
+    if not historial:
+        cacheada = answer_cache.get(tramite["id"], consulta, nombre_usuario)
+        if cacheada is not None:
+            return {"respuesta": cacheada, "origen": "cache"}
+    
+    return _para_el_llm(tramite["id"], contexto, consulta, nombre_usuario, historial, user_id)
 
 async def generar_respuesta_con_rag(
     consulta: str, 
     nombre_usuario: str,
-    historial: str = ""
-) -> str:
+    historial: str = "",
+    user_id: Optional[int] = None
+) -> Dict:
     """
     Función principal del RAG: busca contexto relevante y genera respuesta
     
+    Si la búsqueda es muy confiable la respuesta se arma por plantilla en
+    milisegundos; si no, se genera con el LLM (o se toma del cache).
+    
     Args:
         consulta: Pregunta del usuario
         nombre_usuario: Nombre del usuario para personalizar
         historial: Historial de conversación previo (opcional)
+        user_id: Usuario de la conversación, para reutilizar el trámite del
+                 turno anterior en las repreguntas (opcional)
     
     Returns:
-        str: Respuesta generada con contexto o mensaje de no disponibilidad
+        Dict: {"respuesta": str, "origen": "llm" | "plantilla" | "cache" | "sin_resultados"}
     """
-    tramites = search_tramites(consulta, n_results=1)
+    resuelto = await _resolver_sin_llm(consulta, nombre_usuario, historial, user_id)
+    if "respuesta" in resuelto:
+        return resuelto
     
-    if not tramites:
-        return f"¡Hola, {nombre_usuario}! No encontré un resultado exacto para tu búsqueda. A veces, funciona mejor si usas el **nombre completo del trámite** (ej: en lugar de 'conyuge', prueba con 'Asignación Familiar por Cónyuge'). ¿Podrías intentar con un término más específico? Si aún así no lo encuentras, te sugiero contactar directamente a PAMI al **138** o visitar https://www.pami.org.ar para más información."
+    tramite = resuelto["tramite"]
     
-    tramite = tramites[0]
-    contexto = formatear_tramite_como_texto(tramite)
+    generacion = {"con_contexto": resuelto["context"] is not None}
+    respuesta = await llamar_ollama(resuelto["prompt"], resuelto["context"], generacion)
+    _recordar_contexto_ollama(user_id, tramite["id"], generacion)
+    _guardar_en_cache(tramite["id"], consulta, nombre_usuario, historial, respuesta)
     
-    prompt = construir_prompt_con_contexto(consulta, contexto, nombre_usuario, historial)
+    return {"respuesta": respuesta, "origen": "llm"}
+
+async def generar_respuesta_con_rag_stream(
+    consulta: str, 
+    nombre_usuario: str,
+    historial: str = "",
+    info: Optional[Dict] = None,
+    user_id: Optional[int] = None
+) -> AsyncIterator[str]:
+    """
+    Versión streaming de generar_respuesta_con_rag: misma búsqueda y mismo prompt,
+    pero va devolviendo los fragmentos de la respuesta a medida que se generan
+    
+    Args:
+        info: Dict opcional donde se deja el "origen" de la respuesta, y
+              "error" con el mensaje para el usuario si la generación falló
+              o se cortó (los fragmentos ya devueltos quedan incompletos)
+    
+    Yields:
+        str: Fragmentos de texto de la respuesta
+    """
+    if info is None:
+        info = {}
+    
+    resuelto = await _resolver_sin_llm(consulta, nombre_usuario, historial, user_id)
+    if "respuesta" in resuelto:
+        info["origen"] = resuelto["origen"]
+        yield resuelto["respuesta"]
+        return
+    
+    tramite = resuelto["tramite"]
+    
+    info["origen"] = "llm"
+    fragmentos = []
+    generacion = {"con_contexto": resuelto["context"] is not None}
+    completa = False
+    try:
+        async for fragmento in llamar_ollama_stream(resuelto["prompt"], resuelto["context"], generacion):
+            fragmentos.append(fragmento)
+            yield fragmento
+        completa = True
+    finally:
+        # Si el cliente se desconectó a mitad de la respuesta el context
+        # anterior no incluye este turno: no se puede seguir usando
+        if not completa and user_id is not None:
+            contextos_ollama.delete(user_id)
     
-    respuesta = await llamar_ollama(prompt)
+    if not generacion.get("done"):
+        # Respuesta parcial: ni al cache ni como context para el turno siguiente
+        info["error"] = generacion.get("error", ERROR_INTERNO)
+        if user_id is not None:
+            contextos_ollama.delete(user_id)
+        return
     
-    return respuesta
\ No newline at end of file
+    _recordar_contexto_ollama(user_id, tramite["id"], generacion)
+    _guardar_en_cache(tramite["id"], consulta, nombre_usuario, historial, "".join(fragmentos))
@@ -1,8 +1,46 @@
+import asyncio
+import copy
 import httpx
 from bs4 import BeautifulSoup
+from lxml import etree
 from typing import List, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+import bisect
+import hashlib
 import json
+import os
 import re
+import time
+
+from utils import http_cache
+from utils.executor import run_in_process
+from utils.ollama_client import generate
+
+# Requests simultáneos del scraper, pausa mínima entre requests al mismo host
+# (para no saturar el sitio de PAMI) y reintentos con backoff exponencial
+SCRAPER_CONCURRENCY = int(os.getenv("SCRAPER_CONCURRENCY", 8))
+SCRAPER_HOST_DELAY = float(os.getenv("SCRAPER_HOST_DELAY", 0.2))
+SCRAPER_RETRIES = int(os.getenv("SCRAPER_RETRIES", 3))
+SCRAPER_BACKOFF = float(os.getenv("SCRAPER_BACKOFF", 1.0))
+SCRAPER_TIMEOUT = float(os.getenv("SCRAPER_TIMEOUT", 30))
+
+# Con SCRAPER_OFFLINE=true no se hace ningún request: se re-procesan las
+# páginas guardadas en la caché HTTP (para pruebas y benchmarks)
+SCRAPER_OFFLINE = os.getenv("SCRAPER_OFFLINE", "false").lower() == "true"
+
+REINTENTAR_STATUS = {429, 500, 502, 503, 504}
+
+# Trámites por prompt al generar keywords en lote (1 = un prompt por trámite)
+KEYWORDS_BATCH_SIZE = int(os.getenv("KEYWORDS_BATCH_SIZE", 5))
+KEYWORDS_MAX = 7
+
+# Parser de las páginas: "lxml" (una sola pasada sobre el árbol) o "bs4"
+# (la implementación original con BeautifulSoup, que da el mismo JSON)
+SCRAPER_PARSER = os.getenv("SCRAPER_PARSER", "lxml")
+
+_client: Optional[httpx.AsyncClient] = None
+_locks_host: Dict[str, asyncio.Lock] = {}
+_ultimo_request_host: Dict[str, float] = {}
 
 def limpiar_texto(texto: str) -> str:
     """
@@ -53,6 +91,22 @@ def extraer_texto_y_enlaces(elemento) -> Tuple[str, List[str]]:
     
     return texto, enlaces
 
+def calcular_hash_contenido(tramite: Dict) -> str:
+    """
+    Hash de los campos scrapeados del trámite (sin metadata), para saber si
+    la página cambió desde el último scraping
+    """
+    contenido = {k: v for k, v in tramite.items() if k != "metadata"}
+    serializado = json.dumps(contenido, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(serializado.encode("utf-8")).hexdigest()
+
+def sin_cambios(tramite: Dict, existente: Optional[Dict]) -> bool:
+    """True si el trámite ya estaba indexado con el mismo contenido"""
+    if not existente:
+        return False
+    hash_existente = existente.get("metadata", {}).get("hash_contenido")
+    return hash_existente is not None and hash_existente == tramite["metadata"].get("hash_contenido")
+
 def load_tramites_urls() -> List[str]:
     """Carga las URLs desde el archivo de configuración"""
     config_path = "/app/config/tramites_urls.json"
@@ -74,146 +128,490 @@ def extract_id_from_url(url: str) -> str:
     # ID: cambio-medico
     return url.rstrip('/').split('/')[-1]
 
-def scrape_tramite(url: str) -> Optional[Dict]:
+def _armar_tramite(
+    tramite_id: str,
+    titulo: str,
+    descripcion: str,
+    quien_puede_realizar: Dict,
+    documentacion_necesaria: Dict,
+    donde_realizar: Dict,
+    url: str
+) -> Dict:
+    # Construir estructura JSON
+    tramite = {
+        "id": tramite_id,
+        "titulo": titulo,
+        "descripcion": descripcion,
+        "quien_puede_realizar": quien_puede_realizar,
+        "documentacion_necesaria": documentacion_necesaria,
+        "donde_realizar": donde_realizar,
+        "url_oficial": url,
+        "metadata": {
+            "keywords": []  # Se generarán después con Ollama
+        }
+    }
+    tramite["metadata"]["hash_contenido"] = calcular_hash_contenido(tramite)
+    
+    return tramite
+
+def parsear_tramite_bs4(html: str, url: str) -> Optional[Dict]:
     """
-    Scrapea un trámite individual desde su URL
+    Arma la estructura JSON de un trámite a partir del HTML de su página
     
     Returns:
-        Dict con la estructura JSON del trámite o None si falla
+        Dict con el trámite o None si la página dice que no existe
     """
-    try:
-        print(f"🔍 Scrapeando: {url}")
-        
-        # Hacer request
-        response = httpx.get(url, timeout=30.0, follow_redirects=True)
-        response.raise_for_status()
-        
-        # Parsear HTML
-        soup = BeautifulSoup(response.text, 'lxml')
-        
-        # Extraer ID
-        tramite_id = extract_id_from_url(url)
-        
-        # Extraer título (h2)
-        titulo_tag = soup.find('h2')
-        titulo = titulo_tag.get_text(strip=True) if titulo_tag else "Sin título"
-
-        # AGREGAR ESTA VALIDACIÓN:
-        if "trámite no encontrado" in titulo.lower() or "no encontrado" in titulo.lower():
-            print(f"⚠️ Trámite no existe: {url}")
-            return None  # Esto hará que el endpoint devuelva error 500
+    # Parsear HTML
+    soup = BeautifulSoup(html, 'lxml')
+    
+    # Extraer ID
+    tramite_id = extract_id_from_url(url)
+    
+    # Extraer título (h2)
+    titulo_tag = soup.find('h2')
+    titulo = titulo_tag.get_text(strip=True) if titulo_tag else "Sin título"
+
+    # AGREGAR ESTA VALIDACIÓN:
+    if "trámite no encontrado" in titulo.lower() or "no encontrado" in titulo.lower():
+        print(f"⚠️ Trámite no existe: {url}")
+        return None  # Esto hará que el endpoint devuelva error 500
+    
+    # Extraer descripción (primer <p> después del h2)
+    descripcion = ""
+    if titulo_tag:
+        next_p = titulo_tag.find_next('p')
+        if next_p:
+            descripcion, _ = extraer_texto_y_enlaces(next_p)
+    
+    # Extraer secciones por h3
+    h3_tags = soup.find_all('h3')
+    
+    # Inicializar estructura
+    quien_puede_realizar = {"texto": "", "enlaces": []}
+    documentacion_necesaria = {"items": [], "enlaces": []}
+    donde_realizar = {"texto": "", "enlaces": []}
+    
+    for h3 in h3_tags:
+        seccion = h3.get_text(strip=True).upper()
         
-        # Extraer descripción (primer <p> después del h2)
-        descripcion = ""
-        if titulo_tag:
-            next_p = titulo_tag.find_next('p')
+        if "QUIÉN PUEDE REALIZAR" in seccion:
+            next_p = h3.find_next('p')
             if next_p:
-                descripcion, _ = extraer_texto_y_enlaces(next_p)
+                texto, enlaces = extraer_texto_y_enlaces(next_p)
+                quien_puede_realizar["texto"] = texto
+                quien_puede_realizar["enlaces"] = enlaces
         
-        # Extraer secciones por h3
-        h3_tags = soup.find_all('h3')
+        elif "QUÉ DOCUMENTACIÓN" in seccion or "DOCUMENTACIÓN SE NECESITA" in seccion:
+            next_ul = h3.find_next('ul')
+            if next_ul:
+                items = next_ul.find_all('li')
+                for item in items:
+                    texto, item_enlaces = extraer_texto_y_enlaces(item)
+                    if texto:
+                        documentacion_necesaria["items"].append(texto)
+                        # Agregar enlaces de este item (si los hay)
+                        documentacion_necesaria["enlaces"].extend(item_enlaces)
         
-        # Inicializar estructura
-        quien_puede_realizar = {"texto": "", "enlaces": []}
-        documentacion_necesaria = {"items": [], "enlaces": []}
-        donde_realizar = {"texto": "", "enlaces": []}
-        
-        for h3 in h3_tags:
-            seccion = h3.get_text(strip=True).upper()
+        elif "DÓNDE PUEDO REALIZAR" in seccion or "DÓNDE REALIZAR" in seccion:
+            # Buscar el siguiente H5 que marca el fin de la sección
+            h5_fin = None
+            current = h3.find_next()
+            while current:
+                if current.name == 'h5':
+                    h5_fin = current
+                    break
+                current = current.find_next()
             
-            if "QUIÉN PUEDE REALIZAR" in seccion:
-                next_p = h3.find_next('p')
-                if next_p:
-                    texto, enlaces = extraer_texto_y_enlaces(next_p)
-                    quien_puede_realizar["texto"] = texto
-                    quien_puede_realizar["enlaces"] = enlaces
+            # Extraer todos los <p> entre el H3 y el H5
+            textos = []
+            todos_enlaces = []
+            current = h3.find_next()
             
-            elif "QUÉ DOCUMENTACIÓN" in seccion or "DOCUMENTACIÓN SE NECESITA" in seccion:
-                next_ul = h3.find_next('ul')
-                if next_ul:
-                    items = next_ul.find_all('li')
-                    for item in items:
-                        texto, item_enlaces = extraer_texto_y_enlaces(item)
-                        if texto:
-                            documentacion_necesaria["items"].append(texto)
-                            # Agregar enlaces de este item (si los hay)
-                            documentacion_necesaria["enlaces"].extend(item_enlaces)
+            while current and current != h5_fin:
+                if current.name == 'p':
+                    texto, enlaces = extraer_texto_y_enlaces(current)
+                    if texto and texto not in ['', '\xa0', ' ']:
+                        textos.append(texto)
+                        todos_enlaces.extend(enlaces)
+                current = current.find_next()
             
-            elif "DÓNDE PUEDO REALIZAR" in seccion or "DÓNDE REALIZAR" in seccion:
-                # Buscar el siguiente H5 que marca el fin de la sección
-                h5_fin = None
-                current = h3.find_next()
-                while current:
-                    if current.name == 'h5':
-                        h5_fin = current
-                        break
-                    current = current.find_next()
-                
-                # Extraer todos los <p> entre el H3 y el H5
-                textos = []
-                todos_enlaces = []
-                current = h3.find_next()
-                
-                while current and current != h5_fin:
-                    if current.name == 'p':
-                        texto, enlaces = extraer_texto_y_enlaces(current)
-                        if texto and texto not in ['', '\xa0', ' ']:
-                            textos.append(texto)
-                            todos_enlaces.extend(enlaces)
-                    current = current.find_next()
-                
-                donde_realizar["texto"] = " ".join(textos)
-                donde_realizar["enlaces"] = todos_enlaces
+            donde_realizar["texto"] = " ".join(textos)
+            donde_realizar["enlaces"] = todos_enlaces
+    
+    return _armar_tramite(tramite_id, titulo, descripcion, quien_puede_realizar, documentacion_necesaria, donde_realizar, url)
+
+# Tags cuyo texto se rellena con espacios y tags cuyo texto no cuenta
+# (BeautifulSoup tampoco lo devuelve en get_text)
+TAGS_INLINE = {"strong", "b", "span", "a"}
+TAGS_SIN_TEXTO = {"script", "style", "template"}
+
+def _unico_hijo(elemento) -> bool:
+    """True si el elemento es el único nodo (sin texto alrededor) dentro de su padre"""
+    padre = elemento.getparent()
+    return padre is not None and not padre.text and len(padre) == 1 and not elemento.tail
+
+def _rellenar(nodo, raiz) -> bool:
+    """
+    Equivalente al replace_with de extraer_texto_y_enlaces: el texto de un nodo
+    sin hijos lleva espacios alrededor si es el .string de algún strong/b/span/a
+    dentro de la raíz (él mismo o un ancestro del que es hijo único)
+    """
+    while nodo is not raiz:
+        if nodo.tag in TAGS_INLINE:
+            return True
+        if not _unico_hijo(nodo):
+            return False
+        nodo = nodo.getparent()
+    return False
+
+def _fragmentos_texto(raiz, rellenar: bool) -> List[str]:
+    """Textos de la raíz en orden de documento, como los recorre get_text()"""
+    fragmentos = []
+
+    def recorrer(nodo):
+        if nodo.text:
+            visible = isinstance(nodo.tag, str) and nodo.tag not in TAGS_SIN_TEXTO
+            if rellenar and len(nodo) == 0 and _rellenar(nodo, raiz):
+                # replace_with deja como texto común incluso un comentario o un script
+                fragmentos.append(f" {nodo.text} ")
+            elif visible:
+                fragmentos.append(nodo.text)
+        for hijo in nodo:
+            recorrer(hijo)
+            if hijo.tail:
+                fragmentos.append(hijo.tail)
+
+    recorrer(raiz)
+    return fragmentos
+
+def _texto_strip(elemento) -> str:
+    """Equivalente a get_text(strip=True) de BeautifulSoup"""
+    return "".join(f.strip() for f in _fragmentos_texto(elemento, rellenar=False) if f.strip())
+
+def _extraer_texto_y_enlaces_lxml(elemento) -> Tuple[str, List[str]]:
+    """extraer_texto_y_enlaces para un elemento de lxml, sin modificar el árbol"""
+    texto = limpiar_texto("".join(_fragmentos_texto(elemento, rellenar=True)))
+
+    enlaces = []
+    for a in elemento.iter("a"):
+        if a is elemento or a.get("href") is None:
+            continue
+        href = a.get("href")
+        if href.startswith('/'):
+            href = f"https://www.pami.org.ar{href}"
+        enlaces.append(href)
+
+    return texto, enlaces
+
+class _IndiceDocumento:
+    """
+    Todos los tags del documento en orden (el de find_next de BeautifulSoup)
+    con la posición de cada h2/h3/h5/p/ul. "El siguiente <p> después de X" es
+    una búsqueda binaria en lugar de recorrer el árbol desde X.
+    """
+
+    TAGS = ("h2", "h3", "h5", "p", "ul")
+
+    def __init__(self, raiz):
+        self.elementos = []
+        self.posiciones: Dict[str, List[int]] = {tag: [] for tag in self.TAGS}
+        if raiz is None:
+            return
+        for elemento in raiz.iter():
+            if not isinstance(elemento.tag, str):
+                continue
+            if elemento.tag in self.posiciones:
+                self.posiciones[elemento.tag].append(len(self.elementos))
+            self.elementos.append(elemento)
+
+    def todos(self, tag: str) -> List[Tuple[int, object]]:
+        return [(i, self.elementos[i]) for i in self.posiciones[tag]]
+
+    def siguiente(self, tag: str, desde: int) -> Optional[int]:
+        """Posición del primer tag después de la posición desde (o None)"""
+        posiciones = self.posiciones[tag]
+        k = bisect.bisect_right(posiciones, desde)
+        return posiciones[k] if k < len(posiciones) else None
+
+    def entre(self, tag: str, desde: int, hasta: Optional[int]) -> List[object]:
+        """Los tags que están estrictamente entre dos posiciones"""
+        posiciones = self.posiciones[tag]
+        inicio = bisect.bisect_right(posiciones, desde)
+        fin = len(posiciones) if hasta is None else bisect.bisect_left(posiciones, hasta)
+        return [self.elementos[i] for i in posiciones[inicio:fin]]
+
+def _parsear_html_lxml(html: str):
+    try:
+        return etree.HTML(html)
+    except ValueError:
+        # Strings con declaración de encoding: lxml pide bytes
+        return etree.HTML(html.encode("utf-8"), etree.HTMLParser(encoding="utf-8"))
+
+def parsear_tramite_lxml(html: str, url: str) -> Optional[Dict]:
+    """
+    Mismo resultado que parsear_tramite_bs4, pero indexando el documento una
+    sola vez: cada sección se resuelve con búsquedas en el índice en lugar de
+    caminar find_next() elemento por elemento, y el texto se extrae sin
+    modificar el árbol.
+    
+    Returns:
+        Dict con el trámite o None si la página dice que no existe
+    """
+    indice = _IndiceDocumento(_parsear_html_lxml(html))
+    
+    tramite_id = extract_id_from_url(url)
+    
+    h2s = indice.todos("h2")
+    pos_h2, titulo_tag = h2s[0] if h2s else (None, None)
+    titulo = _texto_strip(titulo_tag) if titulo_tag is not None else "Sin título"
+    
+    if "trámite no encontrado" in titulo.lower() or "no encontrado" in titulo.lower():
+        print(f"⚠️ Trámite no existe: {url}")
+        return None
+    
+    descripcion = ""
+    if titulo_tag is not None:
+        pos_p = indice.siguiente("p", pos_h2)
+        if pos_p is not None:
+            descripcion, _ = _extraer_texto_y_enlaces_lxml(indice.elementos[pos_p])
+    
+    quien_puede_realizar = {"texto": "", "enlaces": []}
+    documentacion_necesaria = {"items": [], "enlaces": []}
+    donde_realizar = {"texto": "", "enlaces": []}
+    
+    for pos_h3, h3 in indice.todos("h3"):
+        seccion = _texto_strip(h3).upper()
         
-        # Construir estructura JSON
-        tramite = {
-            "id": tramite_id,
-            "titulo": titulo,
-            "descripcion": descripcion,
-            "quien_puede_realizar": quien_puede_realizar,
-            "documentacion_necesaria": documentacion_necesaria,
-            "donde_realizar": donde_realizar,
-            "url_oficial": url,
-            "metadata": {
-                "keywords": []  # Se generarán después con Ollama
-            }
-        }
+        if "QUIÉN PUEDE REALIZAR" in seccion:
+            pos_p = indice.siguiente("p", pos_h3)
+            if pos_p is not None:
+                texto, enlaces = _extraer_texto_y_enlaces_lxml(indice.elementos[pos_p])
+                quien_puede_realizar["texto"] = texto
+                quien_puede_realizar["enlaces"] = enlaces
         
-        print(f"✅ Trámite scrapeado: {tramite_id}")
-        return tramite
+        elif "QUÉ DOCUMENTACIÓN" in seccion or "DOCUMENTACIÓN SE NECESITA" in seccion:
+            pos_ul = indice.siguiente("ul", pos_h3)
+            if pos_ul is not None:
+                ul = indice.elementos[pos_ul]
+                for item in ul.iter("li"):
+                    if item is ul:
+                        continue
+                    texto, item_enlaces = _extraer_texto_y_enlaces_lxml(item)
+                    if texto:
+                        documentacion_necesaria["items"].append(texto)
+                        documentacion_necesaria["enlaces"].extend(item_enlaces)
         
-    except httpx.HTTPError as e:
-        print(f"❌ Error HTTP scrapeando {url}: {e}")
-        return None
-    except Exception as e:
-        print(f"❌ Error inesperado scrapeando {url}: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+        elif "DÓNDE PUEDO REALIZAR" in seccion or "DÓNDE REALIZAR" in seccion:
+            # Los <p> entre el H3 y el siguiente H5 (o el final de la página)
+            textos = []
+            todos_enlaces = []
+            for p in indice.entre("p", pos_h3, indice.siguiente("h5", pos_h3)):
+                texto, enlaces = _extraer_texto_y_enlaces_lxml(p)
+                if texto:
+                    textos.append(texto)
+                    todos_enlaces.extend(enlaces)
+            
+            donde_realizar["texto"] = " ".join(textos)
+            donde_realizar["enlaces"] = todos_enlaces
+    
+    return _armar_tramite(tramite_id, titulo, descripcion, quien_puede_realizar, documentacion_necesaria, donde_realizar, url)
+
+PARSERS = {
+    "lxml": parsear_tramite_lxml,
+    "bs4": parsear_tramite_bs4,
+}
+
+def parsear_tramite(html: str, url: str) -> Optional[Dict]:
+    """Arma el trámite a partir del HTML con el parser de SCRAPER_PARSER"""
+    return PARSERS[SCRAPER_PARSER](html, url)
 
-def scrape_all_tramites() -> List[Dict]:
+def get_scraper_client() -> httpx.AsyncClient:
+    """Obtiene el cliente HTTP del scraper con keep-alive (singleton)"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=SCRAPER_CONCURRENCY,
+                max_keepalive_connections=SCRAPER_CONCURRENCY
+            ),
+            timeout=httpx.Timeout(SCRAPER_TIMEOUT),
+            follow_redirects=True
+        )
+    return _client
+
+async def close_scraper_client():
+    """Cierra el pool de conexiones del scraper (shutdown de la app)"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def _esperar_turno_host(url: str):
+    """Respeta SCRAPER_HOST_DELAY entre requests al mismo host"""
+    host = urlsplit(url).netloc
+    lock = _locks_host.setdefault(host, asyncio.Lock())
+    async with lock:
+        espera = _ultimo_request_host.get(host, 0.0) + SCRAPER_HOST_DELAY - time.monotonic()
+        if espera > 0:
+            await asyncio.sleep(espera)
+        _ultimo_request_host[host] = time.monotonic()
+
+async def _descargar(url: str, tiempos: Dict, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    """
+    GET con reintentos y backoff exponencial ante errores de red, 429 y 5xx.
+    Va contando los intentos en tiempos["intentos"]. Un 304 (respuesta al GET
+    condicional) se devuelve tal cual.
     """
-    Scrapea todos los trámites desde el archivo de configuración
+    client = get_scraper_client()
+    intento = 0
+    while True:
+        intento += 1
+        tiempos["intentos"] = intento
+        await _esperar_turno_host(url)
+        try:
+            response = await client.get(url, headers=headers)
+            if response.status_code == 304:
+                return response
+            response.raise_for_status()
+            return response
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code not in REINTENTAR_STATUS or intento > SCRAPER_RETRIES:
+                raise
+            error = e
+        except httpx.TransportError as e:
+            if intento > SCRAPER_RETRIES:
+                raise
+            error = e
+        
+        espera = SCRAPER_BACKOFF * 2 ** (intento - 1)
+        print(f"⚠️ Reintentando {url} en {espera:.1f}s ({error})")
+        await asyncio.sleep(espera)
+
+async def descargar_pagina(
+    url: str,
+    tiempos: Dict,
+    existente: Optional[Dict] = None
+) -> Tuple[Optional[str], Optional[Dict]]:
+    """
+    Trae el HTML de un trámite usando GET condicional contra la caché HTTP
+    (o solo la caché, en modo offline). Va completando fetch_ms, intentos y
+    cache en tiempos.
+    
+    Args:
+        url: URL del trámite
+        tiempos: Registro de la URL (ver nuevo_registro_tiempos)
+        existente: El trámite ya indexado
     
     Returns:
-        Lista de trámites (sin keywords aún)
+        (html, None) si hay que parsear la página, o (None, copia de existente)
+        si respondió 304 y el trámite indexado salió de la página guardada
     """
-    urls = load_tramites_urls()
+    inicio = time.perf_counter()
+    entrada = await asyncio.to_thread(http_cache.leer, url)
     
-    if not urls:
-        print("⚠️ No hay URLs para scrapear")
-        return []
+    if SCRAPER_OFFLINE:
+        if not entrada:
+            raise ValueError("La página no está en la caché HTTP (modo offline)")
+        tiempos["cache"] = "offline"
+        return entrada["body"], None
+    
+    # Incluye la pausa por host y los reintentos
+    try:
+        response = await _descargar(url, tiempos, http_cache.headers_condicionales(entrada))
+    finally:
+        tiempos["fetch_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+    
+    if response.status_code == 304 and entrada:
+        tiempos["cache"] = "304"
+        hash_indexado = (existente or {}).get("metadata", {}).get("hash_contenido")
+        if hash_indexado and hash_indexado == entrada.get("hash_contenido"):
+            # Sin cambios: no hace falta parsear, ni keywords, ni embedding
+            print(f"✅ Trámite sin cambios (304): {existente['id']}")
+            return None, copy.deepcopy(existente)
+        # El HTML guardado todavía no llegó al índice (p. ej. falló el upsert
+        # de la corrida anterior): se vuelve a parsear
+        return entrada["body"], None
+    
+    html = response.text
+    await asyncio.to_thread(
+        http_cache.guardar,
+        url,
+        html,
+        response.headers.get("etag"),
+        response.headers.get("last-modified")
+    )
+    return html, None
+
+async def parsear_pagina(html: str, url: str, tiempos: Dict, en_proceso_aparte: bool = False) -> Optional[Dict]:
+    """
+    Parsea el HTML fuera del event loop (y en los scrapings masivos en otro
+    proceso, para que escale con los núcleos). Completa parse_ms, ok y error.
+    """
+    inicio = time.perf_counter()
+    if en_proceso_aparte:
+        tramite = await run_in_process(parsear_tramite, html, url)
+    else:
+        tramite = await asyncio.to_thread(parsear_tramite, html, url)
+    tiempos["parse_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
     
-    print(f"📋 Se van a scrapear {len(urls)} trámites")
+    if tramite:
+        tiempos["ok"] = True
+        print(f"✅ Trámite scrapeado: {tramite['id']} ({tiempos['fetch_ms']:.0f} ms + {tiempos['parse_ms']:.0f} ms)")
+        if tiempos["cache"] != "offline":
+            await asyncio.to_thread(http_cache.anotar_hash_contenido, url, tramite["metadata"]["hash_contenido"])
+    else:
+        tiempos["error"] = "Trámite no encontrado"
+    return tramite
+
+def nuevo_registro_tiempos(url: str) -> Dict:
+    return {"url": url, "ok": False, "fetch_ms": 0.0, "parse_ms": 0.0, "intentos": 0, "cache": None, "error": None}
+
+def registrar_error_scraping(url: str, tiempos: Dict, e: Exception):
+    """Anota en tiempos (y en el log) por qué falló el scraping de una URL"""
+    if isinstance(e, httpx.HTTPStatusError):
+        tiempos["error"] = f"HTTP {e.response.status_code}"
+        print(f"❌ Error HTTP scrapeando {url}: {e.response.status_code}")
+    elif isinstance(e, httpx.HTTPError):
+        tiempos["error"] = f"HTTP: {type(e).__name__}"
+        print(f"❌ Error HTTP scrapeando {url}: {e}")
+    else:
+        tiempos["error"] = str(e)
+        print(f"❌ Error inesperado scrapeando {url}: {e}")
+
+async def scrape_tramite_async(
+    url: str,
+    reporte: Optional[List[Dict]] = None,
+    existente: Optional[Dict] = None,
+    en_proceso_aparte: bool = False
+) -> Optional[Dict]:
+    """
+    Scrapea un trámite con el cliente asíncrono compartido, usando GET
+    condicional contra la caché HTTP
+    
+    Args:
+        url: URL del trámite
+        reporte: Si se pasa, se le agrega {url, ok, fetch_ms, parse_ms, intentos, cache, error}
+        existente: El trámite ya indexado. Si la página responde 304 se
+                   devuelve una copia de este sin volver a parsear.
+        en_proceso_aparte: Parsear en el pool de procesos (scrapings masivos)
     
-    tramites = []
-    for url in urls:
-        tramite = scrape_tramite(url)
+    Returns:
+        Dict con la estructura JSON del trámite o None si falla
+    """
+    tiempos = nuevo_registro_tiempos(url)
+    tramite = None
+    try:
+        html, tramite = await descargar_pagina(url, tiempos, existente)
         if tramite:
-            tramites.append(tramite)
+            tiempos["ok"] = True
+        else:
+            tramite = await parsear_pagina(html, url, tiempos, en_proceso_aparte)
+    except Exception as e:
+        registrar_error_scraping(url, tiempos, e)
     
-    print(f"\n✅ Scraping completado: {len(tramites)}/{len(urls)} exitosos")
-    return tramites
+    if reporte is not None:
+        reporte.append(tiempos)
+    return tramite
 
 async def generar_keywords_con_ollama(tramite: Dict) -> List[str]:
     """
@@ -235,58 +633,131 @@ Descripción: {tramite['descripcion']}
 Respondé ÚNICAMENTE con las palabras separadas por comas, sin numeración ni explicaciones adicionales.
 Ejemplo de respuesta válida: medico, cabecera, cambio, asignacion, afiliado"""
 
-        # Llamar a Ollama
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "http://nodo-ia:11434/api/generate",
-                json={
-                    "model": "llama3.2:3b",
-                    "prompt": prompt,
-                    "stream": False
-                },
-                timeout=60.0
-            )
-            
-            if response.status_code != 200:
-                print(f"⚠️ Error en Ollama para {tramite['id']}: {response.status_code}")
-                return []
-            
-            resultado = response.json()
-            respuesta = resultado.get("response", "").strip()
-            
-            # Parsear la respuesta (viene como: "palabra1, palabra2, palabra3")
-            keywords = [k.strip().lower() for k in respuesta.split(',') if k.strip()]
-            
-            # Limitar a máximo 7 keywords
-            keywords = keywords[:7]
-            
-            print(f"✅ Keywords generadas para {tramite['id']}: {keywords}")
-            return keywords
+        # Llamar a Ollama (cliente compartido, cola propia para keywords)
+        response = await generate({"prompt": prompt, "stream": False}, backend="keywords")
+        
+        if response.status_code != 200:
+            print(f"⚠️ Error en Ollama para {tramite['id']}: {response.status_code}")
+            return []
+        
+        resultado = response.json()
+        respuesta = resultado.get("response", "").strip()
+        
+        # Parsear la respuesta (viene como: "palabra1, palabra2, palabra3")
+        keywords = _normalizar_keywords(respuesta)
+        
+        print(f"✅ Keywords generadas para {tramite['id']}: {keywords}")
+        return keywords
             
     except Exception as e:
         print(f"❌ Error generando keywords para {tramite['id']}: {e}")
         return []
 
 
-async def scrape_and_generate_keywords() -> List[Dict]:
+def _normalizar_keywords(valor) -> List[str]:
+    """Lista de keywords en minúscula, sin vacías, con el máximo de KEYWORDS_MAX"""
+    if isinstance(valor, str):
+        valor = valor.split(',')
+    if not isinstance(valor, list):
+        return []
+    keywords = [str(k).strip().lower() for k in valor if str(k).strip()]
+    return keywords[:KEYWORDS_MAX]
+
+def _parsear_keywords_lote(respuesta: str, ids: List[str]) -> Dict[str, List[str]]:
+    """
+    Keywords por id a partir de la respuesta del prompt en lote. Tolera JSON
+    cortado o con texto alrededor: se queda con los ids que se puedan leer.
+    """
+    datos = None
+    inicio, fin = respuesta.find("{"), respuesta.rfind("}")
+    if inicio != -1 and fin > inicio:
+        try:
+            datos = json.loads(respuesta[inicio:fin + 1])
+        except json.JSONDecodeError:
+            datos = None
+
+    resultado = {}
+    if isinstance(datos, dict):
+        for tramite_id in ids:
+            keywords = _normalizar_keywords(datos.get(tramite_id))
+            if keywords:
+                resultado[tramite_id] = keywords
+        return resultado
+
+    # JSON inválido (p. ej. cortado por el límite de tokens): buscar id por id
+    for tramite_id in ids:
+        match = re.search(rf'"{re.escape(tramite_id)}"\s*:\s*\[([^\]]*)\]', respuesta)
+        if match:
+            keywords = _normalizar_keywords(re.findall(r'"([^"]+)"', match.group(1)))
+            if keywords:
+                resultado[tramite_id] = keywords
+    return resultado
+
+async def generar_keywords_lote(tramites: List[Dict]) -> Dict[str, List[str]]:
     """
-    Función principal: scrapea todos los trámites y genera sus keywords
+    Genera keywords para varios trámites con un solo prompt que pide un JSON
+    {id: [keywords]}. Los trámites que falten en la respuesta se reintentan
+    de a uno con generar_keywords_con_ollama.
     
     Returns:
-        Lista de trámites completos (con keywords)
+        Keywords por id de trámite
     """
-    # Primero scrapear todo
-    tramites = scrape_all_tramites()
+    if len(tramites) == 1:
+        return {tramites[0]["id"]: await generar_keywords_con_ollama(tramites[0])}
     
-    if not tramites:
-        return []
+    ids = [t["id"] for t in tramites]
+    resultado: Dict[str, List[str]] = {}
+    try:
+        listado = "\n\n".join(
+            f"id: {t['id']}\nTítulo: {t['titulo']}\nDescripción: {t['descripcion']}"
+            for t in tramites
+        )
+        prompt = f"""Para cada uno de los siguientes trámites de PAMI, generá entre 5 y 7 palabras clave (keywords) relevantes que ayuden a identificar y buscar el trámite. Las palabras deben ser simples, en español, y representar los conceptos más importantes.
+
+{listado}
+
+Respondé ÚNICAMENTE con un objeto JSON cuyas claves sean los id de los trámites y cuyos valores sean listas de palabras, sin explicaciones adicionales.
+Ejemplo de respuesta válida: {{"cambio-medico": ["medico", "cabecera", "cambio", "asignacion", "afiliado"]}}"""
+
+        response = await generate(
+            {"prompt": prompt, "stream": False, "format": "json"},
+            backend="keywords"
+        )
+        
+        if response.status_code == 200:
+            resultado = _parsear_keywords_lote(response.json().get("response", ""), ids)
+        else:
+            print(f"⚠️ Error en Ollama para el lote {ids}: {response.status_code}")
+    except Exception as e:
+        print(f"❌ Error generando keywords para el lote {ids}: {e}")
+    
+    faltantes = [t for t in tramites if t["id"] not in resultado]
+    if faltantes:
+        print(f"⚠️ {len(faltantes)}/{len(tramites)} trámites sin keywords en el lote: se piden de a uno")
+        individuales = await asyncio.gather(*(generar_keywords_con_ollama(t) for t in faltantes))
+        for tramite, keywords in zip(faltantes, individuales):
+            resultado[tramite["id"]] = keywords
     
-    print(f"\n🤖 Generando keywords con Ollama para {len(tramites)} trámites...")
+    for tramite_id in ids:
+        print(f"✅ Keywords generadas para {tramite_id}: {resultado.get(tramite_id, [])}")
+    return resultado
+
+async def generar_keywords_en_lotes(tramites: List[Dict], batch_size: Optional[int] = None):
+    """
+    Completa metadata.keywords de los trámites, armando lotes de batch_size
+    (default KEYWORDS_BATCH_SIZE). Los lotes se mandan todos juntos y el
+    semáforo del backend "keywords" de Ollama limita cuántos corren a la vez.
+    """
+    if not tramites:
+        return
+    batch_size = batch_size or KEYWORDS_BATCH_SIZE
+    lotes = [tramites[i:i + batch_size] for i in range(0, len(tramites), batch_size)]
     
-    # Generar keywords para cada trámite
-    for tramite in tramites:
-        keywords = await generar_keywords_con_ollama(tramite)
-        tramite["metadata"]["keywords"] = keywords
+    inicio = time.perf_counter()
+    resultados = await asyncio.gather(*(generar_keywords_lote(lote) for lote in lotes))
+    for lote, keywords in zip(lotes, resultados):
+        for tramite in lote:
+            tramite["metadata"]["keywords"] = keywords.get(tramite["id"], [])
     
-    print(f"\n✅ Proceso completo: {len(tramites)} trámites con keywords generadas")
-    return tramites
\ No newline at end of file
+    segundos = time.perf_counter() - inicio
+    print(f"🤖 Keywords de {len(tramites)} trámites en {segundos:.1f}s ({len(tramites) / segundos * 60:.1f} trámites/minuto)")
@@ -0,0 +1,163 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+# Límites por defecto de cada store de sesiones: cantidad de sesiones, memoria
+# estimada en total y tiempo sin uso después del cual una sesión se descarta
+SESSION_MAX_ENTRADAS = int(os.getenv("SESSION_MAX_ENTRADAS", 5000))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", 64 * 1024 * 1024))
+SESSION_TTL_SEGUNDOS = float(os.getenv("SESSION_TTL_SEGUNDOS", 2 * 3600))
+
+_stores: Dict[str, "SessionStore"] = {}
+
+def estimar_bytes(valor: Any) -> int:
+    """Memoria aproximada de un valor y de lo que contiene (dicts, listas, strings)"""
+    tamano = sys.getsizeof(valor)
+    if isinstance(valor, dict):
+        tamano += sum(estimar_bytes(k) + estimar_bytes(v) for k, v in valor.items())
+    elif isinstance(valor, (list, tuple, set)):
+        tamano += sum(estimar_bytes(v) for v in valor)
+    return tamano
+
+class SessionStore:
+    """
+    Estado por sesión (p. ej. por usuario) acotado en memoria: LRU con
+    vencimiento por inactividad y tope de sesiones y de bytes estimados.
+
+    Los valores se guardan por referencia: si se modifican en el lugar hay
+    que volver a llamar a set para que se recalcule su tamaño.
+    """
+
+    def __init__(
+        self,
+        nombre: str,
+        max_entradas: int = SESSION_MAX_ENTRADAS,
+        max_bytes: int = SESSION_MAX_BYTES,
+        ttl_segundos: float = SESSION_TTL_SEGUNDOS
+    ):
+        self.nombre = nombre
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.ttl_segundos = ttl_segundos
+        # clave -> (último uso, valor, bytes estimados)
+        self._entradas: "OrderedDict[Hashable, Tuple[float, Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions_lru = 0
+        self.evictions_ttl = 0
+        self.evictions_memoria = 0
+        _stores[nombre] = self
+
+    def _quitar(self, clave: Hashable):
+        _, _, tamano = self._entradas.pop(clave)
+        self.bytes -= tamano
+
+    def _purgar_vencidas(self, ahora: float):
+        # El orden LRU es también el de inactividad: las vencidas están al principio
+        while self._entradas:
+            clave, (ultimo_uso, _, _) = next(iter(self._entradas.items()))
+            if ahora - ultimo_uso <= self.ttl_segundos:
+                break
+            self._quitar(clave)
+            self.evictions_ttl += 1
+
+    def get(self, clave: Hashable) -> Optional[Any]:
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.misses += 1
+                return None
+
+            ultimo_uso, valor, tamano = entrada
+            if ahora - ultimo_uso > self.ttl_segundos:
+                self._quitar(clave)
+                self.evictions_ttl += 1
+                self.misses += 1
+                return None
+
+            self._entradas[clave] = (ahora, valor, tamano)
+            self._entradas.move_to_end(clave)
+            self.hits += 1
+            return valor
+
+    def peek(self, clave: Hashable) -> Optional[Any]:
+        """Valor guardado, sin contarlo como uso (ni para el LRU ni en las estadísticas); None si venció"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            if time.monotonic() - entrada[0] > self.ttl_segundos:
+                self._quitar(clave)
+                self.evictions_ttl += 1
+                return None
+            return entrada[1]
+
+    def set(self, clave: Hashable, valor: Any):
+        """Guarda (o actualiza) la sesión y descarta las que hagan falta para respetar los topes"""
+        tamano = estimar_bytes(valor)
+        ahora = time.monotonic()
+        with self._lock:
+            if clave in self._entradas:
+                self._quitar(clave)
+            self._entradas[clave] = (ahora, valor, tamano)
+            self.bytes += tamano
+
+            self._purgar_vencidas(ahora)
+            while len(self._entradas) > self.max_entradas:
+                self._quitar(next(iter(self._entradas)))
+                self.evictions_lru += 1
+            # La sesión recién guardada no se descarta aunque sola supere el tope
+            while self.bytes > self.max_bytes and len(self._entradas) > 1:
+                self._quitar(next(iter(self._entradas)))
+                self.evictions_memoria += 1
+
+    def delete(self, clave: Hashable):
+        with self._lock:
+            if clave in self._entradas:
+                self._quitar(clave)
+
+    def purgar(self) -> int:
+        """Descarta las sesiones vencidas; devuelve cuántas quedaron"""
+        with self._lock:
+            self._purgar_vencidas(time.monotonic())
+            return len(self._entradas)
+
+    def clear(self):
+        with self._lock:
+            self._entradas.clear()
+            self.bytes = 0
+
+    def __contains__(self, clave: Hashable) -> bool:
+        return self.get(clave) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entradas)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._purgar_vencidas(time.monotonic())
+            total = self.hits + self.misses
+            return {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_segundos": self.ttl_segundos,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "evictions_lru": self.evictions_lru,
+                "evictions_ttl": self.evictions_ttl,
+                "evictions_memoria": self.evictions_memoria,
+            }
+
+def get_session_stores_stats() -> Dict[str, Dict]:
+    """Estadísticas de todos los stores de sesiones creados, por nombre"""
+    return {nombre: store.stats() for nombre, store in list(_stores.items())}
@@ -1,14 +1,48 @@
 import chromadb
-from sentence_transformers import SentenceTransformer
+import fcntl
 import json
-from typing import List, Dict, Optional
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Dict, Optional, Tuple
 
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+from utils.answer_cache import answer_cache
+from utils.embedding_batcher import EmbeddingBatcher
+from utils.embeddings import get_embedding_function
+from utils.numpy_index import NumpyIndex
+from utils.payload_store import (
+    guardar_payloads,
+    obtener_payloads,
+    iterar_payloads,
+    eliminar_payloads,
+    eliminar_coleccion_payloads
+)
 
 CHROMA_PATH = "/app/database/chroma"
 COLLECTION_NAME = "tramites_pami"
 
+# Qué versión de la colección está activa. Cada re-indexado completo crea
+# una colección nueva (COLLECTION_NAME_v<timestamp>) y solo al terminar se
+# cambia la activa; la anterior se conserva para poder volver atrás.
+ESTADO_PATH = "/app/database/vector_store_estado.json"
+
+# Motor de búsqueda: "chroma" (índice HNSW) o "numpy" (búsqueda exacta en
+# memoria, conviene para catálogos de unos pocos cientos de trámites)
+SEARCH_ENGINE = os.getenv("SEARCH_ENGINE", "chroma")
+
+# Trámites que se embeben y escriben juntos en add_tramites
+VECTOR_STORE_BATCH_SIZE = int(os.getenv("VECTOR_STORE_BATCH_SIZE", 64))
+
 _chroma_client = None
+_colecciones: Dict[str, object] = {}
+_estado_cache: Dict = {"mtime": None, "estado": None}
+_estado_lock = threading.Lock()
+
+# Las consultas concurrentes se embeben en lotes en lugar de una por una
+embedding_batcher = EmbeddingBatcher(get_embedding_function)
+
+numpy_index = NumpyIndex()
 
 def get_chroma_client():
     """Obtiene el cliente de ChromaDB con persistencia (singleton)"""
@@ -17,14 +51,150 @@ def get_chroma_client():
         _chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
     return _chroma_client
 
-def get_or_create_collection():
-    """Obtiene o crea la colección de trámites"""
-    client = get_chroma_client()
-    collection = client.get_or_create_collection(
-        name=COLLECTION_NAME,
-        metadata={"description": "Trámites de PAMI"}
-    )
-    return collection
+def _leer_estado(forzar: bool = False) -> Dict:
+    """
+    Lee el estado de las colecciones (se relee solo si el archivo cambió, p. ej.
+    desde otro worker, o siempre con forzar=True). Si cambió la colección
+    activa o su revisión se vacía el cache de respuestas de este proceso.
+    """
+    try:
+        mtime = os.path.getmtime(ESTADO_PATH)
+    except OSError:
+        return {"activa": COLLECTION_NAME, "anterior": None}
+    
+    with _estado_lock:
+        if forzar or _estado_cache["mtime"] != mtime:
+            try:
+                with open(ESTADO_PATH, 'r', encoding='utf-8') as f:
+                    estado = json.load(f)
+                anterior = _estado_cache["estado"]
+                if anterior is not None and (
+                    (anterior.get("activa"), anterior.get("revision")) != (estado.get("activa"), estado.get("revision"))
+                ):
+                    # Otro worker activó otra colección o cambió trámites de la
+                    # activa: las respuestas cacheadas acá pueden ser viejas
+                    answer_cache.clear()
+                _estado_cache["estado"] = estado
+                _estado_cache["mtime"] = mtime
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"⚠️ No se pudo leer el estado de la base vectorial: {e}")
+                if _estado_cache["estado"] is None:
+                    return {"activa": COLLECTION_NAME, "anterior": None}
+        return dict(_estado_cache["estado"])
+
+@contextmanager
+def _estado_bloqueado() -> Iterator[Dict]:
+    """
+    Lock de archivo (entre procesos y threads) para leer, modificar y
+    escribir el estado sin pisar el cambio de otro worker. Devuelve el estado
+    releído del archivo ya con el lock tomado.
+    """
+    os.makedirs(os.path.dirname(ESTADO_PATH), exist_ok=True)
+    with open(f"{ESTADO_PATH}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield _leer_estado(forzar=True)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _guardar_estado(estado: Dict):
+    """Escribe el estado de forma atómica (archivo temporal + rename). Llamar con _estado_bloqueado."""
+    tmp_path = f"{ESTADO_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(estado, f, indent=2)
+    os.replace(tmp_path, ESTADO_PATH)
+    
+    with _estado_lock:
+        _estado_cache["estado"] = dict(estado)
+        _estado_cache["mtime"] = os.path.getmtime(ESTADO_PATH)
+
+def _marcar_cambio(nombre: str):
+    """Registra que la colección activa cambió de contenido (invalida el índice en memoria de cada worker)"""
+    try:
+        with _estado_bloqueado() as estado:
+            if nombre == estado["activa"]:
+                estado["revision"] = time.time_ns()
+                _guardar_estado(estado)
+    except OSError as e:
+        print(f"⚠️ No se pudo registrar el cambio de la colección: {e}")
+
+def get_active_collection_name() -> str:
+    """Nombre de la colección que atiende las búsquedas"""
+    return _leer_estado()["activa"]
+
+def get_or_create_collection(name: Optional[str] = None):
+    """Obtiene o crea una colección de trámites (por defecto la activa)"""
+    name = name or get_active_collection_name()
+    if name not in _colecciones:
+        client = get_chroma_client()
+        _colecciones[name] = client.get_or_create_collection(
+            name=name,
+            metadata={"description": "Trámites de PAMI"},
+            embedding_function=get_embedding_function()
+        )
+    return _colecciones[name]
+
+def crear_coleccion_nueva() -> str:
+    """Crea una colección vacía para re-indexar sin tocar la activa"""
+    nombre = f"{COLLECTION_NAME}_v{int(time.time() * 1000)}"
+    get_or_create_collection(nombre)
+    print(f"🆕 Colección nueva: {nombre}")
+    return nombre
+
+def eliminar_coleccion(nombre: str):
+    """Borra una colección (nunca la activa)"""
+    if nombre == get_active_collection_name():
+        raise ValueError(f"No se puede borrar la colección activa: {nombre}")
+    _colecciones.pop(nombre, None)
+    try:
+        get_chroma_client().delete_collection(nombre)
+        print(f"🗑️ Colección eliminada: {nombre}")
+    except ValueError:
+        # Ya no existía
+        pass
+    eliminar_coleccion_payloads(nombre)
+
+def activar_coleccion(nombre: str) -> Dict:
+    """
+    Pasa a usar la colección indicada para todas las búsquedas
+    
+    La que estaba activa queda como "anterior" (para rollback) y la
+    anterior a esa se elimina.
+    
+    Returns:
+        Dict: Estado nuevo {"activa", "anterior"}
+    """
+    with _estado_bloqueado() as estado:
+        descartada = estado.get("anterior")
+        nuevo_estado = {"activa": nombre, "anterior": estado["activa"], "revision": time.time_ns()}
+        _guardar_estado(nuevo_estado)
+    answer_cache.clear()
+    print(f"🔀 Colección activa: {nombre} (anterior: {estado['activa']})")
+    
+    if descartada and descartada not in (nombre, estado["activa"]):
+        eliminar_coleccion(descartada)
+    
+    return nuevo_estado
+
+def rollback_coleccion() -> Dict:
+    """
+    Vuelve a la colección anterior (intercambia activa y anterior)
+    
+    Returns:
+        Dict: Estado nuevo {"activa", "anterior"}
+    """
+    with _estado_bloqueado() as estado:
+        if not estado.get("anterior"):
+            raise ValueError("No hay una versión anterior de la base vectorial")
+        nuevo_estado = {"activa": estado["anterior"], "anterior": estado["activa"], "revision": time.time_ns()}
+        _guardar_estado(nuevo_estado)
+    answer_cache.clear()
+    print(f"↩️ Rollback: colección activa {nuevo_estado['activa']}")
+    return nuevo_estado
+
+def get_estado_colecciones() -> Dict:
+    """Colección activa y anterior"""
+    return _leer_estado()
 
 def create_searchable_text(tramite: Dict) -> str:
     parts = [
@@ -38,9 +208,93 @@ def create_searchable_text(tramite: Dict) -> str:
     
     return " ".join(parts)
 
+def _validar_tramite(tramite: Dict):
+    """Lanza KeyError/TypeError si faltan los campos mínimos"""
+    for campo in ("id", "titulo", "url_oficial"):
+        tramite[campo]
+
+def add_tramites(
+    tramites: List[Dict],
+    batch_size: Optional[int] = None,
+    collection_name: Optional[str] = None
+) -> List[Dict]:
+    """
+    Inserta o actualiza (upsert) varios trámites en la base vectorial, por lotes
+    
+    Cada lote se embebe en una sola pasada y se escribe con un único upsert.
+    
+    Args:
+        tramites: Lista de diccionarios con la estructura JSON definida
+        batch_size: Trámites por lote (default: VECTOR_STORE_BATCH_SIZE)
+        collection_name: Colección destino (default: la activa)
+    
+    Returns:
+        Lista con el estado de cada trámite, en el mismo orden:
+        {"id": str, "ok": bool, "error": Optional[str]}
+    """
+    batch_size = batch_size or VECTOR_STORE_BATCH_SIZE
+    estados = [{"id": t.get("id") if isinstance(t, dict) else None, "ok": False, "error": None} for t in tramites]
+    
+    # Validar y quedarse con la última aparición de cada id (ChromaDB rechaza ids repetidos en un upsert)
+    validos: Dict[str, int] = {}
+    for i, tramite in enumerate(tramites):
+        try:
+            _validar_tramite(tramite)
+        except (KeyError, TypeError) as e:
+            estados[i]["error"] = f"Trámite inválido, falta el campo {e}"
+            continue
+        if tramite["id"] in validos:
+            estados[validos[tramite["id"]]]["error"] = "Id duplicado en el lote"
+        validos[tramite["id"]] = i
+    
+    indices = list(validos.values())
+    if not indices:
+        return estados
+    
+    try:
+        collection = get_or_create_collection(collection_name)
+    except Exception as e:
+        print(f"❌ Error obteniendo la colección: {e}")
+        for i in indices:
+            estados[i]["error"] = str(e)
+        return estados
+    
+    embedding_function = get_embedding_function()
+    
+    for inicio in range(0, len(indices), batch_size):
+        lote = [tramites[i] for i in indices[inicio:inicio + batch_size]]
+        indices_lote = indices[inicio:inicio + batch_size]
+        
+        try:
+            textos = [create_searchable_text(t) for t in lote]
+            embeddings = embedding_function(textos)
+            
+            # El JSON va al payload store; ChromaDB solo guarda ids + embeddings
+            guardar_payloads(collection.name, lote)
+            collection.upsert(
+                ids=[t["id"] for t in lote],
+                embeddings=embeddings
+            )
+            
+            for i, tramite in zip(indices_lote, lote):
+                estados[i]["ok"] = True
+                # Las respuestas cacheadas de este trámite quedaron viejas
+                answer_cache.invalidate_tramite(tramite["id"])
+                
+        except Exception as e:
+            print(f"❌ Error insertando lote de {len(lote)} trámites: {e}")
+            for i in indices_lote:
+                estados[i]["error"] = str(e)
+    
+    ok = sum(1 for estado in estados if estado["ok"])
+    if ok:
+        _marcar_cambio(collection.name)
+    print(f"✅ {ok}/{len(tramites)} trámites insertados en ChromaDB")
+    return estados
+
 def add_tramite(tramite: Dict) -> bool:
     """
-    Agrega un trámite a la base vectorial
+    Agrega (o actualiza) un trámite en la base vectorial
     
     Args:
         tramite: Diccionario con la estructura JSON definida
@@ -48,48 +302,69 @@ def add_tramite(tramite: Dict) -> bool:
     Returns:
         bool: True si se agregó exitosamente
     """
-    try:
-        collection = get_or_create_collection()
-        
-        # Crear texto para embedear
-        searchable_text = create_searchable_text(tramite)
-        
-        # Preparar metadata con el JSON completo incluido
-        metadata = {
-            "id": tramite["id"],
-            "titulo": tramite["titulo"],
-            "url_oficial": tramite["url_oficial"],
-            "json_data": json.dumps(tramite, ensure_ascii=False)
-        }
-        
-        print(f"DEBUG: Insertando con ID: {tramite['id']}")
-        print(f"DEBUG: Texto para embedear: {searchable_text[:100]}...")
-        
-        # UNA SOLA operación: add
-        collection.add(
-            ids=[tramite["id"]],
-            documents=[searchable_text],
-            metadatas=[metadata]
-        )
-        
-        print(f"DEBUG: add() ejecutado sin error")
-        
-        # Verificar que se insertó
-        count_after = collection.count()
-        print(f"DEBUG: Count después de add: {count_after}")
-        
-        print(f"✅ Trámite '{tramite['id']}' agregado a ChromaDB")
-        return True
-        
-    except Exception as e:
-        print(f"❌ Error agregando trámite: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
+    estado = add_tramites([tramite])[0]
+    if not estado["ok"]:
+        print(f"❌ Error agregando trámite: {estado['error']}")
+    return estado["ok"]
 
-def search_tramites(query: str, n_results: int = 3, distance_threshold: float = 1.0) -> List[Dict]:
+def _version_activa() -> Tuple[str, Optional[int]]:
+    """(colección activa, revisión): cambia con cada escritura en la colección activa"""
+    estado = _leer_estado()
+    return estado["activa"], estado.get("revision")
+
+def _resolver_tramites(ids: List[str], metadatas: Optional[List[Optional[Dict]]] = None) -> List[Optional[Dict]]:
     """
-    Busca trámites similares a la consulta
+    Trámites de la colección activa a partir de sus ids, desde el payload store.
+    Las colecciones anteriores al payload store guardaban el JSON en la metadata.
+    """
+    coleccion, revision = _version_activa()
+    payloads = obtener_payloads(coleccion, ids, version=(coleccion, revision))
+    metadatas = metadatas or [None] * len(ids)
+    
+    tramites = []
+    for tramite_id, metadata in zip(ids, metadatas):
+        tramite = payloads.get(tramite_id)
+        if tramite is None and metadata and 'json_data' in metadata:
+            tramite = json.loads(metadata['json_data'])
+        tramites.append(tramite)
+    return tramites
+
+def _buscar_chroma(query_embedding: List[float], n_results: int) -> List[Tuple[Dict, float]]:
+    collection = get_or_create_collection()
+    results = collection.query(
+        query_embeddings=[query_embedding],
+        n_results=n_results,
+        include=["distances", "metadatas"]
+    )
+    
+    if not results['ids'] or not results['ids'][0]:
+        return []
+    
+    tramites = _resolver_tramites(results['ids'][0], results['metadatas'][0])
+    return [
+        (tramite, distancia)
+        for tramite, distancia in zip(tramites, results['distances'][0])
+        if tramite
+    ]
+
+def _cargar_coleccion_activa() -> Tuple[List[List[float]], List[Dict]]:
+    """Embeddings y trámites de la colección activa, para el índice en memoria"""
+    results = get_or_create_collection().get(include=["embeddings", "metadatas"])
+    tramites = _resolver_tramites(results['ids'], results['metadatas'])
+    
+    embeddings, encontrados = [], []
+    for embedding, tramite in zip(results['embeddings'] or [], tramites):
+        if tramite:
+            embeddings.append(embedding)
+            encontrados.append(tramite)
+    return embeddings, encontrados
+
+def _buscar_numpy(query_embedding: List[float], n_results: int) -> List[Tuple[Dict, float]]:
+    return numpy_index.buscar(query_embedding, n_results, _version_activa(), _cargar_coleccion_activa)
+
+def search_tramites_con_distancia(query: str, n_results: int = 3, distance_threshold: float = 1.0) -> List[Tuple[Dict, float]]:
+    """
+    Busca trámites similares a la consulta y devuelve también su distancia
     
     Args:
         query: Consulta del usuario
@@ -99,33 +374,26 @@ def search_tramites(query: str, n_results: int = 3, distance_threshold: float =
                            Si la distancia > threshold, se descarta el resultado
     
     Returns:
-        Lista de trámites relevantes (como dicts)
+        Lista de tuplas (trámite, distancia), de más a menos relevante
     """
     try:
-        collection = get_or_create_collection()
+        # Embeber la consulta junto con las que lleguen al mismo tiempo
+        query_embedding = embedding_batcher.embed(query)
         
-        # Buscar en ChromaDB (ChromaDB embebe el query automáticamente)
-        results = collection.query(
-            query_texts=[query],
-            n_results=n_results
-        )
+        if SEARCH_ENGINE == "numpy":
+            resultados = _buscar_numpy(query_embedding, n_results)
+        else:
+            resultados = _buscar_chroma(query_embedding, n_results)
         
-        # Parsear resultados y filtrar por relevancia
+        # Filtrar resultados poco relevantes
         tramites = []
-        if results['metadatas'] and results['metadatas'][0] and results['distances']:
-            for i, metadata in enumerate(results['metadatas'][0]):
-                distance = results['distances'][0][i]
-                
-                # Filtrar resultados poco relevantes
-                if distance > distance_threshold:
-                    print(f"⚠️ Resultado descartado por baja relevancia: {metadata.get('titulo', 'N/A')} (distancia: {distance:.2f})")
-                    continue
-                
-                # Recuperar el JSON completo desde metadata
-                if 'json_data' in metadata:
-                    tramite = json.loads(metadata['json_data'])
-                    print(f"✅ Resultado relevante: {tramite['titulo']} (distancia: {distance:.2f})")
-                    tramites.append(tramite)
+        for tramite, distance in resultados:
+            if distance > distance_threshold:
+                print(f"⚠️ Resultado descartado por baja relevancia: {tramite.get('titulo', 'N/A')} (distancia: {distance:.2f})")
+                continue
+            
+            print(f"✅ Resultado relevante: {tramite['titulo']} (distancia: {distance:.2f})")
+            tramites.append((tramite, distance))
         
         return tramites
         
@@ -135,6 +403,20 @@ def search_tramites(query: str, n_results: int = 3, distance_threshold: float =
         traceback.print_exc()
         return []
 
+def search_tramites(query: str, n_results: int = 3, distance_threshold: float = 1.0) -> List[Dict]:
+    """
+    Busca trámites similares a la consulta
+    
+    Args:
+        query: Consulta del usuario
+        n_results: Cantidad de resultados a retornar
+        distance_threshold: Umbral de distancia (mayor = más permisivo)
+    
+    Returns:
+        Lista de trámites relevantes (como dicts)
+    """
+    return [tramite for tramite, _ in search_tramites_con_distancia(query, n_results, distance_threshold)]
+
 def delete_tramite(tramite_id: str) -> bool:
     try:
         collection = get_or_create_collection()
@@ -146,6 +428,9 @@ def delete_tramite(tramite_id: str) -> bool:
             return False
         
         collection.delete(ids=[tramite_id])
+        eliminar_payloads(collection.name, [tramite_id])
+        _marcar_cambio(collection.name)
+        answer_cache.invalidate_tramite(tramite_id)
         print(f"✅ Trámite '{tramite_id}' eliminado de ChromaDB")
         return True
     except Exception as e:
@@ -154,6 +439,36 @@ def delete_tramite(tramite_id: str) -> bool:
         traceback.print_exc()
         return False
 
+def delete_tramites(tramite_ids: List[str]) -> int:
+    """
+    Elimina varios trámites de la colección activa en una sola operación
+    
+    Returns:
+        int: Cantidad de trámites eliminados
+    """
+    if not tramite_ids:
+        return 0
+    
+    try:
+        collection = get_or_create_collection()
+        existentes = collection.get(ids=tramite_ids, include=[])['ids']
+        if not existentes:
+            return 0
+        
+        collection.delete(ids=existentes)
+        eliminar_payloads(collection.name, existentes)
+        _marcar_cambio(collection.name)
+        for tramite_id in existentes:
+            answer_cache.invalidate_tramite(tramite_id)
+        
+        print(f"✅ {len(existentes)} trámites eliminados de ChromaDB")
+        return len(existentes)
+    except Exception as e:
+        print(f"❌ Error eliminando trámites: {e}")
+        import traceback
+        traceback.print_exc()
+        return 0
+
 def get_collection_count() -> int:
     try:
         collection = get_or_create_collection()
@@ -162,6 +477,59 @@ def get_collection_count() -> int:
         print(f"❌ Error obteniendo count: {e}")
         return 0
 
+def _iterar_coleccion(collection) -> Iterator[Dict]:
+    """Todos los trámites de la colección, de a lotes (payload store o, en las colecciones viejas, metadata)"""
+    ids = collection.get(include=[])['ids']
+    vistos = set()
+    for tramite in iterar_payloads(collection.name, ids):
+        vistos.add(tramite["id"])
+        yield tramite
+    
+    faltantes = [tramite_id for tramite_id in ids if tramite_id not in vistos]
+    for inicio in range(0, len(faltantes), VECTOR_STORE_BATCH_SIZE):
+        lote = collection.get(ids=faltantes[inicio:inicio + VECTOR_STORE_BATCH_SIZE], include=["metadatas"])
+        for metadata in lote['metadatas']:
+            if metadata and 'json_data' in metadata:
+                yield json.loads(metadata['json_data'])
+
+def iterar_tramites() -> Iterator[Dict]:
+    """Recorre los trámites de la colección activa sin cargarlos todos a la vez"""
+    return _iterar_coleccion(get_or_create_collection())
+
+def get_indice_tramites() -> Dict[str, Dict]:
+    """
+    Lo mínimo de cada trámite de la colección activa para saber si cambió al
+    volver a scrapearlo, sin tener el catálogo completo en memoria
+    
+    Returns:
+        Dict id -> {"id", "metadata": {"hash_contenido", "keywords"}}
+    """
+    try:
+        indice = {}
+        for tramite in _iterar_coleccion(get_or_create_collection()):
+            metadata = tramite.get("metadata", {})
+            indice[tramite["id"]] = {
+                "id": tramite["id"],
+                "metadata": {
+                    "hash_contenido": metadata.get("hash_contenido"),
+                    "keywords": metadata.get("keywords", []),
+                },
+            }
+        print(f"✅ Índice de {len(indice)} trámites recuperado")
+        return indice
+    except Exception as e:
+        print(f"❌ Error obteniendo el índice de trámites: {e}")
+        return {}
+
+def get_tramites_por_id(ids: List[str]) -> Dict[str, Dict]:
+    """Trámites completos de la colección activa por id (compartidos: no modificarlos)"""
+    resultados = get_or_create_collection().get(ids=ids, include=["metadatas"])
+    return {
+        tramite["id"]: tramite
+        for tramite in _resolver_tramites(resultados['ids'], resultados['metadatas'])
+        if tramite
+    }
+
 def get_all_tramites() -> List[Dict]:
     """
     Obtiene todos los trámites almacenados en ChromaDB
@@ -172,15 +540,13 @@ def get_all_tramites() -> List[Dict]:
     try:
         collection = get_or_create_collection()
         
-        # Obtener todos los documentos sin filtros
-        results = collection.get()
+        # Obtener todos los ids sin filtros y resolverlos en el payload store
+        results = collection.get(include=["metadatas"])
         
-        tramites = []
-        if results['metadatas']:
-            for metadata in results['metadatas']:
-                # Recuperar el JSON completo desde metadata
-                if 'json_data' in metadata:
-                    tramites.append(json.loads(metadata['json_data']))
+        tramites = [
+            tramite for tramite in _resolver_tramites(results['ids'], results['metadatas'])
+            if tramite
+        ]
         
         print(f"✅ Recuperados {len(tramites)} trámites de ChromaDB")
         return tramites
@@ -52,29 +52,40 @@ function AdminProcedure() {
 
         const token = localStorage.getItem("access_token");
 
+        const headers = {
+          Authorization: `Bearer ${token}`,
+          "Content-Type": "application/json",
+        };
+
+        // El scraping corre en segundo plano: se lanza el job y se consulta su estado
         const response = await axios.post(
           "http://localhost:8000/admin/scrape-all",
           {},
-          {
-            headers: {
-              Authorization: `Bearer ${token}`,
-              "Content-Type": "application/json",
-            },
-            timeout: 300000, // 5 minutos timeout
-          }
+          { headers }
         );
 
-        if (response.data.success) {
+        let job;
+        do {
+          await new Promise((resolve) => setTimeout(resolve, 3000));
+          const jobResponse = await axios.get(
+            `http://localhost:8000/admin/jobs/${response.data.job_id}`,
+            { headers }
+          );
+          job = jobResponse.data;
+        } while (job.estado === "pendiente" || job.estado === "en_curso");
+
+        if (job.estado === "completado" && job.resultado?.success) {
           // Recargar lista de trámites
           const tramitesResponse = await getTramitesList(token);
           setTramites(tramitesResponse.tramites);
 
           alert(
-            `Sincronización exitosa: ${response.data.inserted_to_db} trámites procesados`
+            `Sincronización exitosa: ${job.resultado.inserted_to_db} trámites procesados`
           );
         } else {
           setError(
-            "Error en la sincronización: " + response.data.errors.join(", ")
+            "Error en la sincronización: " +
+              (job.error || (job.resultado?.errors?.join(", ") ?? job.estado))
           );
         }
       } catch (err) {